@@ -0,0 +1,202 @@
+"""Throughput benchmark of the H5 and TIFF to OME-Zarr converters.
+
+Synthetic volumes are generated for every combination of format, size, dtype
+and layout, and converted end to end with `convert_h5_to_ome_zarr` and
+`convert_tiff_to_ome_zarr`. For each case the benchmark reports the
+throughput (MB/s of input data), the peak resident memory of the conversion,
+and the time spent in each phase of the conversion, as recorded by
+`record_phase_timings` during the same run:
+
+- read: loading the source file, or reading its slabs when streaming,
+- level_0_write: writing the full resolution level,
+- pyramid: computing and writing the lower resolution levels.
+
+The converters interleave the phases slab by slab, and the image and its
+label are written concurrently, so the sum of the phases is not the end to
+end time. Each case runs in a fresh process, so that the peak memory of a
+case is not inflated by the previous ones.
+
+Usage:
+    python benchmarks/benchmark_converters.py --output results.json
+    python benchmarks/benchmark_converters.py --sizes small --formats h5 \
+        --dtypes uint8 --layouts ZYX CZYX --streaming
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from importlib.metadata import PackageNotFoundError, version
+from itertools import product
+from pathlib import Path
+from typing import Any
+
+import h5py
+import numpy as np
+import tifffile
+
+from plantseg_tasks.convert_h5_to_ome_zarr import convert_h5_to_ome_zarr
+from plantseg_tasks.convert_tiff_to_ome_zarr import convert_tiff_to_ome_zarr
+from plantseg_tasks.task_utils.converter_input_models import OMEZarrBuilderParams
+from plantseg_tasks.task_utils.io import record_phase_timings
+
+# (Z, Y, X) shape of the synthetic volumes
+SIZES = {
+    "small": (32, 256, 256),
+    "medium": (64, 512, 512),
+    "large": (128, 1024, 1024),
+}
+DTYPES = ["uint8", "uint16", "float32"]
+FORMATS = ["h5", "tiff"]
+NUM_CHANNELS = 2
+
+
+def layout_shape(layout: str, zyx_shape: tuple[int, int, int]) -> tuple[int, ...]:
+    """Shape of a synthetic volume in the given layout."""
+    axes_size = dict(zip("zyx", zyx_shape), c=NUM_CHANNELS, t=1)
+    return tuple(axes_size[ax] for ax in layout.lower())
+
+
+def synthetic_volume(shape: tuple[int, ...], dtype: str, seed: int = 0) -> np.ndarray:
+    """A smooth ramp plus noise, so that it compresses like a real image."""
+    rng = np.random.default_rng(seed)
+    ramp = np.indices(shape).sum(axis=0) % 200
+    noise = rng.integers(0, 50, size=shape)
+    return (ramp + noise).astype(dtype)
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident memory of the current process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / 1024**2 if sys.platform == "darwin" else peak / 1024
+
+
+def _convert(case: dict[str, Any], zarr_dir: str) -> str:
+    kwargs = {
+        "zarr_urls": [],
+        "zarr_dir": zarr_dir,
+        "image_layout": case["layout"],
+        "ome_zarr_parameters": OMEZarrBuilderParams(
+            number_multiscale=case["num_levels"]
+        ),
+        "streaming": case["streaming"],
+        "resume": False,
+    }
+    if case["format"] == "h5":
+        result = convert_h5_to_ome_zarr(
+            input_path=case["path"], image_key="raw", **kwargs
+        )
+    else:
+        result = convert_tiff_to_ome_zarr(image_path=case["path"], **kwargs)
+    return result["image_list_updates"][0]["zarr_url"]
+
+
+def run_case(case: dict[str, Any]) -> dict[str, Any]:
+    """Run a single benchmark case, meant to be called in a fresh process."""
+    with tempfile.TemporaryDirectory(dir=case["workdir"]) as tmp_dir:
+        baseline_rss_mb = _peak_rss_mb()
+        with record_phase_timings() as phases:
+            start = time.perf_counter()
+            _convert(case, zarr_dir=tmp_dir)
+            total_time = time.perf_counter() - start
+        peak_rss_mb = _peak_rss_mb()
+
+    input_mb = case["nbytes"] / 1024**2
+    return {
+        "total_time_s": total_time,
+        "throughput_mbs": input_mb / total_time,
+        "input_mb": input_mb,
+        "baseline_rss_mb": baseline_rss_mb,
+        "peak_rss_mb": peak_rss_mb,
+        "phases_s": phases,
+    }
+
+
+def write_input(case: dict[str, Any], workdir: Path) -> dict[str, Any]:
+    """Write the synthetic input file of a case."""
+    shape = layout_shape(case["layout"], SIZES[case["size"]])
+    data = synthetic_volume(shape, case["dtype"])
+    name = f"{case['size']}_{case['dtype']}_{case['layout']}"
+    if case["format"] == "h5":
+        path = workdir / f"{name}.h5"
+        with h5py.File(path, "w") as f:
+            f.create_dataset("raw", data=data, chunks=True)
+            f["raw"].attrs["element_size_um"] = (1.0, 0.5, 0.5)
+    else:
+        path = workdir / f"{name}.tiff"
+        tifffile.imwrite(path, data)
+    return {**case, "path": str(path), "shape": shape, "nbytes": data.nbytes}
+
+
+def _package_version() -> str:
+    try:
+        return version("fractal-plantseg-tasks")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def main() -> None:
+    """Run the benchmark suite and save the results as JSON."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--formats", nargs="+", default=FORMATS, choices=FORMATS)
+    parser.add_argument(
+        "--sizes", nargs="+", default=["small", "medium"], choices=list(SIZES)
+    )
+    parser.add_argument("--dtypes", nargs="+", default=DTYPES)
+    parser.add_argument(
+        "--layouts", nargs="+", default=["ZYX", "CZYX", "ZCYX", "TCZYX"]
+    )
+    parser.add_argument("--num-levels", type=int, default=4)
+    parser.add_argument("--streaming", action="store_true")
+    parser.add_argument("--workdir", default=None, help="Scratch directory.")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    results = []
+    # "spawn" gives every case a fresh process to measure its peak memory
+    mp_context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for fmt, size, dtype, layout in product(
+            args.formats, args.sizes, args.dtypes, args.layouts
+        ):
+            case = {
+                "format": fmt,
+                "size": size,
+                "dtype": dtype,
+                "layout": layout,
+                "num_levels": args.num_levels,
+                "streaming": args.streaming,
+                "workdir": workdir,
+            }
+            case = write_input(case, Path(workdir))
+            with ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as pool:
+                metrics = pool.submit(run_case, case).result()
+
+            case = {k: v for k, v in case.items() if k not in ("path", "workdir")}
+            results.append({**case, **metrics})
+            print(
+                f"{fmt:>4} {size:>6} {dtype:>7} {layout:>5}: "
+                f"{metrics['throughput_mbs']:8.1f} MB/s, "
+                f"peak RSS {metrics['peak_rss_mb']:8.1f} MB"
+            )
+
+    report = {
+        "version": _package_version(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
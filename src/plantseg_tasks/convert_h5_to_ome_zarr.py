@@ -1,11 +1,14 @@
 """This task converts simple H5 files to OME-Zarr."""
 
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Optional
 
 from fractal_tasks_core.utils import logger
 from pydantic import Field, validate_call
 
+from plantseg_tasks.task_utils.batch import run_batch_conversion
+from plantseg_tasks.task_utils.conversion_manifest import ConversionManifest
 from plantseg_tasks.task_utils.converter_input_models import (
     ALLOWED_H5_EXTENSIONS,
     VALID_IMAGE_LAYOUT,
@@ -16,13 +19,54 @@ from plantseg_tasks.task_utils.io import (
     correct_image_metadata,
     create_ome_zarr,
     load_h5_images,
+    open_h5_images,
 )
 
 
+def find_h5_files(input_path: str) -> list[Path]:
+    """Find the H5 files to convert.
+
+    Args:
+        input_path (str): Input path to the H5 file, or a folder containing H5 files.
+
+    Returns:
+        The sorted list of H5 files to convert.
+    """
+    if not Path(input_path).exists():
+        raise ValueError("Input path does not exist.")
+
+    if Path(input_path).is_dir():
+        files = []
+        for ext in ALLOWED_H5_EXTENSIONS:
+            files += list(Path(input_path).glob(f"*{ext}"))
+
+        if len(files) == 0:
+            raise ValueError(f"Folder {input_path} does not contain any H5 files.")
+
+        logger.info(
+            f"Converting from directory: {input_path}. Found {len(files)} H5 files."
+        )
+
+    elif (
+        Path(input_path).is_file() and Path(input_path).suffix in ALLOWED_H5_EXTENSIONS
+    ):
+        files = [Path(input_path)]
+        logger.info(f"Converting from file: {input_path}")
+
+    else:
+        raise ValueError(
+            f"Input path {input_path} must be a H5 file or a folder. "
+            f"Allowed extensions are {ALLOWED_H5_EXTENSIONS}."
+        )
+
+    return sorted(files)
+
+
 def convert_single_h5_to_ome(
     zarr_dir: str,
     input_path: str,
     image_key: str = "raw",
+    channel_keys: Optional[list[str]] = None,
     image_layout: VALID_IMAGE_LAYOUT = "ZYX",
     label_key: Optional[str] = None,
     new_image_key: Optional[str] = None,
@@ -33,6 +77,8 @@ def convert_single_h5_to_ome(
     ome_zarr_parameters: OMEZarrBuilderParams = Field(
         title="OME-Zarr Parameters", default=OMEZarrBuilderParams()
     ),
+    streaming: bool = False,
+    resume: bool = False,
 ):
     """H5 to OME-Zarr converter task.
 
@@ -40,6 +86,11 @@ def convert_single_h5_to_ome(
         zarr_dir (str): Output path to save the OME-Zarr file.
         input_path (str): Input path to the H5 file, or a folder containing H5 files.
         image_key (str): The image key in the H5 file where the image is stored.
+        channel_keys (Optional[list[str]]): Keys of additional images in the H5
+            file, converted as further channels of the image at `image_key`
+            into a single multichannel (CZYX) OME-Zarr. The channels are read
+            lazily and never stacked in memory. The channels are named after
+            the keys, unless `custom_axis` has matching channel names.
         image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
             Must be one of 'ZYX', 'YX', 'XY', 'CZYX', 'ZCYX'.
         label_key (Optional[str]): The label key in the H5 file
@@ -52,28 +103,41 @@ def convert_single_h5_to_ome(
             This field will override the default axes resolution and units found in the
             H5 file.
         ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr builder.
+        streaming (bool): If True, the H5 datasets are not loaded in memory,
+            but streamed slab by slab into the OME-Zarr. The peak memory is
+            then bounded by `ome_zarr_parameters.max_slab_size_mb`
+            instead of by the size of the image.
+        resume (bool): If True, the existing OME-Zarr is not overwritten, and
+            an interrupted conversion is resumed from the last slab written.
 
     """
-    image_ds = load_h5_images(
-        input_path=input_path,
-        image_key=image_key,
-        label_key=label_key,
-        image_layout=image_layout,
-        new_image_key=new_image_key,
-        new_label_key=new_label_key,
-    )
-    logger.info(f"Loaded image from {input_path}")
-
-    zarr_url = Path(zarr_dir) / f"{Path(input_path).stem}.zarr"
-    image_ds = correct_image_metadata(image_ds, custom_axis=custom_axis)
-    logger.info(f"Corrected metadata for {input_path}")
-    return create_ome_zarr(
-        zarr_url=zarr_url,
-        path=image_ds.image_key,
-        name=image_ds.image_key,
-        image=image_ds,
-        omezarr_params=ome_zarr_parameters,
-    )
+    load_kwargs = {
+        "input_path": input_path,
+        "image_key": [image_key, *channel_keys] if channel_keys else image_key,
+        "label_key": label_key,
+        "image_layout": image_layout,
+        "new_image_key": new_image_key,
+        "new_label_key": new_label_key,
+    }
+    if streaming:
+        image_context = open_h5_images(**load_kwargs)
+    else:
+        image_context = nullcontext(load_h5_images(**load_kwargs))
+
+    with image_context as image_ds:
+        logger.info(f"Loaded image from {input_path} (streaming={streaming})")
+
+        zarr_url = Path(zarr_dir) / f"{Path(input_path).stem}.zarr"
+        image_ds = correct_image_metadata(image_ds, custom_axis=custom_axis)
+        logger.info(f"Corrected metadata for {input_path}")
+        return create_ome_zarr(
+            zarr_url=zarr_url,
+            path=image_ds.image_key,
+            name=image_ds.image_key,
+            image=image_ds,
+            omezarr_params=ome_zarr_parameters,
+            resume=resume,
+        )
 
 
 @validate_call
@@ -82,6 +146,7 @@ def convert_h5_to_ome_zarr(
     zarr_dir: str,
     input_path: str,
     image_key: str = "raw",
+    channel_keys: Optional[list[str]] = None,
     image_layout: VALID_IMAGE_LAYOUT = "ZYX",
     label_key: Optional[str] = None,
     new_image_key: Optional[str] = None,
@@ -92,6 +157,9 @@ def convert_h5_to_ome_zarr(
     ome_zarr_parameters: OMEZarrBuilderParams = Field(
         title="OME-Zarr Parameters", default=OMEZarrBuilderParams()
     ),
+    streaming: bool = False,
+    num_workers: int = 1,
+    resume: bool = False,
 ):
     """H5 to OME-Zarr converter task.
 
@@ -101,6 +169,11 @@ def convert_h5_to_ome_zarr(
         zarr_dir (str): Output path to save the OME-Zarr file.
         input_path (str): Input path to the H5 file, or a folder containing H5 files.
         image_key (str): The image key in the H5 file where the image is stored.
+        channel_keys (Optional[list[str]]): Keys of additional images in the H5
+            file, converted as further channels of the image at `image_key`
+            into a single multichannel (CZYX) OME-Zarr. The channels are read
+            lazily and never stacked in memory. The channels are named after
+            the keys, unless `custom_axis` has matching channel names.
         image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
             Must be one of 'ZYX', 'YX', 'XY', 'CZYX', 'ZCYX'.
         label_key (Optional[str]): The label key in the H5 file
@@ -113,51 +186,55 @@ def convert_h5_to_ome_zarr(
             This field will override the default axes resolution and units found in the
             H5 file.
         ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr builder.
+        streaming (bool): If True, the H5 datasets are not loaded in memory,
+            but streamed slab by slab into the OME-Zarr. The peak memory is
+            then bounded by `ome_zarr_parameters.max_slab_size_mb`
+            instead of by the size of the image.
+        num_workers (int): Number of processes used to convert the H5 files
+            when `input_path` is a folder. Files that fail to convert are
+            reported in the logs without stopping the rest of the batch.
+        resume (bool): If True, the files already converted to `zarr_dir`
+            with the same parameters (and unchanged since) are skipped, and
+            the conversions interrupted by a previous run are resumed from
+            the last slab written. The conversions are tracked in a manifest
+            file in `zarr_dir`. If False (the default), all the files are
+            converted again and existing OME-Zarrs are overwritten.
 
     """
-    if not Path(input_path).exists():
-        raise ValueError("Input path does not exist.")
+    files = find_h5_files(input_path)
 
-    if Path(input_path).is_dir():
-        files = []
-        for ext in ALLOWED_H5_EXTENSIONS:
-            files += list(Path(input_path).glob(f"*{ext}"))
-
-        if len(files) == 0:
-            raise ValueError(f"Folder {input_path} does not contain any H5 files.")
-
-        logger.info(
-            f"Converting from directory: {input_path}. Found {len(files)} H5 files."
-        )
+    Path(zarr_dir).mkdir(parents=True, exist_ok=True)
+    new_zarr_urls = run_batch_conversion(
+        convert_single_h5_to_ome,
+        input_arg="input_path",
+        inputs=files,
+        num_workers=num_workers,
+        manifest=ConversionManifest(zarr_dir),
+        resume=resume,
+        zarr_dir=zarr_dir,
+        image_key=image_key,
+        channel_keys=channel_keys,
+        image_layout=image_layout,
+        label_key=label_key,
+        new_image_key=new_image_key,
+        new_label_key=new_label_key,
+        custom_axis=custom_axis,
+        ome_zarr_parameters=ome_zarr_parameters,
+        streaming=streaming,
+    )
 
-    elif (
-        Path(input_path).is_file() and Path(input_path).suffix in ALLOWED_H5_EXTENSIONS
-    ):
-        files = [Path(input_path)]
-        logger.info(f"Converting from file: {input_path}")
+    if VALID_IMAGE_LAYOUT(image_layout) in [
+        VALID_IMAGE_LAYOUT.CYX,
+        VALID_IMAGE_LAYOUT.YX,
+    ]:
+        is_3d = False
+    else:
+        is_3d = True
 
-    Path(zarr_dir).mkdir(parents=True, exist_ok=True)
     image_list_updates = []
-    for file in files:
-        new_zarr_url = convert_single_h5_to_ome(
-            zarr_dir=zarr_dir,
-            input_path=str(file),
-            image_key=image_key,
-            image_layout=image_layout,
-            label_key=label_key,
-            new_image_key=new_image_key,
-            new_label_key=new_label_key,
-            custom_axis=custom_axis,
-            ome_zarr_parameters=ome_zarr_parameters,
-        )
-
-        if VALID_IMAGE_LAYOUT(image_layout) in [
-            VALID_IMAGE_LAYOUT.CYX,
-            VALID_IMAGE_LAYOUT.YX,
-        ]:
-            is_3d = False
-        else:
-            is_3d = True
+    for file, new_zarr_url in zip(files, new_zarr_urls):
+        if new_zarr_url is None:
+            continue
 
         logger.info(f"Succesfully converted {file} to {new_zarr_url}")
         image_update = {"zarr_url": new_zarr_url, "types": {"is_3D": is_3d}}
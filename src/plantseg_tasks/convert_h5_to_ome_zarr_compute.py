@@ -0,0 +1,65 @@
+"""Compute task of the compound H5 to OME-Zarr converter."""
+
+from pathlib import Path
+from typing import Any
+
+from fractal_tasks_core.utils import logger
+from pydantic import validate_call
+
+from plantseg_tasks.convert_h5_to_ome_zarr import convert_single_h5_to_ome
+from plantseg_tasks.task_utils.converter_input_models import (
+    VALID_IMAGE_LAYOUT,
+    InitArgsH5Converter,
+)
+
+
+@validate_call
+def convert_h5_to_ome_zarr_compute(
+    *,
+    zarr_url: str,
+    init_args: InitArgsH5Converter,
+) -> dict[str, Any]:
+    """H5 to OME-Zarr converter compute task.
+
+    Convert a single H5 file, as prepared by `convert_h5_to_ome_zarr_init`.
+
+    Args:
+        zarr_url (str): URL of the OME-Zarr image to create.
+            (standard argument for Fractal tasks, managed by Fractal server).
+        init_args (InitArgsH5Converter): Intialization arguments provided by
+            `convert_h5_to_ome_zarr_init`.
+    """
+    new_zarr_url = convert_single_h5_to_ome(
+        zarr_dir=init_args.zarr_dir,
+        input_path=init_args.input_path,
+        image_key=init_args.image_key,
+        channel_keys=init_args.channel_keys,
+        image_layout=init_args.image_layout,
+        label_key=init_args.label_key,
+        new_image_key=init_args.new_image_key,
+        new_label_key=init_args.new_label_key,
+        custom_axis=init_args.custom_axis,
+        ome_zarr_parameters=init_args.ome_zarr_parameters,
+        streaming=init_args.streaming,
+    )
+    if Path(new_zarr_url) != Path(zarr_url):
+        raise ValueError(
+            f"The converted image {new_zarr_url} does not match "
+            f"the expected zarr_url {zarr_url}."
+        )
+
+    is_3d = VALID_IMAGE_LAYOUT(init_args.image_layout) not in [
+        VALID_IMAGE_LAYOUT.CYX,
+        VALID_IMAGE_LAYOUT.YX,
+    ]
+    logger.info(f"Succesfully converted {init_args.input_path} to {zarr_url}")
+    return {"image_list_updates": [{"zarr_url": zarr_url, "types": {"is_3D": is_3d}}]}
+
+
+if __name__ == "__main__":
+    from fractal_tasks_core.tasks._utils import run_fractal_task
+
+    run_fractal_task(
+        task_function=convert_h5_to_ome_zarr_compute,
+        logger_name=logger.name,
+    )
@@ -0,0 +1,107 @@
+"""Init task of the compound H5 to OME-Zarr converter."""
+
+from pathlib import Path
+from typing import Any, Optional
+
+from fractal_tasks_core.utils import logger
+from pydantic import Field, validate_call
+
+from plantseg_tasks.convert_h5_to_ome_zarr import find_h5_files
+from plantseg_tasks.task_utils.converter_input_models import (
+    VALID_IMAGE_LAYOUT,
+    CustomAxisInputModel,
+    InitArgsH5Converter,
+    OMEZarrBuilderParams,
+)
+
+
+@validate_call
+def convert_h5_to_ome_zarr_init(
+    *,
+    zarr_urls: list[str],
+    zarr_dir: str,
+    input_path: str,
+    image_key: str = "raw",
+    channel_keys: Optional[list[str]] = None,
+    image_layout: VALID_IMAGE_LAYOUT = "ZYX",
+    label_key: Optional[str] = None,
+    new_image_key: Optional[str] = None,
+    new_label_key: Optional[str] = None,
+    custom_axis: CustomAxisInputModel = Field(
+        title="Custom Axis", default=CustomAxisInputModel()
+    ),
+    ome_zarr_parameters: OMEZarrBuilderParams = Field(
+        title="OME-Zarr Parameters", default=OMEZarrBuilderParams()
+    ),
+    streaming: bool = False,
+) -> dict[str, Any]:
+    """H5 to OME-Zarr converter init task.
+
+    Scan the input path and create a parallelization list with one item
+    per H5 file, each file is then converted by the compute task.
+
+    Args:
+        zarr_urls (list[str]): List of URLs to the OME-Zarr files.
+            Not used in this task.
+        zarr_dir (str): Output path to save the OME-Zarr file.
+        input_path (str): Input path to the H5 file, or a folder containing H5 files.
+        image_key (str): The image key in the H5 file where the image is stored.
+        channel_keys (Optional[list[str]]): Keys of additional images in the H5
+            file, converted as further channels of the image at `image_key`
+            into a single multichannel (CZYX) OME-Zarr. The channels are named
+            after the keys, unless `custom_axis` has matching channel names.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
+            Must be one of 'ZYX', 'YX', 'XY', 'CZYX', 'ZCYX'.
+        label_key (Optional[str]): The label key in the H5 file
+            where a label/segmentation is stored.
+        new_image_key (Optional[str]): New key for the image data to
+            be stored in the OME-Zarr. If not provided, the original key will be used.
+        new_label_key (Optional[str]): New key for the label data to
+            be stored in the OME-Zarr. If not provided, the original key will be used.
+        custom_axis (list[AxisInputModel]): Custom axes to add to the OME-Zarr file.
+            This field will override the default axes resolution and units found in the
+            H5 file.
+        ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr builder.
+        streaming (bool): If True, the H5 datasets are not loaded in memory,
+            but streamed slab by slab into the OME-Zarr. The peak memory is
+            then bounded by `ome_zarr_parameters.max_slab_size_mb`
+            instead of by the size of the image.
+    """
+    files = find_h5_files(input_path)
+    Path(zarr_dir).mkdir(parents=True, exist_ok=True)
+
+    image_path = image_key if new_image_key is None else new_image_key
+    parallelization_list = []
+    for file in files:
+        init_args = InitArgsH5Converter(
+            zarr_dir=zarr_dir,
+            input_path=str(file),
+            image_key=image_key,
+            channel_keys=channel_keys,
+            image_layout=image_layout,
+            label_key=label_key,
+            new_image_key=new_image_key,
+            new_label_key=new_label_key,
+            custom_axis=custom_axis,
+            ome_zarr_parameters=ome_zarr_parameters,
+            streaming=streaming,
+        )
+        zarr_url = Path(zarr_dir) / f"{file.stem}.zarr" / image_path
+        parallelization_list.append(
+            {
+                "zarr_url": str(zarr_url),
+                "init_args": init_args.model_dump(exclude_unset=True),
+            }
+        )
+
+    logger.info(f"Created a parallelization list with {len(files)} H5 files.")
+    return {"parallelization_list": parallelization_list}
+
+
+if __name__ == "__main__":
+    from fractal_tasks_core.tasks._utils import run_fractal_task
+
+    run_fractal_task(
+        task_function=convert_h5_to_ome_zarr_init,
+        logger_name=logger.name,
+    )
@@ -1,11 +1,15 @@
 """This task converts simple H5 files to OME-Zarr."""
 
+import re
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Optional
 
 from fractal_tasks_core.utils import logger
 from pydantic import Field, validate_call
 
+from plantseg_tasks.task_utils.batch import run_batch_conversion
+from plantseg_tasks.task_utils.conversion_manifest import ConversionManifest
 from plantseg_tasks.task_utils.converter_input_models import (
     ALLOWED_TIFF_EXTENSIONS,
     VALID_IMAGE_LAYOUT,
@@ -16,8 +20,156 @@ from plantseg_tasks.task_utils.io import (
     correct_image_metadata,
     create_ome_zarr,
     load_tiff_images,
+    open_tiff_images,
+    open_tiff_stack_images,
 )
 
+DEFAULT_SLICE_PATTERN = r"(\d+)\D*$"
+
+
+def find_tiff_files(image_path: str, label_path: Optional[str] = None) -> list[Path]:
+    """Find the TIFF files to convert.
+
+    Args:
+        image_path (str): Input path to the TIFF file,
+            or a folder containing TIFF files.
+        label_path (Optional[str]): Input path to the label TIFF file.
+            Must be None if `image_path` is a folder.
+
+    Returns:
+        The sorted list of TIFF files to convert.
+    """
+    if not Path(image_path).exists():
+        raise ValueError(f"Input path {image_path} does not exist.")
+
+    if label_path is not None and not Path(label_path).exists():
+        raise ValueError(f"Label path {label_path} does not exist.")
+
+    if Path(image_path).is_dir() and label_path is None:
+        files = []
+        for ext in ALLOWED_TIFF_EXTENSIONS:
+            files += list(Path(image_path).glob(f"*{ext}"))
+    elif Path(image_path).is_dir() and label_path is not None:
+        raise NotImplementedError(
+            "Label path must be None if image path is a folder. "
+            "Batch conversion is not yet supported."
+        )
+    elif (
+        Path(image_path).is_file()
+        and Path(image_path).suffix in ALLOWED_TIFF_EXTENSIONS
+    ):
+        files = [Path(image_path)]
+    else:
+        raise ValueError(
+            f"Input path {image_path} must be a TIFF file or a folder. "
+            f"Allowed extensions are {ALLOWED_TIFF_EXTENSIONS}."
+        )
+
+    return sorted(files)
+
+
+def find_tiff_slices(
+    folder: str, slice_pattern: str = DEFAULT_SLICE_PATTERN
+) -> list[Path]:
+    """Find the TIFF slices of a stack, sorted along Z.
+
+    Args:
+        folder (str): Folder containing one TIFF file per Z plane.
+        slice_pattern (str): Regular expression searched in the file name
+            (without extension), its first group is the Z index of the slice.
+
+    Returns:
+        The list of TIFF slices, sorted by their Z index.
+    """
+    if not Path(folder).is_dir():
+        raise ValueError(f"Slices path {folder} must be a folder.")
+
+    files = []
+    for ext in ALLOWED_TIFF_EXTENSIONS:
+        files += list(Path(folder).glob(f"*{ext}"))
+    if len(files) == 0:
+        raise ValueError(f"Folder {folder} does not contain any TIFF files.")
+
+    indexed_files = {}
+    for file in files:
+        match = re.search(slice_pattern, file.stem)
+        if match is None:
+            raise ValueError(
+                f"File name {file.name} does not match the pattern {slice_pattern}."
+            )
+        z_index = int(match.group(1))
+        if z_index in indexed_files:
+            raise ValueError(
+                f"Files {indexed_files[z_index].name} and {file.name} "
+                f"have the same Z index {z_index}."
+            )
+        indexed_files[z_index] = file
+
+    logger.info(f"Found {len(files)} TIFF slices in {folder}.")
+    return [indexed_files[z_index] for z_index in sorted(indexed_files)]
+
+
+def convert_tiff_stack_to_ome_zarr(
+    zarr_dir: str,
+    image_path: str,
+    image_layout: VALID_IMAGE_LAYOUT = "ZYX",
+    label_path: Optional[str] = None,
+    new_image_key: str = "raw",
+    new_label_key: str = "label",
+    custom_axis: CustomAxisInputModel = Field(
+        title="Custom Axis", default_factory=CustomAxisInputModel
+    ),
+    ome_zarr_parameters: OMEZarrBuilderParams = Field(
+        title="OME-Zarr Parameters", default_factory=OMEZarrBuilderParams
+    ),
+    slice_pattern: str = DEFAULT_SLICE_PATTERN,
+    num_workers: int = 1,
+) -> str:
+    """Convert a folder of TIFF slices (one per Z plane) into a single OME-Zarr.
+
+    The slices are always streamed, only the slices of the slab being
+    written are decoded (`num_workers` at a time) and held in memory.
+
+    Args:
+        zarr_dir (str): Output path to save the OME-Zarr file.
+        image_path (str): Folder containing the image slices.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the stacked image,
+            e.g. "ZYX" for 2D slices.
+        label_path (Optional[str]): Folder containing the label slices,
+            sorted with the same pattern as the image slices.
+        new_image_key (str): New key for the image data to
+            be stored in the OME-Zarr.
+        new_label_key (str): New key for the label data to
+            be stored in the OME-Zarr.
+        custom_axis (list[AxisInputModel]): Custom axes to add to the OME-Zarr file.
+        ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr builder.
+        slice_pattern (str): Regular expression matching the Z index of a slice
+            in its file name.
+        num_workers (int): Number of slices decoded in parallel.
+    """
+    image_slices = find_tiff_slices(image_path, slice_pattern=slice_pattern)
+    label_slices = None
+    if label_path is not None:
+        label_slices = find_tiff_slices(label_path, slice_pattern=slice_pattern)
+
+    with open_tiff_stack_images(
+        image_slices=image_slices,
+        label_slices=label_slices,
+        new_image_key=new_image_key,
+        new_label_key=new_label_key,
+        image_layout=image_layout,
+        num_workers=num_workers,
+    ) as image_ds:
+        zarr_url = Path(zarr_dir) / f"{Path(image_path).name}.zarr"
+        image_ds = correct_image_metadata(image_ds, custom_axis=custom_axis)
+        return create_ome_zarr(
+            zarr_url=zarr_url,
+            path=image_ds.image_key,
+            name=image_ds.image_key,
+            image=image_ds,
+            omezarr_params=ome_zarr_parameters,
+        )
+
 
 def convert_single_tiff_to_ome_zarr(
     zarr_dir: str,
@@ -32,6 +184,8 @@ def convert_single_tiff_to_ome_zarr(
     ome_zarr_parameters: OMEZarrBuilderParams = Field(
         title="OME-Zarr Parameters", default_factory=OMEZarrBuilderParams
     ),
+    streaming: bool = False,
+    resume: bool = False,
 ) -> str:
     """TIFF to OME-Zarr converter task.
 
@@ -50,24 +204,37 @@ def convert_single_tiff_to_ome_zarr(
             This field will override the default axes resolution and units found in the
             TIFF file.
         ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr builder.
+        streaming (bool): If True, the TIFF files are not loaded in memory,
+            but memory-mapped (uncompressed files) or decoded page by page
+            (compressed files) while being written into the OME-Zarr. The peak
+            memory is then bounded by `ome_zarr_parameters.max_slab_size_mb`
+            instead of by the size of the image.
+        resume (bool): If True, the existing OME-Zarr is not overwritten, and
+            an interrupted conversion is resumed from the last slab written.
     """
-    image_ds = load_tiff_images(
-        image_path=image_path,
-        label_path=label_path,
-        new_image_key=new_image_key,
-        new_label_key=new_label_key,
-        image_layout=image_layout,
-    )
+    load_kwargs = {
+        "image_path": image_path,
+        "label_path": label_path,
+        "new_image_key": new_image_key,
+        "new_label_key": new_label_key,
+        "image_layout": image_layout,
+    }
+    if streaming:
+        image_context = open_tiff_images(**load_kwargs)
+    else:
+        image_context = nullcontext(load_tiff_images(**load_kwargs))
 
-    zarr_url = Path(zarr_dir) / f"{Path(image_path).stem}.zarr"
-    image_ds = correct_image_metadata(image_ds, custom_axis=custom_axis)
-    return create_ome_zarr(
-        zarr_url=zarr_url,
-        path=image_ds.image_key,
-        name=image_ds.image_key,
-        image=image_ds,
-        omezarr_params=ome_zarr_parameters,
-    )
+    with image_context as image_ds:
+        zarr_url = Path(zarr_dir) / f"{Path(image_path).stem}.zarr"
+        image_ds = correct_image_metadata(image_ds, custom_axis=custom_axis)
+        return create_ome_zarr(
+            zarr_url=zarr_url,
+            path=image_ds.image_key,
+            name=image_ds.image_key,
+            image=image_ds,
+            omezarr_params=ome_zarr_parameters,
+            resume=resume,
+        )
 
 
 @validate_call
@@ -85,6 +252,11 @@ def convert_tiff_to_ome_zarr(
     ome_zarr_parameters: OMEZarrBuilderParams = Field(
         title="OME-Zarr Parameters", default=OMEZarrBuilderParams()
     ),
+    streaming: bool = False,
+    num_workers: int = 1,
+    resume: bool = False,
+    stack_slices: bool = False,
+    slice_pattern: str = DEFAULT_SLICE_PATTERN,
 ):
     """TIFF to OME-Zarr converter task.
 
@@ -105,48 +277,76 @@ def convert_tiff_to_ome_zarr(
             This field will override the default axes resolution and units found in the
             TIFF file.
         ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr builder.
+        streaming (bool): If True, the TIFF files are not loaded in memory,
+            but memory-mapped (uncompressed files) or decoded page by page
+            (compressed files) while being written into the OME-Zarr. The peak
+            memory is then bounded by `ome_zarr_parameters.max_slab_size_mb`
+            instead of by the size of the image.
+        num_workers (int): Number of processes used to convert the TIFF files
+            when `image_path` is a folder. Files that fail to convert are
+            reported in the logs without stopping the rest of the batch.
+            If `stack_slices` is True, the number of slices decoded in parallel.
+        resume (bool): If True, the files already converted to `zarr_dir`
+            with the same parameters (and unchanged since) are skipped, and
+            the conversions interrupted by a previous run are resumed from
+            the last slab written. The conversions are tracked in a manifest
+            file in `zarr_dir`. If False (the default), all the files are
+            converted again and existing OME-Zarrs are overwritten.
+        stack_slices (bool): If True, `image_path` (and `label_path`, if given)
+            must be a folder with one TIFF file per Z plane. The slices are
+            sorted by `slice_pattern` and streamed into a single 3D OME-Zarr,
+            decoding `num_workers` slices in parallel. Stacks are always
+            converted from scratch, `streaming` and `resume` are ignored.
+        slice_pattern (str): Regular expression searched in the file name
+            (without extension) of each slice when `stack_slices` is True.
+            Its first group is the Z index used to sort the slices.
+            By default, the last number in the file name.
     """
-    if not Path(image_path).exists():
-        raise ValueError(f"Input path {image_path} does not exist.")
-
-    if label_path is not None and not Path(label_path).exists():
-        raise ValueError(f"Label path {label_path} does not exist.")
-
-    if Path(image_path).is_dir() and label_path is None:
-        files = []
-        for ext in ALLOWED_TIFF_EXTENSIONS:
-            files += list(Path(image_path).glob(f"*{ext}"))
-    elif Path(image_path).is_dir() and label_path is not None:
-        raise NotImplementedError(
-            "Label path must be None if image path is a folder. "
-            "Batch conversion is not yet supported."
+    if stack_slices:
+        new_zarr_url = convert_tiff_stack_to_ome_zarr(
+            zarr_dir=zarr_dir,
+            image_path=image_path,
+            image_layout=image_layout,
+            label_path=label_path,
+            new_image_key=new_image_key,
+            new_label_key=new_label_key,
+            custom_axis=custom_axis,
+            ome_zarr_parameters=ome_zarr_parameters,
+            slice_pattern=slice_pattern,
+            num_workers=num_workers,
         )
-    elif (
-        Path(image_path).is_file()
-        and Path(image_path).suffix in ALLOWED_TIFF_EXTENSIONS
-    ):
-        files = [Path(image_path)]
-
-    image_list_updates = []
-    for file in files:
-        new_zarr_url = convert_single_tiff_to_ome_zarr(
+        new_zarr_urls = [new_zarr_url]
+    else:
+        files = find_tiff_files(image_path=image_path, label_path=label_path)
+        new_zarr_urls = run_batch_conversion(
+            convert_single_tiff_to_ome_zarr,
+            input_arg="image_path",
+            inputs=files,
+            num_workers=num_workers,
+            manifest=ConversionManifest(zarr_dir),
+            resume=resume,
             zarr_dir=zarr_dir,
-            image_path=str(file),
             image_layout=image_layout,
             label_path=label_path,
             new_image_key=new_image_key,
             new_label_key=new_label_key,
             custom_axis=custom_axis,
             ome_zarr_parameters=ome_zarr_parameters,
+            streaming=streaming,
         )
 
-        if VALID_IMAGE_LAYOUT(image_layout) in [
-            VALID_IMAGE_LAYOUT.CYX,
-            VALID_IMAGE_LAYOUT.YX,
-        ]:
-            is_3d = False
-        else:
-            is_3d = True
+    if VALID_IMAGE_LAYOUT(image_layout) in [
+        VALID_IMAGE_LAYOUT.CYX,
+        VALID_IMAGE_LAYOUT.YX,
+    ]:
+        is_3d = False
+    else:
+        is_3d = True
+
+    image_list_updates = []
+    for new_zarr_url in new_zarr_urls:
+        if new_zarr_url is None:
+            continue
 
         image_update = {"zarr_url": new_zarr_url, "types": {"is_3D": is_3d}}
         image_list_updates.append(image_update)
@@ -0,0 +1,98 @@
+"""Init task of the compound TIFF to OME-Zarr converter."""
+
+from pathlib import Path
+from typing import Any, Optional
+
+from fractal_tasks_core.utils import logger
+from pydantic import Field, validate_call
+
+from plantseg_tasks.convert_tiff_to_ome_zarr import find_tiff_files
+from plantseg_tasks.task_utils.converter_input_models import (
+    VALID_IMAGE_LAYOUT,
+    CustomAxisInputModel,
+    InitArgsTiffConverter,
+    OMEZarrBuilderParams,
+)
+
+
+@validate_call
+def convert_tiff_to_ome_zarr_init(
+    *,
+    zarr_urls: list[str],
+    zarr_dir: str,
+    image_path: str,
+    image_layout: VALID_IMAGE_LAYOUT = "ZYX",
+    label_path: Optional[str] = None,
+    new_image_key: str = "raw",
+    new_label_key: str = "label",
+    custom_axis: CustomAxisInputModel = Field(
+        title="Custom Axis", default=CustomAxisInputModel()
+    ),
+    ome_zarr_parameters: OMEZarrBuilderParams = Field(
+        title="OME-Zarr Parameters", default=OMEZarrBuilderParams()
+    ),
+    streaming: bool = False,
+) -> dict[str, Any]:
+    """TIFF to OME-Zarr converter init task.
+
+    Scan the input path and create a parallelization list with one item
+    per TIFF file, each file is then converted by the compute task.
+
+    Args:
+        zarr_urls (list[str]): List of URLs to the OME-Zarr files.
+            Not used in this task.
+        zarr_dir (str): Output path to save the OME-Zarr file.
+        image_path (str): Input path to the TIFF file,
+            or a folder containing TIFF files.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
+        label_path (Optional[str]): Input path to the label TIFF file. Folder containing
+            TIFF files is not yet supported.
+        new_image_key (str): New key for the image data to
+            be stored in the OME-Zarr.
+        new_label_key (str): New key for the label data to
+            be stored in the OME-Zarr.
+        custom_axis (list[AxisInputModel]): Custom axes to add to the OME-Zarr file.
+            This field will override the default axes resolution and units found in the
+            TIFF file.
+        ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr builder.
+        streaming (bool): If True, the TIFF files are not loaded in memory,
+            but memory-mapped (uncompressed files) or decoded page by page
+            (compressed files) while being written into the OME-Zarr. The peak
+            memory is then bounded by `ome_zarr_parameters.max_slab_size_mb`
+            instead of by the size of the image.
+    """
+    files = find_tiff_files(image_path=image_path, label_path=label_path)
+    Path(zarr_dir).mkdir(parents=True, exist_ok=True)
+
+    parallelization_list = []
+    for file in files:
+        init_args = InitArgsTiffConverter(
+            zarr_dir=zarr_dir,
+            image_path=str(file),
+            image_layout=image_layout,
+            label_path=label_path,
+            new_image_key=new_image_key,
+            new_label_key=new_label_key,
+            custom_axis=custom_axis,
+            ome_zarr_parameters=ome_zarr_parameters,
+            streaming=streaming,
+        )
+        zarr_url = Path(zarr_dir) / f"{file.stem}.zarr" / new_image_key
+        parallelization_list.append(
+            {
+                "zarr_url": str(zarr_url),
+                "init_args": init_args.model_dump(exclude_unset=True),
+            }
+        )
+
+    logger.info(f"Created a parallelization list with {len(files)} TIFF files.")
+    return {"parallelization_list": parallelization_list}
+
+
+if __name__ == "__main__":
+    from fractal_tasks_core.tasks._utils import run_fractal_task
+
+    run_fractal_task(
+        task_function=convert_tiff_to_ome_zarr_init,
+        logger_name=logger.name,
+    )
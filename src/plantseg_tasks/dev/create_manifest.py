@@ -20,6 +20,16 @@ custom_pydantic_models = [
         "task_utils/converter_input_models.py",
         "OMEZarrBuilderParams",
     ),
+    (
+        "plantseg_tasks",
+        "task_utils/converter_input_models.py",
+        "InitArgsH5Converter",
+    ),
+    (
+        "plantseg_tasks",
+        "task_utils/converter_input_models.py",
+        "InitArgsTiffConverter",
+    ),
     (
         "plantseg_tasks",
         "task_utils/ps_workflow_input_models.py",
@@ -1,6 +1,10 @@
 """Contains the list of tasks available to fractal."""
 
-from fractal_tasks_core.dev.task_models import NonParallelTask, ParallelTask
+from fractal_tasks_core.dev.task_models import (
+    CompoundTask,
+    NonParallelTask,
+    ParallelTask,
+)
 
 TASK_LIST = [
     NonParallelTask(
@@ -13,6 +17,20 @@ TASK_LIST = [
         executable="convert_tiff_to_ome_zarr.py",
         meta={"cpus_per_task": 1, "mem": 8000},
     ),
+    CompoundTask(
+        name="Convert H5 to OME-Zarr (Compound)",
+        executable_init="convert_h5_to_ome_zarr_init.py",
+        executable="convert_h5_to_ome_zarr_compute.py",
+        meta_init={"cpus_per_task": 1, "mem": 4000},
+        meta={"cpus_per_task": 1, "mem": 8000},
+    ),
+    CompoundTask(
+        name="Convert Tiff to OME-Zarr (Compound)",
+        executable_init="convert_tiff_to_ome_zarr_init.py",
+        executable="convert_tiff_to_ome_zarr_compute.py",
+        meta_init={"cpus_per_task": 1, "mem": 4000},
+        meta={"cpus_per_task": 1, "mem": 8000},
+    ),
     ParallelTask(
         name="PlantSeg Segmentation",
         executable="plantseg_workflow.py",
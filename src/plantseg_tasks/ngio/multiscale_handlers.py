@@ -1,7 +1,8 @@
 """Implementation of MultiscaleHandler class to handle OME-NGFF images."""
 
 from dataclasses import dataclass
-from typing import Iterator
+from itertools import product
+from typing import Callable, Iterator
 
 import numpy as np
 import zarr
@@ -9,6 +10,7 @@ from scipy.ndimage import zoom
 
 from plantseg_tasks.ngio.ngff.zarr_utils import NgffImageMeta, load_ngff_image_meta
 from plantseg_tasks.ngio.table_handlers import ROI, RoiTableHandler
+from plantseg_tasks.task_utils.pyramids import block_mode, coarsen
 
 
 def match_resolution(
@@ -66,6 +68,8 @@ class MultiscaleHandler:
         """Initialize the MultiscaleHandler in read mode."""
         self.zarr_url = zarr_url
         self.internal_path = path
+        # the metadata is loaded once, the handler is read only
+        self._metadata: NgffImageMeta | None = None
 
         assert mode in ["r"], "Only read mode is supported at the moment."
         self.zarr_mode = mode
@@ -104,7 +108,11 @@ class MultiscaleHandler:
     @property
     def metadata(self) -> NgffImageMeta:
         """Return the metadata of the image."""
-        return load_ngff_image_meta(self._metadata_path, "0.4")
+        if self._metadata is None:
+            self._metadata = load_ngff_image_meta(
+                self.zarr_url, "0.4", path=self.internal_path
+            )
+        return self._metadata
 
     @property
     def level(self) -> int:
@@ -116,13 +124,6 @@ class MultiscaleHandler:
         """List of available levels in the multiscale image."""
         return list(range(self.metadata.num_levels))
 
-    @property
-    def _metadata_path(self) -> str:
-        if self.internal_path:
-            return f"{self.zarr_url}/{self.internal_path}"
-
-        return self.zarr_url
-
     @property
     def array_path(self) -> str:
         """Path to the zarr array in the Zarr store."""
@@ -253,6 +254,121 @@ class MultiscaleHandler:
         zarr_array[slices] = data
 
 
+def _iter_chunks(
+    shape: tuple[int, ...],
+    chunks: tuple[int, ...],
+    boxes: list[list[tuple[int, int]]] | None = None,
+) -> Iterator[tuple[slice, ...]]:
+    """Iterate over the slices of the chunks of an array.
+
+    If `boxes` (a list of (start, stop) per axis) is given, only the chunks
+    overlapping a box are returned, each of them once.
+    """
+    if boxes is None:
+        boxes = [[(0, size) for size in shape]]
+    seen = set()
+    for box in boxes:
+        grid = [
+            range(start // chunk, -(-stop // chunk))
+            for (start, stop), chunk in zip(box, chunks)
+        ]
+        for index in product(*grid):
+            if index in seen:
+                continue
+            seen.add(index)
+            yield tuple(
+                slice(i * chunk, min((i + 1) * chunk, size))
+                for i, chunk, size in zip(index, chunks, shape)
+            )
+
+
+def _nearest_indices(source_size: int, target_size: int) -> np.ndarray:
+    """Index of the source voxel resampled to each target voxel along an axis.
+
+    The indices are the ones picked by `scipy.ndimage.zoom` with nearest
+    neighbor interpolation, so that any block of the target can be resampled
+    on its own.
+    """
+    return zoom(
+        np.arange(source_size),
+        target_size / source_size,
+        order=0,
+        mode="nearest",
+        grid_mode=True,
+    )
+
+
+def _consolidate(
+    handler: MultiscaleHandler,
+    aggregation_function: Callable | None = None,
+    regions: list[tuple[slice, ...]] | None = None,
+) -> None:
+    """Resample the data at the current level to all the other levels.
+
+    The data is written at the current level (e.g. a coarse level, that is
+    cheaper to process), and every other level, coarser or finer, is
+    resampled from it with nearest neighbor interpolation.
+    If `aggregation_function` is given, coarser levels obtained with integer
+    factors are instead computed by aggregating blocks of voxels.
+    The other levels are written chunk by chunk, reading only the region of
+    the current level each chunk is resampled from. If `regions` (slices of
+    the current level) is given, only the chunks they overlap are updated.
+    """
+    source = handler.zarr_array
+    source_boxes = None
+    if regions is not None:
+        source_boxes = [
+            [s.indices(size)[:2] for s, size in zip(region, source.shape)]
+            for region in regions
+        ]
+
+    for i in handler.list_levels:
+        if i == handler.level:
+            continue
+        image = handler.change_level(i)
+        target = zarr.open_array(image.array_path, mode="a", dimension_separator="/")
+        factors = [max(1, round(ds / ts)) for ds, ts in zip(source.shape, target.shape)]
+        use_coarsen = (
+            aggregation_function is not None
+            and i > handler.level
+            and tuple(ds // f for ds, f in zip(source.shape, factors)) == target.shape
+        )
+        indices = [
+            _nearest_indices(ds, ts) for ds, ts in zip(source.shape, target.shape)
+        ]
+
+        target_boxes = None
+        if source_boxes is not None and use_coarsen:
+            target_boxes = [
+                [
+                    (start // f, min(ts, -(-stop // f)))
+                    for (start, stop), f, ts in zip(box, factors, target.shape)
+                ]
+                for box in source_boxes
+            ]
+        elif source_boxes is not None:
+            target_boxes = [
+                [
+                    (np.searchsorted(ind, start), np.searchsorted(ind, stop))
+                    for (start, stop), ind in zip(box, indices)
+                ]
+                for box in source_boxes
+            ]
+
+        for target_slices in _iter_chunks(target.shape, target.chunks, target_boxes):
+            if use_coarsen:
+                source_slices = tuple(
+                    slice(s.start * f, s.stop * f)
+                    for s, f in zip(target_slices, factors)
+                )
+                data = coarsen(source[source_slices], factors, aggregation_function)
+            else:
+                index = [ind[s] for ind, s in zip(indices, target_slices)]
+                source_slices = tuple(slice(ix[0], ix[-1] + 1) for ix in index)
+                data = source[source_slices][np.ix_(*[ix - ix[0] for ix in index])]
+            target[target_slices] = data
+
+
 class MultiscaleImage(MultiscaleHandler):
     """A class to handle OME-NGFF images stored in Zarr format."""
 
@@ -284,18 +400,19 @@ class MultiscaleImage(MultiscaleHandler):
             mode=self.zarr_mode,
         )
 
-    def consolidate(self) -> None:
-        """Consolidate the label data at a given level."""
-        # TODO: implement this method properly
+    def consolidate(
+        self,
+        aggregation_function: Callable | None = None,
+        regions: list[tuple[slice, ...]] | None = None,
+    ) -> None:
+        """Consolidate the image data from the current level to all the others.
 
-        image = self.change_level(0)
-        data = image.get_data()
-        dtype = data.dtype
-        for i in self.list_levels[1:]:
-            image = image.change_level(i)
-            factor = [img_s / ds for ds, img_s in zip(data.shape, image.shape)]
-            data = zoom(data, factor, order=0).astype(dtype)
-            image.write_data(data)
+        If `aggregation_function` is given (e.g. np.mean), coarser levels
+        aggregate blocks of voxels instead of picking the nearest one.
+        If `regions` is given, only the parts of the other levels covering
+        these slices of the current level are updated.
+        """
+        _consolidate(self, aggregation_function=aggregation_function, regions=regions)
 
 
 class MultiscaleLabel(MultiscaleHandler):
@@ -311,14 +428,8 @@ class MultiscaleLabel(MultiscaleHandler):
         )
 
     def consolidate(self) -> None:
-        """Consolidate the label data at a given level."""
-        # TODO: implement this method properly
-
-        image = self.change_level(0)
-        data = image.get_data()
-        dtype = data.dtype
-        for i in self.list_levels[1:]:
-            image = image.change_level(i)
-            factor = [img_s / ds for ds, img_s in zip(data.shape, image.shape)]
-            data = zoom(data, factor, order=0).astype(dtype)
-            image.write_data(data)
+        """Consolidate the label data from the current level to all the others.
+
+        Coarser levels keep the most frequent label ID of each block.
+        """
+        _consolidate(self, aggregation_function=block_mode)
@@ -1,5 +1,15 @@
 """IO and validation of NGFF metadata."""
 
-from plantseg_tasks.ngio.ngff.zarr_utils import load_ngff_image_meta
+from plantseg_tasks.ngio.ngff.zarr_utils import (
+    consolidate_metadata,
+    load_ngff_image_meta,
+    open_group_metadata,
+    read_group_attrs,
+)
 
-__all__ = ["load_ngff_image_meta"]
+__all__ = [
+    "consolidate_metadata",
+    "load_ngff_image_meta",
+    "open_group_metadata",
+    "read_group_attrs",
+]
@@ -10,20 +10,35 @@ from fractal_tasks_core.ngff.specs import (
     Omero,
     ScaleCoordinateTransformation,
 )
+from numcodecs.abc import Codec
 
 from plantseg_tasks.ngio.ngff_image import NgffImage
 
 
 def create_ngff_image_from_metadata(
-    zarr_url, shape, dtype, metadata: NgffImageMeta
+    zarr_url,
+    shape,
+    dtype,
+    metadata: NgffImageMeta,
+    compressor: Codec | str | None = "default",
 ) -> NgffImage:
     # this is a placeholder for the actual implementation
     new_ome_zarr = zarr.open(zarr_url, mode="w")
-    for i, _ in enumerate(metadata.multiscales[0].datasets):
+    datasets = metadata.multiscales[0].datasets
+    highres_scale = datasets[0].coordinateTransformations[0].scale
+    for i, dataset in enumerate(datasets):
+        # the shape of each level follows the coarsening of its scale
+        scale = dataset.coordinateTransformations[0].scale
+        level_shape = [
+            s // round(ls / hs) for s, hs, ls in zip(shape, highres_scale, scale)
+        ]
         new_ome_zarr.create_dataset(
-            f"{i}", shape=shape, dimension_separator="/", dtype=dtype
+            f"{i}",
+            shape=level_shape,
+            dimension_separator="/",
+            dtype=dtype,
+            compressor=compressor,
         )
-        shape = [shape[0], shape[1], shape[2] // 2, shape[3] // 2]
 
     new_ome_zarr.attrs.update(metadata.dict(exclude_none=True))
     return NgffImage(zarr_url)
@@ -41,7 +56,9 @@ def create_ngff_image(
     channel_names: list[str] | None = None,
     axis_order: list[str] | None = None,
     scling_factor_xy: float = 2.0,
+    scaling_factor_z: float = 1.0,
     num_levels: int = 3,
+    compressor: Codec | str | None = "default",
 ) -> NgffImage:
     if axis_order is None:
         axis_order = ["t", "c", "z", "y", "x"][-len(shape) :]
@@ -72,21 +89,17 @@ def create_ngff_image(
                 ],
             )
         )
+        factors = {"x": scling_factor_xy, "y": scling_factor_xy, "z": scaling_factor_z}
         pixel_resulution = [
-            s * scling_factor_xy if ax in ["x", "y"] else s
-            for s, ax in zip(pixel_resulution, spatial_axis)
+            s * factors[ax] for s, ax in zip(pixel_resulution, spatial_axis)
         ]
 
         list_shapes.append(shape)
-        shape = [
-            int(s / scling_factor_xy) if ax in ["x", "y"] else s
-            for s, ax in zip(shape, spatial_axis)
-        ]
+        shape = [int(s / factors.get(ax, 1)) for s, ax in zip(shape, axis_order)]
         if chunks is not None:
             list_chunks.append(chunks)
-            channel_names = [
-                int(c / scling_factor_xy) if ax in ["x", "y"] else c
-                for c, ax in zip(chunks, spatial_axis)
+            chunks = [
+                max(1, int(c / factors.get(ax, 1))) for c, ax in zip(chunks, axis_order)
             ]
         else:
             list_chunks.append(None)
@@ -106,7 +119,12 @@ def create_ngff_image(
     new_ome_zarr = zarr.open(zarr_url, mode="w")
     for (i, shape), chunks in zip(enumerate(list_shapes), list_chunks):
         new_ome_zarr.create_dataset(
-            f"{i}", shape=shape, dtype=dtype, chunks=chunks, dimension_separator="/"
+            f"{i}",
+            shape=shape,
+            dtype=dtype,
+            chunks=chunks,
+            compressor=compressor,
+            dimension_separator="/",
         )
     new_ome_zarr.attrs.update(ngff_meta.dict())
 
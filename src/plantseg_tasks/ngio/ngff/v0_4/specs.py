@@ -3,16 +3,16 @@
 Implementations of the OME-NGFF 0.4 specs using Pydantic models.
 """
 
+import zarr
 from fractal_tasks_core.ngff.specs import NgffImageMeta
-from fractal_tasks_core.ngff.zarr_utils import load_NgffImageMeta
 
 __all__ = ["NgffImageMeta"]
 
 
-def load_ngff_image_meta_v04(zarr_path: str) -> NgffImageMeta:
-    """Load OME-NGFF image metadata from a Zarr store.
+def load_ngff_image_meta_v04(zarr_group: zarr.Group) -> NgffImageMeta:
+    """Load OME-NGFF image metadata from a Zarr group.
 
     Args:
-        zarr_path (str): Path to the Zarr store.
+        zarr_group (zarr.Group): The image group, opened in read mode.
     """
-    return load_NgffImageMeta(zarr_path=zarr_path)
+    return NgffImageMeta(**zarr_group.attrs.asdict())
@@ -3,9 +3,11 @@
 from pathlib import Path
 
 import zarr
+import zarr.storage
 from fractal_tasks_core.ngff.specs import (
     NgffImageMeta,
 )
+from zarr.util import json_dumps, json_loads
 
 from plantseg_tasks.ngio.ngff.v0_4.specs import load_ngff_image_meta_v04
 
@@ -13,16 +15,114 @@ __all__ = ["NgffImageMeta"]
 
 _ngff_image_meta_loaders = {"0.4": load_ngff_image_meta_v04}
 
+CONSOLIDATED_METADATA_KEY = ".zmetadata"
 
-def load_ngff_image_meta(zarr_path: str, version: str) -> NgffImageMeta:
+
+_METADATA_KEYS = (".zgroup", ".zarray", ".zattrs")
+
+
+def _list_metadata_keys(store: zarr.storage.FSStore, path: str = "") -> list[str]:
+    """List the metadata keys of the hierarchy below `path`.
+
+    Only the children of groups are listed, the content of the arrays (their
+    chunks) is never listed.
+    """
+    prefix = f"{path}/" if path else ""
+    keys = [f"{prefix}{key}" for key in _METADATA_KEYS if f"{prefix}{key}" in store]
+    if f"{prefix}.zgroup" not in keys:
+        return keys
+
+    for child in store.listdir(path):
+        if child.startswith("."):
+            continue
+        child_path = f"{prefix}{child}"
+        if f"{child_path}/.zgroup" in store or f"{child_path}/.zarray" in store:
+            keys.extend(_list_metadata_keys(store, child_path))
+    return keys
+
+
+def consolidate_metadata(zarr_url: str | Path) -> None:
+    """Write the consolidated metadata (.zmetadata) of a Zarr hierarchy.
+
+    All the .zgroup, .zarray and .zattrs files below `zarr_url` are gathered
+    in a single .zmetadata file, so that readers can load the metadata of the
+    whole hierarchy with a single read. Only the metadata keys are listed,
+    the chunks of the arrays are skipped. It must be called again after any
+    metadata change, or readers will see the stale metadata.
+
+    Args:
+        zarr_url (str | Path): Path to the root of the Zarr hierarchy.
+    """
+    store = zarr.storage.FSStore(str(zarr_url))
+    metadata = {key: json_loads(store[key]) for key in _list_metadata_keys(store)}
+    store[CONSOLIDATED_METADATA_KEY] = json_dumps(
+        {"zarr_consolidated_format": 1, "metadata": metadata}
+    )
+
+
+def _read_attrs(store: zarr.storage.FSStore, path: str | None) -> dict:
+    key = f"{path}/.zattrs" if path else ".zattrs"
+    if key not in store:
+        return {}
+    return json_loads(store[key])
+
+
+def read_group_attrs(zarr_url: str | Path, path: str) -> dict:
+    """Read the attributes of a group from the store, skipping .zmetadata.
+
+    Used for the attributes that change as the hierarchy grows (e.g. the
+    list of labels), which may be stale in the consolidated metadata. An
+    empty dict is returned if the group has no attributes.
+
+    Args:
+        zarr_url (str | Path): Path to the root of the Zarr hierarchy.
+        path (str): Path of the group inside the hierarchy.
+    """
+    store = zarr.storage.FSStore(str(zarr_url), mode="r")
+    return _read_attrs(store, path)
+
+
+def open_group_metadata(zarr_url: str | Path, path: str | None = None) -> zarr.Group:
+    """Open a Zarr group in read mode, to read its metadata.
+
+    If the hierarchy at `zarr_url` has consolidated metadata, the group is
+    opened from it, so the metadata of its arrays is not read again. The
+    .zattrs of the group itself is always read from the store: if it changed
+    since the metadata was consolidated (e.g. a table or label written by
+    another task), or if the group was created after, the group is opened
+    from the store directly.
+
+    Args:
+        zarr_url (str | Path): Path to the root of the Zarr hierarchy.
+        path (str | None): Path of the group inside the hierarchy.
+    """
+    store = zarr.storage.FSStore(str(zarr_url), mode="r")
+    if CONSOLIDATED_METADATA_KEY in store:
+        root = zarr.open_consolidated(store, mode="r")
+        try:
+            group = root if path is None else root[path]
+        except KeyError:
+            group = None
+        if isinstance(group, zarr.Group):
+            if group.attrs.asdict() == _read_attrs(store, path):
+                return group
+
+    return zarr.open_group(store, path=path, mode="r")
+
+
+def load_ngff_image_meta(
+    zarr_path: str | Path, version: str, path: str | None = None
+) -> NgffImageMeta:
     """Load OME-NGFF image metadata from a Zarr store.
 
     Args:
-        zarr_path (str): Path to the Zarr store.
+        zarr_path (str | Path): Path to the Zarr store.
         version (str): Version of the OME-NGFF specs.
+        path (str | None): Path of the image group inside the Zarr store.
     """
     assert (
         version in _ngff_image_meta_loaders.keys()
     ), f"Unsupported version: {version}, \
         supported versions are: {list(_ngff_image_meta_loaders.keys())}"
-    return _ngff_image_meta_loaders[version](zarr_path)
+    zarr_group = open_group_metadata(zarr_path, path=path)
+    return _ngff_image_meta_loaders[version](zarr_group)
@@ -8,8 +8,14 @@ from fractal_tasks_core.ngff.specs import (
     Omero,
     ScaleCoordinateTransformation,
 )
+from numcodecs.abc import Codec
 
 from plantseg_tasks.ngio.multiscale_handlers import MultiscaleImage, MultiscaleLabel
+from plantseg_tasks.ngio.ngff.zarr_utils import (
+    consolidate_metadata,
+    open_group_metadata,
+    read_group_attrs,
+)
 from plantseg_tasks.ngio.table_handlers import RoiTableHandler
 
 
@@ -17,34 +23,42 @@ class NgffImage:
     """A class to handle OME-NGFF images."""
 
     def __init__(self, zarr_url: str, mode: str = "r") -> None:
-        """Initialize the NGFFImage in read mode."""
+        """Initialize the NGFFImage in read mode.
+
+        In read mode, the consolidated metadata is used if present.
+        """
         # setup the main image
         self._zarr_url = zarr_url
-        self.group = zarr.open_group(zarr_url, mode=mode)
+        if mode == "r":
+            self.group = open_group_metadata(zarr_url)
+        else:
+            self.group = zarr.open_group(zarr_url, mode=mode)
+
+    def _read_list(self, group_name: str) -> list[str]:
+        """Read the list of the children of the `group_name` group.
+
+        The list changes as labels (or tables) are added, so it is read from
+        the .zattrs of the group, never from the consolidated metadata.
+        """
+        list_children = read_group_attrs(self.zarr_url, group_name).get(group_name, [])
+        if not isinstance(list_children, list):
+            raise ValueError(f"{group_name.capitalize()} must be a list of strings.")
+        return list_children
 
     @property
     def list_labels(self) -> list[str]:
         """List all the labels in the image."""
-        labels_group = self.group.get("labels", None)
-        if labels_group is None:
-            return []
-
-        list_labels = labels_group.attrs["labels"]
-        if not isinstance(list_labels, list):
-            raise ValueError("Labels must be a list of strings.")
-        return list_labels
+        return self._read_list("labels")
 
     @property
     def list_tables(self) -> list[str]:
         """List all the tables in the image."""
-        tables_group = self.group.get("tables", None)
-        if tables_group is None:
-            return []
+        return self._read_list("tables")
 
-        list_tables = tables_group.attrs["tables"]
-        if not isinstance(list_tables, list):
-            raise ValueError("Tables must be a list of strings.")
-        return list_tables
+    @property
+    def list_predictions(self) -> list[str]:
+        """List all the boundary predictions saved in the image."""
+        return self._read_list("predictions")
 
     @property
     def zarr_url(self) -> str:
@@ -55,6 +69,14 @@ class NgffImage:
         """Create a MultiscaleLabel object."""
         return MultiscaleLabel(self.zarr_url, path=f"labels/{label_name}", level=level)
 
+    def get_multiscale_predictions(
+        self, predictions_name: str, level: int = 0
+    ) -> MultiscaleImage:
+        """Create a MultiscaleImage object of saved boundary predictions."""
+        return MultiscaleImage(
+            self.zarr_url, path=f"predictions/{predictions_name}", level=level
+        )
+
     def get_roi_table(self, table_name: str) -> RoiTableHandler:
         """Create a RoiTableHandler object."""
         return RoiTableHandler(self.zarr_url, table_name)
@@ -91,44 +113,51 @@ class NgffImage:
             metadata=multiscale_image_metadata,
         )
 
-    def create_new_label(
+    def _create_zyx_multiscale(
         self,
-        new_label_name: str,
-    ) -> "MultiscaleLabel":
-        """Create a new label in the current image."""
-        label_group = zarr.open(self.zarr_url, mode="a").require_group("labels")
-
-        if "labels" not in label_group.attrs:
-            label_group.attrs["labels"] = []
-
-        labels = label_group.attrs["labels"]
-        label_group.attrs["labels"] = labels + [new_label_name]
-
-        label_group = zarr.open(self.zarr_url, path="labels", mode="a").require_group(
-            new_label_name
+        group_name: str,
+        new_name: str,
+        dtype: str,
+        compressor: Codec | str | None = "default",
+    ) -> zarr.Group:
+        """Create a ZYX multiscale group matching the image pyramid.
+
+        The group is created at `group_name/new_name` and listed in the
+        `group_name` attribute of the `group_name` group, like labels are.
+        """
+        parent_group = zarr.open(self.zarr_url, mode="a").require_group(group_name)
+
+        if group_name not in parent_group.attrs:
+            parent_group.attrs[group_name] = []
+
+        names = parent_group.attrs[group_name]
+        if new_name not in names:
+            parent_group.attrs[group_name] = names + [new_name]
+
+        new_group = zarr.open(self.zarr_url, path=group_name, mode="a").require_group(
+            new_name
         )
 
-        shape = self.get_multiscale_image().shape
-        new_shape = (shape[1], shape[2], shape[3])
-
         image = self.get_multiscale_image()
         for i in image.list_levels:
             image = image.change_level(i)
-            shape = image.shape
-            new_shape = (shape[1], shape[2], shape[3])
-            new_label_dataset = zarr.open_array(
-                f"{self.zarr_url}/labels/{new_label_name}/{i}",
+            new_shape = image.shape[-3:]
+            new_chunks = image.zarr_array.chunks[-3:]
+            zarr.open_array(
+                f"{self.zarr_url}/{group_name}/{new_name}/{i}",
                 shape=new_shape,
-                dtype="<i4",
+                chunks=new_chunks,
+                dtype=dtype,
+                compressor=compressor,
                 mode="w",
                 dimension_separator="/",
             )
 
         multiscale = self.get_multiscale_image().metadata.multiscales[0]
-        multiscale_axes = multiscale.axes[1:]
+        multiscale_axes = multiscale.axes[-3:]
         new_dataset = []
         for dataset in multiscale.datasets:
-            scale = dataset.coordinateTransformations[0].scale[1:]
+            scale = dataset.coordinateTransformations[0].scale[-3:]
             new_dataset.append(
                 Dataset(
                     path=dataset.path,
@@ -141,20 +170,55 @@ class NgffImage:
         metadata = NgffImageMeta(
             multiscales=[
                 Multiscale(
-                    name=new_label_name,
+                    name=new_name,
                     version="0.4",
                     axes=multiscale_axes,
                     datasets=new_dataset,
                 )
             ]
         )
-        label_group.attrs.update(metadata.dict(exclude_none=True))
+        new_group.attrs.update(metadata.dict(exclude_none=True))
+        return new_group
+
+    def create_new_label(
+        self,
+        new_label_name: str,
+        compressor: Codec | str | None = "default",
+    ) -> "MultiscaleLabel":
+        """Create a new label in the current image.
+
+        Every level of the label matches the ZYX shape, chunks and scale of
+        the corresponding image level, so labels follow the image pyramid also
+        when it is coarsened along Z. The compressor is passed to zarr for
+        every level of the label, "default" keeps the zarr default compressor.
+        The metadata of the image is consolidated again once the label is
+        created.
+        """
+        label_group = self._create_zyx_multiscale(
+            "labels",
+            new_label_name,
+            dtype="<i4",
+            compressor=compressor,
+        )
         source_dict = {
             "image-label": {"source": {"image": "../../"}, "version": "0.4"},
         }
         label_group.attrs.update(source_dict)
+        consolidate_metadata(self.zarr_url)
         return self.get_multiscale_label(new_label_name)
 
+    def create_new_predictions(
+        self, new_predictions_name: str, dtype: str
+    ) -> MultiscaleImage:
+        """Create a new boundary predictions image in the current image.
+
+        The predictions are stored like a label, as a ZYX multiscale group in
+        `predictions/{new_predictions_name}` matching the image pyramid.
+        """
+        self._create_zyx_multiscale("predictions", new_predictions_name, dtype=dtype)
+        consolidate_metadata(self.zarr_url)
+        return self.get_multiscale_predictions(new_predictions_name)
+
     def derive_new_label(
         self,
         new_label_name: str,
@@ -4,6 +4,7 @@ from pathlib import Path
 
 import zarr
 
+from plantseg_tasks.ngio.ngff.zarr_utils import open_group_metadata
 from plantseg_tasks.ngio.tables.v1 import (
     FeatureTable,
     MaskingRoiTable,
@@ -30,8 +31,10 @@ def _get_version(zarr_group: zarr.Group) -> str:
 def load_table_meta(
     zarr_url: str | Path, table_name: str
 ) -> RoiTable | MaskingRoiTable | FeatureTable:
-    """Load a table from a Zarr group."""
-    table_path = Path(zarr_url) / "tables" / table_name
-    table_group = zarr.open_group(table_path)
+    """Load a table from a Zarr group.
+
+    The consolidated metadata of the image is used if present.
+    """
+    table_group = open_group_metadata(zarr_url, path=f"tables/{table_name}")
     version = _get_version(table_group)
-    return _loaders[version](table_path)
+    return _loaders[version](table_group)
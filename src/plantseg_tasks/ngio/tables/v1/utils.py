@@ -1,17 +1,14 @@
 """Utility functions for working with tables in the v1 format."""
 
-from pathlib import Path
-
 import zarr
 
 from plantseg_tasks.ngio.tables.v1.specs import FeatureTable, MaskingRoiTable, RoiTable
 
 
 def load_table_meta_v1(
-    zarr_url: str | Path,
+    table_group: zarr.Group,
 ) -> RoiTable | MaskingRoiTable | FeatureTable:
     """Load a table from a Zarr group."""
-    table_group = zarr.open_group(zarr_url)
     group_attrs = dict(table_group.attrs.asdict())
 
     # rename 'encoding-type' and 'encoding-version'
@@ -1,67 +1,290 @@
 """PlantSeg Workflow as a Fractal Task."""
 
-from typing import Any, Optional
+import multiprocessing
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Optional
 
+import numpy as np
 from fractal_tasks_core.utils import logger
 from pydantic import validate_call
 
+from plantseg_tasks.ngio.multiscale_handlers import MultiscaleImage
+from plantseg_tasks.ngio.ngff.zarr_utils import consolidate_metadata
 from plantseg_tasks.ngio.ngff_image import NgffImage
-from plantseg_tasks.task_utils.process import plantseg_standard_workflow
+from plantseg_tasks.task_utils.chunking import plan_blocks
+from plantseg_tasks.task_utils.predictions_cache import (
+    PREDICTIONS_DTYPE,
+    open_predictions_cache,
+)
+from plantseg_tasks.task_utils.process import (
+    PlantSegPredictor,
+    plantseg_segmentation,
+)
 from plantseg_tasks.task_utils.ps_workflow_input_models import (
     PlantSegPredictionsModel,
     PlantSegSegmentationModel,
 )
 
+# Number of regions read ahead, and written behind, the prediction stage
+_PREFETCH_REGIONS = 2
+_PENDING_WRITES = 2
 
-def _predict_simple(image, label, channel, prediction_model, segmentation_model):
-    logger.info("Predicting on the full image")
-    patch = image.get_data()
+
+def _select_channel(patch: np.ndarray, channel: int) -> np.ndarray:
     if patch.ndim == 5:
         assert patch.shape[0] == 1, "Time dimension not supported"
         patch = patch[0]
 
     assert patch.ndim == 4, "Only 4D images are supported CXYZ"
-    patch = patch[channel]
+    return patch[channel]
 
-    seg = plantseg_standard_workflow(
-        image=patch,
-        prediction_model=prediction_model,
-        segmentation_model=segmentation_model,
-    )
 
-    label.write_data(seg)
-    return label
+@dataclass(frozen=True)
+class _Region:
+    """A region of the image segmented on its own.
 
+    Attributes:
+        read_slices: The slices of the image array to read and segment.
+        write_slices: The ZYX slices of the label to write.
+        crop: The ZYX crop of the segmentation written to `write_slices`.
+    """
 
-def _predict_with_roi(
-    ngff_image, image, label, channel, prediction_model, segmentation_model, table_name
+    read_slices: tuple[slice, ...]
+    write_slices: tuple[slice, ...]
+    crop: tuple[slice, ...] = (slice(None), slice(None), slice(None))
+
+
+def _read_region(image: MultiscaleImage, region: _Region, channel: int) -> np.ndarray:
+    return _select_channel(image.zarr_array[region.read_slices], channel)
+
+
+def _ordered_map(
+    executor: Executor, function: Callable, items: Iterable, max_pending: int
+) -> Iterator[Any]:
+    """Like `executor.map`, but with at most `max_pending` jobs submitted.
+
+    The results are yielded in the order of `items`, so a result waits in
+    memory only for the jobs submitted before it. `items` is consumed
+    lazily, one item per job submitted.
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) == max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(function, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def _write_region(label, region: _Region, seg: np.ndarray, offset: int) -> None:
+    seg += offset
+    label._write_data(seg, slices=region.write_slices)
+
+
+def _segmentation_executor(num_workers: int) -> Executor:
+    if num_workers == 1:
+        # a thread still overlaps the segmentation with the next prediction
+        return ThreadPoolExecutor(max_workers=1)
+    # "spawn" avoids forking a process that already runs torch/zarr threads
+    mp_context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context)
+
+
+def _segment_regions(
+    image,
+    label,
+    regions,
+    channel,
+    prediction_model,
+    segmentation_model,
+    num_workers,
+    predictions_cache=None,
+    whole_level=False,
 ):
-    logger.info(f"Predicting on ROIs from table {table_name}")
-    table_handler = ngff_image.get_roi_table(table_name=table_name)
+    """Segment the regions in a pipeline of bounded stages.
 
-    max_seg_id = 0
-    for info, patch in image.iter_over_rois(table_handler, return_info=True):
-        if patch.ndim == 5:
-            assert patch.shape[0] == 1, "Time dimension not supported"
-            patch = patch[0]
+    The stages run concurrently on successive regions: a reader thread
+    prefetches the next regions, the predictions run in this thread, the
+    segmentation runs on `num_workers` processes (or a thread if 1), and a
+    writer thread writes the labels. Each stage holds at most a few regions,
+    so the memory stays bounded and the throughput is set by the slowest stage.
 
-        assert patch.ndim == 4, "Only 4D images are supported CXYZ"
+    If a `predictions_cache` is given, the regions it covers are read from it
+    instead of being predicted, and the other predictions are saved in it.
+    """
+    logger.info(
+        f"Segmenting {len(regions)} regions with {num_workers} segmentation workers."
+    )
+    cached = [
+        predictions_cache is not None
+        and predictions_cache.is_cached(region.read_slices[-3:])
+        for region in regions
+    ]
+    if any(cached):
+        logger.info(f"Loading the saved predictions of {sum(cached)} regions.")
 
-        patch = patch[channel]
+    def read_region(item):
+        region, is_cached = item
+        if is_cached:
+            return predictions_cache.read(region.read_slices[-3:])
+        return _read_region(image, region, channel=channel)
 
-        seg = plantseg_standard_workflow(
-            image=patch,
-            prediction_model=prediction_model,
-            segmentation_model=segmentation_model,
+    with (
+        ThreadPoolExecutor(max_workers=1) as reader,
+        _segmentation_executor(num_workers) as segmenter,
+        ThreadPoolExecutor(max_workers=1) as writer,
+    ):
+        pending_writes = deque()
+
+        def submit_write(function, *args):
+            if len(pending_writes) == _PENDING_WRITES:
+                pending_writes.popleft().result()
+            pending_writes.append(writer.submit(function, *args))
+
+        def predict_regions(patches):
+            # the model is loaded once, and only if a region must be predicted
+            predictor = None
+            for region, is_cached, patch in zip(regions, cached, patches):
+                if is_cached or prediction_model.skip:
+                    yield patch
+                    continue
+                if predictor is None:
+                    predictor = PlantSegPredictor(prediction_model)
+                predictions = predictor(patch)
+                if predictions_cache is not None:
+                    submit_write(
+                        predictions_cache.write,
+                        region.write_slices,
+                        predictions[region.crop],
+                    )
+                yield predictions
+
+        patches = _ordered_map(
+            reader,
+            read_region,
+            zip(regions, cached),
+            max_pending=_PREFETCH_REGIONS,
+        )
+        segmentations = _ordered_map(
+            segmenter,
+            partial(plantseg_segmentation, segmentation_model=segmentation_model),
+            predict_regions(patches),
+            max_pending=2 * num_workers,
         )
-        seg += max_seg_id
-        max_seg_id = seg.max() + 1
 
-        slices = info.slices[-3:]
-        label._write_data(seg, slices=slices)
+        max_seg_id = 0
+        for region, seg in zip(regions, segmentations):
+            seg = seg[region.crop]
+            # the IDs are offset in the order of the regions, so that they
+            # do not depend on the number of workers
+            offset, max_seg_id = max_seg_id, seg.max() + max_seg_id + 1
+            submit_write(_write_region, label, region, seg, offset)
+        for write in pending_writes:
+            write.result()
+
+    if predictions_cache is not None:
+        predicted = [r for r, is_cached in zip(regions, cached) if not is_cached]
+        predictions_cache.save(
+            [region.write_slices for region in predicted], whole_level=whole_level
+        )
     return label
 
 
+def _predict_simple(
+    image,
+    label,
+    channel,
+    prediction_model,
+    segmentation_model,
+    predictions_cache=None,
+):
+    logger.info("Predicting on the full image")
+    full_image = tuple(slice(None) for _ in image.shape)
+    return _segment_regions(
+        image,
+        label,
+        [_Region(read_slices=full_image, write_slices=full_image[-3:])],
+        channel=channel,
+        prediction_model=prediction_model,
+        segmentation_model=segmentation_model,
+        num_workers=1,
+        predictions_cache=predictions_cache,
+        whole_level=True,
+    )
+
+
+def _predict_blockwise(
+    image,
+    label,
+    channel,
+    prediction_model,
+    segmentation_model,
+    block_shape,
+    halo,
+    num_workers=1,
+    predictions_cache=None,
+):
+    logger.info(f"Predicting block by block, blocks {block_shape} with halo {halo}")
+    leading_slices = tuple(slice(None) for _ in image.shape[:-3])
+    regions = []
+    for inner, outer in plan_blocks(
+        image.shape[-3:],
+        block_shape=block_shape,
+        chunks=label.zarr_array.chunks[-3:],
+        halo=halo,
+    ):
+        crop = tuple(
+            slice(i.start - o.start, i.stop - o.start) for i, o in zip(inner, outer)
+        )
+        regions.append(
+            _Region(read_slices=leading_slices + outer, write_slices=inner, crop=crop)
+        )
+    return _segment_regions(
+        image,
+        label,
+        regions,
+        channel=channel,
+        prediction_model=prediction_model,
+        segmentation_model=segmentation_model,
+        num_workers=num_workers,
+        predictions_cache=predictions_cache,
+        whole_level=True,
+    )
+
+
+def _predict_with_roi(
+    ngff_image,
+    image,
+    label,
+    channel,
+    prediction_model,
+    segmentation_model,
+    table_name,
+    num_workers=1,
+    predictions_cache=None,
+):
+    logger.info(f"Predicting on ROIs from table {table_name}")
+    table_handler = ngff_image.get_roi_table(table_name=table_name)
+    regions = [
+        _Region(read_slices=slices, write_slices=slices[-3:])
+        for slices in image.iter_over_slices(table_handler)
+    ]
+    return _segment_regions(
+        image,
+        label,
+        regions,
+        channel=channel,
+        prediction_model=prediction_model,
+        segmentation_model=segmentation_model,
+        num_workers=num_workers,
+        predictions_cache=predictions_cache,
+    )
+
+
 @validate_call
 def plantseg_workflow(
     *,
@@ -72,6 +295,11 @@ def plantseg_workflow(
     prediction_model: PlantSegPredictionsModel = PlantSegPredictionsModel(),
     segmentation_model: PlantSegSegmentationModel = PlantSegSegmentationModel(),
     label_name: Optional[str] = None,
+    num_workers: int = 1,
+    block_shape: Optional[tuple[int, ...]] = None,
+    halo: tuple[int, ...] = (8, 32, 32),
+    save_predictions: bool = False,
+    predictions_dtype: PREDICTIONS_DTYPE = "float16",
 ) -> dict[str, Any]:
     """Full PlantSeg workflow.
 
@@ -85,7 +313,32 @@ def plantseg_workflow(
         prediction_model: Parameters for the prediction model.
         segmentation_model: Parameters for the segmentation model.
         label_name: The name of the label to create with the plantseg segmentation.
+        num_workers: Number of processes segmenting the ROIs (or the blocks)
+            in parallel. The ROIs are read, predicted, segmented and written
+            in a pipeline: the predictions run in the task process, one ROI
+            at a time, while the previous ROIs are segmented by the workers.
+        block_shape: If set and no `table_name` is given, the image is
+            segmented block by block instead of all at once, so that the
+            memory is bounded by the block size whatever the image size.
+            The ZYX shape of the blocks, rounded up to the label chunks.
+            Objects crossing the border of a block get a different label
+            in each block.
+        halo: The ZYX margin read and segmented around each block, only the
+            interior of the block is written. Only used with `block_shape`.
+        save_predictions: Whether to save the boundary predictions in the
+            OME-Zarr (in `predictions/`), keyed by a hash of the prediction
+            model, the channel and the level. Predictions saved by a previous
+            run with the same parameters are loaded instead of predicted
+            again, e.g. to try other segmentation parameters.
+        predictions_dtype: The dtype of the saved predictions, "float16" or
+            "uint8" (probabilities quantized to 256 levels, half the size).
+            Only used when new predictions are saved.
     """
+    if num_workers < 1:
+        raise ValueError(f"num_workers must be a positive integer, got {num_workers}.")
+    if block_shape is not None and (len(block_shape) != 3 or len(halo) != 3):
+        raise ValueError("block_shape and halo must be ZYX shapes of length 3.")
+
     ngff_image = NgffImage(zarr_url=zarr_url)
     image = ngff_image.get_multiscale_image(level=level)
 
@@ -95,13 +348,36 @@ def plantseg_workflow(
     label = ngff_image.create_new_label(label_name)
     label = label.change_level(level=level)
 
-    if table_name is None:
+    predictions_cache = None
+    if save_predictions:
+        predictions_cache = open_predictions_cache(
+            ngff_image,
+            prediction_model,
+            channel=channel,
+            level=level,
+            dtype=predictions_dtype,
+        )
+
+    if table_name is None and block_shape is not None:
+        label = _predict_blockwise(
+            image=image,
+            label=label,
+            channel=channel,
+            prediction_model=prediction_model,
+            segmentation_model=segmentation_model,
+            block_shape=block_shape,
+            halo=halo,
+            num_workers=num_workers,
+            predictions_cache=predictions_cache,
+        )
+    elif table_name is None:
         label = _predict_simple(
             image=image,
             label=label,
             channel=channel,
             prediction_model=prediction_model,
             segmentation_model=segmentation_model,
+            predictions_cache=predictions_cache,
         )
     else:
         label = _predict_with_roi(
@@ -112,8 +388,11 @@ def plantseg_workflow(
             prediction_model=prediction_model,
             segmentation_model=segmentation_model,
             table_name=table_name,
+            num_workers=num_workers,
+            predictions_cache=predictions_cache,
         )
     label.consolidate()
+    consolidate_metadata(zarr_url)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+"""Utils to run the converters over a batch of files."""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Optional
+
+from fractal_tasks_core.utils import logger
+
+from plantseg_tasks.task_utils.conversion_manifest import ConversionManifest
+from plantseg_tasks.task_utils.converter_input_models import OMEZarrBuilderParams
+from plantseg_tasks.task_utils.hashing import hash_file
+
+
+def _safe_convert(
+    convert_function: Callable[..., str],
+    kwargs: dict[str, Any],
+    hash_path: Optional[str] = None,
+) -> tuple[Optional[str], Optional[str], Optional[str]]:
+    """Run a single conversion and return (result, error message, file hash).
+
+    If `hash_path` is given, the file is hashed in a thread while it is
+    converted, else the returned hash is None.
+    """
+    with ThreadPoolExecutor(max_workers=1) as hasher:
+        file_hash = None if hash_path is None else hasher.submit(hash_file, hash_path)
+        try:
+            result, error = convert_function(**kwargs), None
+        except Exception as e:
+            logger.exception(f"Conversion failed with arguments {kwargs}")
+            result, error = None, f"{type(e).__name__}: {e}"
+
+        if file_hash is None:
+            return result, error, None
+        try:
+            return result, error, file_hash.result()
+        except OSError as e:
+            logger.warning(f"Could not hash {hash_path}: {e}")
+            return result, error, None
+
+
+def _share_threads(kwargs: dict[str, Any], num_workers: int) -> None:
+    """Share the writer threads of the OME-Zarr parameters between the workers.
+
+    Without this, each worker process would start `num_threads` threads.
+    """
+    params = kwargs.get("ome_zarr_parameters")
+    if num_workers == 1 or not isinstance(params, OMEZarrBuilderParams):
+        return None
+    num_threads = max(1, params.num_threads // num_workers)
+    kwargs["ome_zarr_parameters"] = params.model_copy(
+        update={"num_threads": num_threads}
+    )
+
+
+def run_batch_conversion(
+    convert_function: Callable[..., str],
+    input_arg: str,
+    inputs: list[str],
+    num_workers: int = 1,
+    manifest: Optional[ConversionManifest] = None,
+    resume: bool = False,
+    **kwargs: Any,
+) -> list[Optional[str]]:
+    """Run a converter over a batch of input files.
+
+    Each input is converted independently, a failure is logged and reported
+    for that input only, while the rest of the batch keeps running.
+
+    Args:
+        convert_function: The single file converter. It must be picklable
+            (i.e. defined at module level) if `num_workers > 1`.
+        input_arg: The name of the argument of `convert_function` that
+            receives the input file.
+        inputs: The input files to convert.
+        num_workers: The number of worker processes. If 1, the inputs are
+            converted sequentially in the current process.
+        manifest: If given, the conversions are recorded in the manifest,
+            and `convert_function` must accept a `resume` argument. The
+            files are hashed by the workers, while they are converted.
+        resume: Whether to skip the inputs that the manifest records as
+            already converted, and to resume the interrupted conversions.
+            Ignored if `manifest` is None.
+        **kwargs: Arguments passed to every call of `convert_function`.
+
+    Returns:
+        The results of `convert_function`, in the same order as `inputs`.
+        Failed conversions are reported as None.
+    """
+    if num_workers < 1:
+        raise ValueError(f"num_workers must be a positive integer, got {num_workers}.")
+
+    if len(inputs) == 0:
+        return []
+
+    outcomes: list[tuple[Optional[str], Optional[str]]] = [(None, None)] * len(inputs)
+    pending, hash_paths = {}, {}
+    for idx, _input in enumerate(inputs):
+        input_kwargs = {input_arg: str(_input), **kwargs}
+        if manifest is not None:
+            completed = manifest.completed_output(_input, kwargs) if resume else None
+            if completed is not None:
+                logger.info(f"Skipping {_input}, already converted to {completed}")
+                outcomes[idx] = (completed, None)
+                continue
+            input_kwargs["resume"] = resume and manifest.is_interrupted(_input, kwargs)
+            manifest.mark_started(_input, kwargs)
+            if manifest.needs_hash(_input):
+                hash_paths[idx] = str(_input)
+        pending[idx] = input_kwargs
+
+    def _record(
+        idx: int, outcome: tuple[Optional[str], Optional[str], Optional[str]]
+    ) -> None:
+        result, error, file_hash = outcome
+        outcomes[idx] = (result, error)
+        if manifest is not None and error is None:
+            manifest.mark_complete(inputs[idx], result, file_hash=file_hash)
+
+    num_workers = min(num_workers, max(1, len(pending)))
+    for kw in pending.values():
+        _share_threads(kw, num_workers)
+    if num_workers == 1:
+        for idx, kw in pending.items():
+            _record(idx, _safe_convert(convert_function, kw, hash_paths.get(idx)))
+    else:
+        logger.info(f"Converting {len(pending)} files with {num_workers} processes.")
+        # "spawn" avoids forking a process that already runs dask/zarr threads
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=num_workers, mp_context=mp_context
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _safe_convert, convert_function, kw, hash_paths.get(idx)
+                ): idx
+                for idx, kw in pending.items()
+            }
+            # record each conversion as soon as it finishes, so that it is
+            # not lost if the batch is interrupted
+            for future in as_completed(futures):
+                _record(futures[future], future.result())
+
+    failures = [
+        (_input, error)
+        for _input, (_, error) in zip(inputs, outcomes)
+        if error is not None
+    ]
+    for _input, error in failures:
+        logger.error(f"Failed to convert {_input}: {error}")
+
+    if len(failures) == len(inputs):
+        raise ValueError(
+            f"All {len(inputs)} conversions failed. First error: {failures[0][1]}"
+        )
+
+    if len(failures) > 0:
+        logger.warning(
+            f"{len(failures)} out of {len(inputs)} conversions failed, "
+            "see the errors above."
+        )
+
+    return [result for result, _ in outcomes]
@@ -0,0 +1,116 @@
+"""Chunk shape planning for the converters output."""
+
+from itertools import product
+from typing import Literal, Optional
+
+import numpy as np
+
+CHUNK_ACCESS_PATTERN = Literal["volume", "plane"]
+
+
+def _fit_extents(
+    shape: list[int], weights: list[float], num_voxels: float
+) -> list[int]:
+    """Find extents proportional to `weights`, with a product of `num_voxels`.
+
+    Extents are capped to the `shape`, and the budget left by a capped axis
+    is redistributed over the remaining axes.
+    """
+    extents = [0] * len(shape)
+    free_axes = list(range(len(shape)))
+    budget = num_voxels
+    while free_axes:
+        weights_prod = np.prod([weights[ax] for ax in free_axes])
+        k = (budget / weights_prod) ** (1 / len(free_axes))
+        capped = [ax for ax in free_axes if round(k * weights[ax]) >= shape[ax]]
+        if not capped:
+            for ax in free_axes:
+                extents[ax] = max(1, round(k * weights[ax]))
+            break
+
+        for ax in capped:
+            extents[ax] = shape[ax]
+            budget /= shape[ax]
+            free_axes.remove(ax)
+    return extents
+
+
+def plan_chunks(
+    shape: tuple[int, ...],
+    dtype: np.dtype,
+    target_chunk_size_mb: float = 4,
+    access_pattern: CHUNK_ACCESS_PATTERN = "volume",
+    voxel_size: Optional[tuple[float, ...]] = None,
+) -> tuple[int, ...]:
+    """Plan the chunk shape of an image in the standard (C)ZYX layout.
+
+    Non spatial leading axes (e.g. channels) are always chunked one by one.
+
+    Args:
+        shape: The shape of the array, the last three axes must be ZYX.
+        dtype: The data type of the array.
+        target_chunk_size_mb: The target size of a single chunk in MB.
+        access_pattern: The expected way the data will be read.
+            "volume" creates 3D chunks that are isotropic in physical space,
+            to make 3D ROI reads cheap. "plane" creates single Z plane chunks
+            tiled over YX, to make 2D plane reads cheap.
+        voxel_size: The ZYX voxel size, used to make "volume" chunks isotropic
+            in physical space. If None, chunks are isotropic in voxels.
+    """
+    if len(shape) < 3:
+        raise ValueError(f"Expected at least a ZYX shape, got {shape}.")
+
+    itemsize = np.dtype(dtype).itemsize
+    num_voxels = max(1.0, target_chunk_size_mb * 1024**2 / itemsize)
+    spatial_shape = list(shape[-3:])
+
+    if access_pattern == "plane":
+        yx_extents = _fit_extents(spatial_shape[1:], [1.0, 1.0], num_voxels)
+        spatial_chunks = [1, *yx_extents]
+    elif access_pattern == "volume":
+        if voxel_size is None:
+            voxel_size = (1.0, 1.0, 1.0)
+        weights = [1.0 / max(vs, 1e-12) for vs in voxel_size]
+        spatial_chunks = _fit_extents(spatial_shape, weights, num_voxels)
+    else:
+        raise ValueError(f"Unknown access pattern: {access_pattern}.")
+
+    leading_chunks = [1] * (len(shape) - 3)
+    return tuple(leading_chunks + spatial_chunks)
+
+
+def plan_blocks(
+    shape: tuple[int, ...],
+    block_shape: tuple[int, ...],
+    chunks: tuple[int, ...],
+    halo: tuple[int, ...],
+) -> list[tuple[tuple[slice, ...], tuple[slice, ...]]]:
+    """Tile a volume in chunk aligned blocks, each with a halo around it.
+
+    The block shape is rounded up to a multiple of `chunks` (and capped to
+    `shape`), so that the interiors of the blocks never share a chunk and
+    can be written independently. The blocks are listed in C order.
+
+    Args:
+        shape: The shape of the volume.
+        block_shape: The minimal shape of the interior of a block.
+        chunks: The chunk shape of the array the blocks are written to.
+        halo: The margin read around each block, on each side.
+
+    Returns:
+        For each block, the slices of its interior and the slices of its
+        interior plus the halo, clipped to the volume.
+    """
+    steps = [min(-(-b // c) * c, s) for b, c, s in zip(block_shape, chunks, shape)]
+    blocks = []
+    for starts in product(*[range(0, s, step) for s, step in zip(shape, steps)]):
+        inner = tuple(
+            slice(start, min(start + step, s))
+            for start, step, s in zip(starts, steps, shape)
+        )
+        outer = tuple(
+            slice(max(0, _slice.start - h), min(s, _slice.stop + h))
+            for _slice, h, s in zip(inner, halo, shape)
+        )
+        blocks.append((inner, outer))
+    return blocks
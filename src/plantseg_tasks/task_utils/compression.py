@@ -0,0 +1,172 @@
+"""Compression codecs for the arrays written by the tasks."""
+
+import time
+from itertools import product
+from typing import Any, Literal, Optional, Union
+
+import h5py
+import numpy as np
+from fractal_tasks_core.utils import logger
+from numcodecs import Blosc, Shuffle, Zlib
+from numcodecs.abc import Codec
+
+COMPRESSION_CODEC = Literal["default", "auto", "zstd", "lz4", "none"]
+SHUFFLE_FILTER = Literal["byte", "bit", "none"]
+
+_BLOSC_SHUFFLE = {
+    "byte": Blosc.SHUFFLE,
+    "bit": Blosc.BITSHUFFLE,
+    "none": Blosc.NOSHUFFLE,
+}
+
+# Candidates benchmarked by the "auto" mode
+_AUTO_CANDIDATES = list(product(["lz4", "zstd"], ["byte", "bit"], [3, 5]))
+# Bandwidth (in MB/s) of the storage the arrays are read from, used to weight
+# the compression ratio against the decoding speed in the "auto" mode
+_AUTO_READ_BANDWIDTH_MBS = 200
+_AUTO_MAX_SAMPLES = 8
+
+Compressor = Union[Codec, Literal["default"], None]
+
+
+def _blosc(cname: str, shuffle: SHUFFLE_FILTER, clevel: int) -> Blosc:
+    return Blosc(cname=cname, clevel=clevel, shuffle=_BLOSC_SHUFFLE[shuffle])
+
+
+def sample_chunks(
+    data: Any, chunks: tuple[int, ...], max_samples: int = _AUTO_MAX_SAMPLES
+) -> list[np.ndarray]:
+    """Read up to `max_samples` chunks, evenly spread over the chunk grid.
+
+    The data only needs to support slicing, so lazy arrays
+    (h5py datasets, zarr arrays, layout views) are only partially read.
+    """
+    grid = [len(range(0, size, chunk)) for size, chunk in zip(data.shape, chunks)]
+    num_chunks = int(np.prod(grid))
+    if num_chunks == 0:
+        return []
+
+    num_samples = min(num_chunks, max_samples)
+    flat_indices = np.unique(np.linspace(0, num_chunks - 1, num_samples).astype(int))
+    samples = []
+    for flat_idx in flat_indices:
+        chunk_idx = np.unravel_index(flat_idx, grid)
+        slices = tuple(
+            slice(i * chunk, min((i + 1) * chunk, size))
+            for i, chunk, size in zip(chunk_idx, chunks, data.shape)
+        )
+        samples.append(np.ascontiguousarray(data[slices]))
+    return samples
+
+
+def _estimated_read_time(compressor: Codec, samples: list[np.ndarray]) -> float:
+    """Estimate the time (in s) to read and decode the samples from storage."""
+    compressed_bytes, decode_time = 0, 0.0
+    for sample in samples:
+        encoded = compressor.encode(sample)
+        compressed_bytes += len(encoded)
+        # best of two to smooth out the timing noise
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            compressor.decode(encoded)
+            timings.append(time.perf_counter() - start)
+        decode_time += min(timings)
+    return compressed_bytes / (_AUTO_READ_BANDWIDTH_MBS * 1024**2) + decode_time
+
+
+def _fallback_compressor(dtype: np.dtype) -> Codec:
+    """Compressor used by the "auto" mode when there is no data to sample."""
+    shuffle = "bit" if np.dtype(dtype).itemsize > 1 else "byte"
+    return _blosc("zstd", shuffle=shuffle, clevel=5)
+
+
+def auto_select_compressor(samples: list[np.ndarray], dtype: np.dtype) -> Codec:
+    """Select the Blosc compressor with the shortest estimated read time.
+
+    Every candidate compresses the samples, and the read time is estimated
+    as the time to fetch the compressed bytes from storage plus the time
+    to decode them. This trades the compression ratio against the decoding
+    speed for the actual data (and dtype) to be written.
+    """
+    samples = [sample for sample in samples if sample.size > 0]
+    if len(samples) == 0:
+        return _fallback_compressor(dtype)
+
+    best_compressor, best_time = None, float("inf")
+    for cname, shuffle, clevel in _AUTO_CANDIDATES:
+        compressor = _blosc(cname, shuffle=shuffle, clevel=clevel)
+        read_time = _estimated_read_time(compressor, samples)
+        if read_time < best_time:
+            best_compressor, best_time = compressor, read_time
+
+    logger.info(f"Auto selected compressor {best_compressor} for dtype {dtype}.")
+    return best_compressor
+
+
+def get_compressor(
+    codec: COMPRESSION_CODEC = "default",
+    shuffle: SHUFFLE_FILTER = "byte",
+    clevel: int = 5,
+    data: Optional[Any] = None,
+    chunks: Optional[tuple[int, ...]] = None,
+    dtype: Optional[np.dtype] = None,
+) -> Compressor:
+    """Build the compressor to pass to zarr when creating an array.
+
+    Args:
+        codec: "default" keeps the zarr default compressor, "none" disables
+            compression, "zstd" and "lz4" use Blosc with that codec, and "auto"
+            benchmarks several Blosc codecs on a sample of chunks of `data`.
+        shuffle: The Blosc shuffle filter, ignored by "auto".
+        clevel: The Blosc compression level, ignored by "auto".
+        data: The data to sample in "auto" mode. If None, a dtype based
+            default is used.
+        chunks: The chunk shape of the array to write, used to sample `data`.
+        dtype: The dtype of the array to write, defaults to `data.dtype`.
+    """
+    if codec == "default":
+        return "default"
+    if codec == "none":
+        return None
+    if codec in ("zstd", "lz4"):
+        return _blosc(codec, shuffle=shuffle, clevel=clevel)
+    if codec != "auto":
+        raise ValueError(f"Unknown compression codec: {codec}.")
+
+    if data is None:
+        return _fallback_compressor(dtype)
+
+    dtype = data.dtype if dtype is None else np.dtype(dtype)
+    chunks = data.shape if chunks is None else chunks
+    # benchmark the samples with the dtype they will be written with
+    samples = [sample.astype(dtype) for sample in sample_chunks(data, chunks)]
+    return auto_select_compressor(samples, dtype=dtype)
+
+
+def get_h5_chunk_codecs(
+    dataset: h5py.Dataset,
+) -> Optional[tuple[Optional[Codec], list[Codec]]]:
+    """Map the HDF5 filters of a chunked dataset to zarr codecs.
+
+    If the chunks of `dataset` can be decoded by zarr as they are stored,
+    the zarr compressor and filters doing so are returned, else None. Only
+    the gzip (deflate, mapped to zlib) and shuffle filters are supported,
+    and the fill value must be the zarr default (zero), so that chunks
+    never written in the HDF5 file read the same in zarr.
+    """
+    if dataset.chunks is None or dataset.fillvalue != 0:
+        return None
+
+    create_plist = dataset.id.get_create_plist()
+    compressor, filters = None, []
+    for ind_filter in range(create_plist.get_nfilters()):
+        code, _, values, _ = create_plist.get_filter(ind_filter)
+        if code == h5py.h5z.FILTER_SHUFFLE and compressor is None:
+            filters.append(Shuffle(elementsize=dataset.dtype.itemsize))
+        elif code == h5py.h5z.FILTER_DEFLATE and compressor is None:
+            compressor = Zlib(level=values[0] if len(values) > 0 else 6)
+        else:
+            # any other filter, or a filter applied after the compression
+            return None
+    return compressor, filters
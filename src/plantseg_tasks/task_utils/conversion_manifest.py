@@ -0,0 +1,137 @@
+"""Manifest of the files converted to OME-Zarr, used to resume a batch."""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+from fractal_tasks_core.utils import logger
+
+from plantseg_tasks.task_utils.converter_input_models import OMEZarrBuilderParams
+from plantseg_tasks.task_utils.hashing import hash_file, hash_params
+
+MANIFEST_FILE = ".conversion_manifest.json"
+_MANIFEST_VERSION = 1
+
+# Arguments that change how a file is converted, but not the converted output
+# (`num_workers` and `resume` are not part of the hashed parameters at all)
+_RUNTIME_ARGS = ("streaming",)
+_RUNTIME_OME_ZARR_FIELDS = {"num_threads", "max_slab_size_mb", "fused_pyramid"}
+
+
+def hash_conversion_params(params: dict[str, Any]) -> str:
+    """Compute a hash of the conversion parameters that affect the output."""
+    params = {k: v for k, v in params.items() if k not in _RUNTIME_ARGS}
+    ome_zarr_parameters = params.get("ome_zarr_parameters")
+    if isinstance(ome_zarr_parameters, OMEZarrBuilderParams):
+        params["ome_zarr_parameters"] = ome_zarr_parameters.model_dump(
+            mode="json", exclude=_RUNTIME_OME_ZARR_FIELDS
+        )
+    return hash_params(params)
+
+
+class ConversionManifest:
+    """Record of the conversions run in a `zarr_dir`.
+
+    For every source file, the manifest stores its size, mtime and content
+    hash, the hash of the conversion parameters, the output OME-Zarr and
+    whether the conversion finished. A source is converted again only if
+    any of these changed, or if the output is missing. The content is only
+    hashed by the worker converting the file, or when the size or mtime of
+    a converted file changed.
+
+    The manifest is a JSON file in `zarr_dir`. It is only written by the
+    process that runs the batch, never by the worker processes.
+    """
+
+    def __init__(self, zarr_dir: str):
+        """Load the manifest of `zarr_dir`, if any."""
+        self.path = Path(zarr_dir) / MANIFEST_FILE
+        self.entries: dict[str, dict[str, Any]] = {}
+        if self.path.exists():
+            try:
+                manifest = json.loads(self.path.read_text())
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring the corrupted manifest {self.path}")
+            else:
+                if manifest.get("version") == _MANIFEST_VERSION:
+                    self.entries = manifest["files"]
+
+    @staticmethod
+    def _key(source: str) -> str:
+        return str(Path(source).resolve())
+
+    @staticmethod
+    def _stat(source: str) -> dict[str, Any]:
+        stat = os.stat(source)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def needs_hash(self, source: str) -> bool:
+        """Whether the content hash of a started conversion is still missing."""
+        return self.entries[self._key(source)]["hash"] is None
+
+    def completed_output(self, source: str, params: dict[str, Any]) -> Optional[str]:
+        """Return the output of `source` if it is already converted, else None."""
+        entry = self.entries.get(self._key(source))
+        if entry is None or entry["status"] != "complete":
+            return None
+        if entry["params_hash"] != hash_conversion_params(params):
+            return None
+        if not Path(entry["zarr_url"]).exists():
+            return None
+        state = self._stat(source)
+        if any(entry[k] != v for k, v in state.items()):
+            # the file was touched, its content is hashed to check if it changed
+            if entry["hash"] is None or hash_file(source) != entry["hash"]:
+                return None
+            entry.update(state)
+            self.save()
+        return entry["zarr_url"]
+
+    def is_interrupted(self, source: str, params: dict[str, Any]) -> bool:
+        """Check if the conversion of `source` was started but did not finish."""
+        entry = self.entries.get(self._key(source))
+        if entry is None or entry["status"] != "started":
+            return False
+        if entry["params_hash"] != hash_conversion_params(params):
+            return False
+        state = self._stat(source)
+        return all(entry[k] == v for k, v in state.items())
+
+    def mark_started(self, source: str, params: dict[str, Any]) -> None:
+        """Record that the conversion of `source` started.
+
+        The content is not hashed here, the hash recorded before is kept if
+        the size and mtime did not change, else it is left to be computed
+        along with the conversion and given to `mark_complete`.
+        """
+        state = self._stat(source)
+        entry = self.entries.get(self._key(source), {})
+        unchanged = all(entry.get(k) == v for k, v in state.items())
+        self.entries[self._key(source)] = {
+            **state,
+            "hash": entry.get("hash") if unchanged else None,
+            "params_hash": hash_conversion_params(params),
+            "zarr_url": None,
+            "status": "started",
+        }
+        self.save()
+
+    def mark_complete(
+        self, source: str, zarr_url: str, file_hash: Optional[str] = None
+    ) -> None:
+        """Record that the conversion of `source` to `zarr_url` finished."""
+        entry = self.entries[self._key(source)]
+        entry["zarr_url"] = str(zarr_url)
+        entry["status"] = "complete"
+        if file_hash is not None:
+            entry["hash"] = file_hash
+        self.save()
+
+    def save(self) -> None:
+        """Write the manifest, atomically replacing the previous one."""
+        manifest = {"version": _MANIFEST_VERSION, "files": self.entries}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(tmp_path, self.path)
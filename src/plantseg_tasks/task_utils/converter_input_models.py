@@ -2,10 +2,14 @@
 
 from enum import StrEnum
 from pathlib import Path
-from typing import Literal
+from typing import Literal, Optional
 
 from pydantic import BaseModel, Field  # , field_validator
 
+from plantseg_tasks.task_utils.chunking import CHUNK_ACCESS_PATTERN
+from plantseg_tasks.task_utils.compression import COMPRESSION_CODEC, SHUFFLE_FILTER
+from plantseg_tasks.task_utils.pyramids import LABEL_DOWNSAMPLING
+
 ALLOWED_TIFF_EXTENSIONS = [".tiff", ".tif"]
 ALLOWED_H5_EXTENSIONS = [".h5", ".hdf5"]
 
@@ -150,6 +154,27 @@ class CustomAxisInputModel(BaseModel):
     channel_names: list[str] = Field(default_factory=_default_channels_names)
 
 
+class CompressionParams(BaseModel):
+    """Compression of the arrays written in the OME-Zarr.
+
+    Attributes:
+        codec: The compression codec. "default" keeps the zarr default
+            compressor, "none" disables compression, "zstd" and "lz4" use the
+            Blosc compressor with that codec. "auto" compresses a sample of
+            chunks with several Blosc codecs and picks the one with the best
+            trade-off between compression ratio and decoding speed. The image
+            and the label are tuned independently.
+        shuffle: The Blosc shuffle filter, one of "byte", "bit" or "none".
+            Ignored if codec is "auto".
+        clevel: The Blosc compression level, from 1 to 9.
+            Ignored if codec is "auto".
+    """
+
+    codec: COMPRESSION_CODEC = "default"
+    shuffle: SHUFFLE_FILTER = "byte"
+    clevel: int = Field(default=5, ge=1, le=9)
+
+
 class OMEZarrBuilderParams(BaseModel):
     """Parameters for the OME-Zarr builder.
 
@@ -159,10 +184,48 @@ class OMEZarrBuilderParams(BaseModel):
         scaling_factor_XY: The factor to downsample the XY plane.
             Default is 2, meaning every layer is half the size over XY.
         scaling_factor_Z: The factor to downsample the Z plane.
-            Default is 1, no scaling on Z.
+            Default is 1, no scaling on Z. Single plane images are never
+            downsampled along Z.
         create_all_ome_axis: Whether to create all OME axis.
             Default is True, meaning that missing axis will be created
             with a sigleton dimension.
+        max_slab_size_mb: Upper bound (in MB) for the size of a single slab
+            written to the full resolution level. The data is written slab
+            by slab along Z, so this bounds the peak memory when streaming.
+            Default is 512 MB.
+        chunk_access_pattern: The expected way the data will be read, used to
+            plan the chunk shape. "volume" creates 3D chunks (isotropic in
+            physical space) for cheap 3D ROI reads, "plane" creates single
+            Z plane chunks for cheap 2D plane reads. Default is "volume".
+        target_chunk_size_mb: The target size of a single chunk in MB.
+            The same chunk shape is used for the image, the label
+            and all the pyramid levels. Default is 4 MB.
+        compression: The compression of the image, label and pyramid arrays.
+        fused_pyramid: Whether to build all the pyramid levels in a single
+            pass, while the full resolution level is written. If False, each
+            level is built by reading back the previous one from storage.
+            Default is True.
+        label_downsampling: How the label pyramid is downsampled. "mode" keeps
+            the most frequent label ID of each block, "strided" keeps the first
+            voxel of each block (fastest). Both only use label IDs present in
+            the full resolution label. Default is "mode".
+        minimal_label_dtype: Whether to write the label with the smallest
+            unsigned dtype (uint8, uint16, uint32 or uint64) that fits its
+            maximum ID, instead of the dtype of the input file. When
+            streaming, this reads the label once more before writing it.
+            Labels with negative IDs keep their dtype. Default is False.
+        num_threads: The number of threads used to write the OME-Zarr. The
+            image and the label are written concurrently, and the chunks of
+            each array are encoded in parallel. When files are converted by
+            several worker processes, the threads are shared between the
+            workers. Default is 1.
+        copy_source_chunks: Whether to copy the compressed chunks of a chunked
+            HDF5 dataset to the full resolution level as they are, without
+            decoding and encoding them again. Only used when streaming, and
+            only if the HDF5 filters map to zarr codecs (gzip and shuffle).
+            The chunk shape and compression of the dataset are then used for
+            every level, instead of the planned chunks and the compression
+            parameters. Default is False.
     """
 
     number_multiscale: int = Field(default=4, ge=0)
@@ -174,3 +237,80 @@ class OMEZarrBuilderParams(BaseModel):
     )
     scaling_factor_Z: int = Field(default=1, ge=1, le=10)
     create_all_ome_axis: bool = True
+    max_slab_size_mb: int = Field(default=512, ge=1, title="Max Slab Size (MB)")
+    chunk_access_pattern: CHUNK_ACCESS_PATTERN = "volume"
+    target_chunk_size_mb: float = Field(default=4, gt=0, title="Target Chunk Size (MB)")
+    compression: CompressionParams = Field(default_factory=CompressionParams)
+    fused_pyramid: bool = True
+    label_downsampling: LABEL_DOWNSAMPLING = "mode"
+    minimal_label_dtype: bool = False
+    num_threads: int = Field(default=1, ge=1)
+    copy_source_chunks: bool = False
+
+
+class InitArgsH5Converter(BaseModel):
+    """Arguments to be passed from the H5 converter init to the compute task.
+
+    Attributes:
+        zarr_dir (str): Output path to save the OME-Zarr file.
+        input_path (str): Input path to the single H5 file to convert.
+        image_key (str): The image key in the H5 file where the image is stored.
+        channel_keys (Optional[list[str]]): Keys of additional images in the H5
+            file, converted as further channels of the image.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
+        label_key (Optional[str]): The label key in the H5 file
+            where a label/segmentation is stored.
+        new_image_key (Optional[str]): New key for the image data to
+            be stored in the OME-Zarr.
+        new_label_key (Optional[str]): New key for the label data to
+            be stored in the OME-Zarr.
+        custom_axis (CustomAxisInputModel): Custom axes to add to the OME-Zarr file.
+        ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr
+            builder.
+        streaming (bool): Whether to stream the H5 datasets into the OME-Zarr.
+    """
+
+    zarr_dir: str
+    input_path: str
+    image_key: str = "raw"
+    channel_keys: Optional[list[str]] = None
+    image_layout: VALID_IMAGE_LAYOUT = VALID_IMAGE_LAYOUT.ZYX
+    label_key: Optional[str] = None
+    new_image_key: Optional[str] = None
+    new_label_key: Optional[str] = None
+    custom_axis: CustomAxisInputModel = Field(default_factory=CustomAxisInputModel)
+    ome_zarr_parameters: OMEZarrBuilderParams = Field(
+        default_factory=OMEZarrBuilderParams
+    )
+    streaming: bool = False
+
+
+class InitArgsTiffConverter(BaseModel):
+    """Arguments to be passed from the TIFF converter init to the compute task.
+
+    Attributes:
+        zarr_dir (str): Output path to save the OME-Zarr file.
+        image_path (str): Input path to the single TIFF file to convert.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
+        label_path (Optional[str]): Input path to the label TIFF file.
+        new_image_key (str): New key for the image data to
+            be stored in the OME-Zarr.
+        new_label_key (str): New key for the label data to
+            be stored in the OME-Zarr.
+        custom_axis (CustomAxisInputModel): Custom axes to add to the OME-Zarr file.
+        ome_zarr_parameters (OMEZarrBuilderParams): Parameters for the OME-Zarr
+            builder.
+        streaming (bool): Whether to stream the TIFF files into the OME-Zarr.
+    """
+
+    zarr_dir: str
+    image_path: str
+    image_layout: VALID_IMAGE_LAYOUT = VALID_IMAGE_LAYOUT.ZYX
+    label_path: Optional[str] = None
+    new_image_key: str = "raw"
+    new_label_key: str = "label"
+    custom_axis: CustomAxisInputModel = Field(default_factory=CustomAxisInputModel)
+    ome_zarr_parameters: OMEZarrBuilderParams = Field(
+        default_factory=OMEZarrBuilderParams
+    )
+    streaming: bool = False
@@ -0,0 +1,32 @@
+"""Hashes of files and parameters, used to decide if results can be reused."""
+
+import hashlib
+import json
+from typing import Any
+
+_HASH_BLOCK_SIZE = 8 * 1024**2
+
+
+def hash_file(path: str) -> str:
+    """Compute the blake2b hash of the content of a file, block by block."""
+    file_hash = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while block := f.read(_HASH_BLOCK_SIZE):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def _to_json(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    return str(value)
+
+
+def hash_params(params: dict[str, Any]) -> str:
+    """Compute the blake2b hash of a dict of parameters.
+
+    Pydantic models are hashed through their JSON dump, and any other value
+    that is not JSON serializable through its string representation.
+    """
+    params_json = json.dumps(params, sort_keys=True, default=_to_json)
+    return hashlib.blake2b(params_json.encode(), digest_size=16).hexdigest()
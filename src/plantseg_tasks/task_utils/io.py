@@ -1,38 +1,195 @@
 """IO utils for Converters."""
 
-from dataclasses import dataclass
+import json
+import math
+import os
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, replace
+from functools import partial
+from itertools import product
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional, Union
 
+import h5py
 import numpy as np
+import tifffile
 import zarr
 import zarr.storage
 from fractal_tasks_core import __OME_NGFF_VERSION__
 from fractal_tasks_core.ngff.specs import (
     Axis,
+    Channel,
     Dataset,
     Multiscale,
     NgffImageMeta,
+    Omero,
     ScaleCoordinateTransformation,
 )
-from fractal_tasks_core.pyramids import build_pyramid
+from fractal_tasks_core.utils import logger
 from plantseg.io import load_h5, load_tiff
 
+from plantseg_tasks.ngio.ngff.zarr_utils import consolidate_metadata
+from plantseg_tasks.task_utils.chunking import plan_chunks
+from plantseg_tasks.task_utils.compression import (
+    get_compressor,
+    get_h5_chunk_codecs,
+)
 from plantseg_tasks.task_utils.converter_input_models import (
     VALID_IMAGE_LAYOUT,
     CustomAxisInputModel,
     OMEZarrBuilderParams,
 )
+from plantseg_tasks.task_utils.pyramids import (
+    build_pyramid,
+    coarsen,
+    get_label_aggregation_function,
+    pyramid_factors,
+    pyramid_shapes,
+)
+
+_PROGRESS_FILE = ".conversion_progress.json"
+
+_phase_timings: Optional[dict[str, float]] = None
+_phase_timings_lock = threading.Lock()
+
+
+@contextmanager
+def record_phase_timings() -> Iterator[dict[str, float]]:
+    """Record the time spent in each phase of the OME-Zarr writes.
+
+    Within the context, the writes of `create_ome_zarr` add up the seconds
+    spent in each phase to the yielded dict:
+
+    - read: loading the source files, or reading their slabs when streaming
+      (including the layout conversion),
+    - level_0_write: encoding and writing the full resolution level,
+    - pyramid: computing and writing the lower resolution levels.
+
+    The time of the arrays written concurrently (e.g. the image and its
+    label) is summed, so the total can exceed the wall time.
+    """
+    global _phase_timings
+    timings = {"read": 0.0, "level_0_write": 0.0, "pyramid": 0.0}
+    _phase_timings = timings
+    try:
+        yield timings
+    finally:
+        _phase_timings = None
+
+
+@contextmanager
+def _timed(phase: str) -> Iterator[None]:
+    """Add the time spent in the context to `phase`, if timings are recorded."""
+    if _phase_timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _phase_timings_lock:
+            if _phase_timings is not None:
+                _phase_timings[phase] += elapsed
+
+
+class StandardLayoutView:
+    """Lazy view of an array-like in the standard layout.
+
+    The source (e.g. a h5py dataset or a numpy array) is never loaded or
+    copied as a whole, the layout conversion is applied only to the region
+    requested through slicing. Axes missing in the source are added as
+    singletons, singleton axes of the source missing in the standard layout
+    (e.g. the channel of a label) are dropped.
+    """
+
+    def __init__(self, source: Any, current_layout: str, standard_layout: str):
+        """Initialize the view from a source array-like and its layout."""
+        self.source = source
+        self.current_layout = current_layout
+        self.standard_layout = standard_layout
+
+        present_axes = [ax for ax in standard_layout if ax in current_layout]
+        dropped_axes = [ax for ax in current_layout if ax not in standard_layout]
+        for ax in dropped_axes:
+            if source.shape[current_layout.index(ax)] != 1:
+                raise ValueError(
+                    f"Axis {ax} of the {current_layout} data is not a singleton,"
+                    f" it can not be converted to the {standard_layout} layout."
+                )
+        # dropped (singleton) axes are moved last and removed by the reshape
+        self._transpose_order = tuple(
+            current_layout.index(ax) for ax in present_axes + dropped_axes
+        )
+        self._shape = tuple(
+            source.shape[current_layout.index(ax)] if ax in current_layout else 1
+            for ax in standard_layout
+        )
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """Shape of the data in the standard layout."""
+        return self._shape
+
+    @property
+    def ndim(self) -> int:
+        """Number of dimensions in the standard layout."""
+        return len(self._shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Data type of the source."""
+        return np.dtype(self.source.dtype)
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Read a region (given in the standard layout) from the source."""
+        if key is Ellipsis:
+            key = ()
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        source_key = [slice(None)] * len(self.current_layout)
+        out_shape = []
+        for ax, _slice, size in zip(self.standard_layout, key, self.shape):
+            if not isinstance(_slice, slice):
+                raise ValueError("Only slices are supported to index a lazy image.")
+            start, stop, step = _slice.indices(size)
+            if step != 1:
+                raise ValueError("Only contiguous slices are supported.")
+            out_shape.append(max(stop - start, 0))
+            if ax in self.current_layout:
+                source_key[self.current_layout.index(ax)] = slice(start, stop)
+
+        data = np.asarray(self.source[tuple(source_key)])
+        if self._transpose_order != tuple(range(data.ndim)):
+            data = np.transpose(data, self._transpose_order)
+        return data.reshape(out_shape)
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        """Load the full view in memory."""
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
 
 
 def to_standard_layout(
-    image_data: np.ndarray,
+    image_data: Any,
     current_layout: VALID_IMAGE_LAYOUT,
     voxel_size: tuple = (1, 1, 1),
     standard_layout="CZYX",
 ):
-    """Convert any layout to standard layout."""
-    layout_as_str = current_layout.value
+    """Convert any layout to standard layout.
+
+    The conversion is lazy, the data is wrapped in a `StandardLayoutView` and
+    the transpose is only applied to the regions read from it (e.g. slab by
+    slab at write time), so the full volume is never copied.
+    Data already in the standard layout is returned as is.
+    """
+    layout_as_str = VALID_IMAGE_LAYOUT(current_layout).value
 
     if len(layout_as_str) != image_data.ndim:
         raise ValueError(
@@ -41,21 +198,6 @@ def to_standard_layout(
             f" dimensions and shape {layout_as_str}. Please provide a different layout."
         )
 
-    axis_shape = {ax: 1 for ax in standard_layout}
-    axis_pos = {ax: None for i, ax in enumerate(standard_layout)}
-
-    for index, ax in enumerate(layout_as_str):
-        axis_shape[ax] = image_data.shape[index]
-        axis_pos[ax] = index
-
-    transpose_order = tuple(
-        [axis_pos[ax] for ax in standard_layout if axis_pos[ax] is not None]
-    )
-    if transpose_order != tuple(range(image_data.ndim)):
-        image_data = np.transpose(image_data, transpose_order)
-
-    image_data = image_data.reshape(tuple(axis_shape.values()))
-
     if len(standard_layout) == 3:
         scale = voxel_size
     elif len(standard_layout) == 4:
@@ -63,15 +205,113 @@ def to_standard_layout(
     else:
         raise ValueError("Invalid number of dimensions.")
 
-    return image_data, scale
+    if layout_as_str == standard_layout:
+        return image_data, scale
+
+    view = StandardLayoutView(
+        image_data, current_layout=layout_as_str, standard_layout=standard_layout
+    )
+    return view, scale
+
+
+class ChannelStackView:
+    """Lazy stack of several images along the channel axis.
+
+    Each image (e.g. a h5py dataset per channel) must be in the "CZYX"
+    layout, and all images must have the same ZYX shape. Only the images
+    overlapping the requested region are read, so a slab of a single
+    channel never reads the other channels.
+    """
+
+    def __init__(self, channels: list[Any]):
+        """Initialize the view from a list of "CZYX" array-likes."""
+        spatial_shapes = {tuple(channel.shape[1:]) for channel in channels}
+        if len(spatial_shapes) != 1:
+            raise ValueError(
+                f"All the channels must have the same ZYX shape, got {spatial_shapes}."
+            )
+        self.channels = channels
+        self._offsets = np.cumsum([0] + [channel.shape[0] for channel in channels])
+        self._shape = (int(self._offsets[-1]), *spatial_shapes.pop())
+        self._dtype = np.result_type(*[channel.dtype for channel in channels])
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """Shape of the stacked data."""
+        return self._shape
+
+    @property
+    def ndim(self) -> int:
+        """Number of dimensions of the stacked data."""
+        return len(self._shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Data type of the stacked data, common to all channels."""
+        return self._dtype
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Read a region of the stacked data."""
+        if key is Ellipsis:
+            key = ()
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if not isinstance(key[0], slice):
+            raise ValueError("Only slices are supported to index a lazy image.")
+
+        start, stop, step = key[0].indices(self.shape[0])
+        if step != 1:
+            raise ValueError("Only contiguous slices are supported.")
+
+        blocks = []
+        for channel, offset in zip(self.channels, self._offsets):
+            channel_start = max(start - offset, 0)
+            channel_stop = min(stop - offset, channel.shape[0])
+            if channel_start >= channel_stop:
+                continue
+            block = channel[(slice(channel_start, channel_stop), *key[1:])]
+            blocks.append(np.asarray(block, dtype=self.dtype))
+
+        if len(blocks) == 0:
+            out_shape = [0] + [
+                len(range(*k.indices(s))) for k, s in zip(key[1:], self.shape[1:])
+            ]
+            return np.empty(out_shape, dtype=self.dtype)
+        return blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=0)
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        """Load the full stack in memory."""
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+
+def stack_channels(
+    channels: list[Any], layout: VALID_IMAGE_LAYOUT
+) -> tuple[Any, VALID_IMAGE_LAYOUT]:
+    """Lazily stack images stored separately into a single multichannel image.
+
+    Returns the stacked data and its layout. A single image is returned as is.
+    """
+    if len(channels) == 1:
+        return channels[0], layout
+
+    channels = [
+        to_standard_layout(channel, current_layout=layout)[0] for channel in channels
+    ]
+    return ChannelStackView(channels), VALID_IMAGE_LAYOUT.CZYX
 
 
 @dataclass
 class Label:
-    """Simple dataclass to store label data."""
+    """Simple dataclass to store label data.
+
+    The label data is exposed in the "ZYX" layout, through a lazy
+    `StandardLayoutView` if the source has a different layout.
+    """
 
     label_key: str
-    label_data: np.ndarray
+    label_data: Any
     voxel_size: tuple[float] = (1, 1, 1)
     unit: str = "micrometer"
     layout: VALID_IMAGE_LAYOUT = "ZYX"
@@ -110,11 +350,17 @@ class Label:
 class Image:
     """Simple dataclass to store image data.
 
-    By default the image layout is going to be internaly converted to "TCZYX" layout.
+    The image data is exposed in the "CZYX" layout, through a lazy
+    `StandardLayoutView` if the source has a different layout. The layout
+    change is applied only to the regions read from the image (e.g. slab by
+    slab at write time), so no full copy of the data is ever made.
+    `pyramid_levels` are the sub-resolution levels stored in the source file
+    (e.g. a pyramidal OME-TIFF), from the highest to the lowest resolution,
+    in the same layout as `image_data`.
     """
 
     image_key: str
-    image_data: np.ndarray
+    image_data: Any
     voxel_size: tuple[float]
     unit: str
     layout: VALID_IMAGE_LAYOUT
@@ -123,11 +369,13 @@ class Image:
     type: str = "image"
     _scale: tuple[float] = (1, 1, 1, 1)
     input_layout: Optional[VALID_IMAGE_LAYOUT] = None
+    pyramid_levels: Optional[list[Any]] = None
 
     def __post_init__(self):
         """Post init method to validate the image data."""
         layout = VALID_IMAGE_LAYOUT(self.layout)
-        self.input_layout = layout
+        if self.input_layout is None:
+            self.input_layout = layout
 
         if self.type == "image":
             standard_layout = "CZYX"
@@ -151,18 +399,24 @@ class Image:
 
         self.image_data = image
         self._scale = scale
+        if self.pyramid_levels is not None:
+            self.pyramid_levels = [
+                to_standard_layout(
+                    image_data=level,
+                    current_layout=layout,
+                    voxel_size=self.voxel_size,
+                    standard_layout=standard_layout,
+                )[0]
+                for level in self.pyramid_levels
+            ]
         self.layout = standard_layout
         self._axis_units = [None, self.unit, self.unit, self.unit]
         self._axis_type = ["channel", "space", "space", "space"]
 
         if self.label is not None:
-            self.label = Label(
-                label_key=self.label.label_key,
-                label_data=self.label.label_data,
-                layout=self.input_layout,
-                voxel_size=self.voxel_size,
-                unit=self.unit,
-            )
+            # the label is already in its standard layout, only the
+            # voxel size and unit are taken from the image
+            self.label = replace(self.label, voxel_size=self.voxel_size, unit=self.unit)
 
     @property
     def axis_info(self):
@@ -184,9 +438,17 @@ class Image:
         return True
 
 
+def _validate_h5_path(input_path: str) -> None:
+    if Path(input_path).suffix != ".h5":
+        raise ValueError("plantseg expects only H5 files.")
+
+    if not Path(input_path).exists():
+        raise FileNotFoundError(f"File {input_path} not found.")
+
+
 def load_h5_images(
     input_path: str,
-    image_key: str = "raw",
+    image_key: Union[str, list[str]] = "raw",
     label_key: Optional[str] = None,
     new_image_key: Optional[str] = None,
     new_label_key: Optional[str] = None,
@@ -198,7 +460,9 @@ def load_h5_images(
 
     Args:
         input_path (str): Path to the H5 file.
-        image_key (str): Key to the image data in the H5 file.
+        image_key (Union[str, list[str]]): Key to the image data in the H5 file.
+            If a list of keys is given, each key is loaded as a channel
+            of a single multichannel image.
         label_key (Optional[str]): Key to the label data in the H5 file.
         new_image_key (Optional[str]): New key for the image data to
             be stored in the OME-Zarr.
@@ -206,18 +470,18 @@ def load_h5_images(
             be stored in the OME-Zarr.
         image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
     """
-    if Path(input_path).suffix != ".h5":
-        raise ValueError("plantseg expects only H5 files.")
-
-    if not Path(input_path).exists():
-        raise FileNotFoundError(f"File {input_path} not found.")
+    _validate_h5_path(input_path)
 
-    image, (voxel_size, _, _, unit) = load_h5(input_path, key=image_key)
-    image_key = image_key if new_image_key is None else new_image_key
+    image_keys = [image_key] if isinstance(image_key, str) else list(image_key)
+    voxel_size, _, _, unit = load_h5(input_path, key=image_keys[0], info_only=True)
+    with _timed("read"):
+        channels = [load_h5(input_path, key=key)[0] for key in image_keys]
+    image, layout = stack_channels(channels, layout=image_layout)
 
     if label_key is not None:
+        with _timed("read"):
+            _label, _ = load_h5(input_path, key=label_key)
         label_key = label_key if new_label_key is None else new_label_key
-        _label, _ = load_h5(input_path, key=label_key)
         label = Label(
             label_key=label_key,
             label_data=_label,
@@ -229,15 +493,75 @@ def load_h5_images(
         label = None
 
     return Image(
-        image_key=image_key,
+        image_key=image_keys[0] if new_image_key is None else new_image_key,
         image_data=image,
         voxel_size=voxel_size,
         unit=unit,
-        layout=image_layout,
+        layout=layout,
+        channel_names=image_keys if len(image_keys) > 1 else None,
         label=label,
+        input_layout=image_layout,
     )
 
 
+@contextmanager
+def open_h5_images(
+    input_path: str,
+    image_key: Union[str, list[str]] = "raw",
+    label_key: Optional[str] = None,
+    new_image_key: Optional[str] = None,
+    new_label_key: Optional[str] = None,
+    image_layout: VALID_IMAGE_LAYOUT = "ZYX",
+) -> Iterator[Image]:
+    """Open images from an H5 file without loading them in memory.
+
+    Same as `load_h5_images`, but the image and label data are kept as
+    lazy h5py datasets, so that they can be streamed slab by slab into
+    the OME-Zarr. The H5 file is closed when the context exits.
+
+    Args:
+        input_path (str): Path to the H5 file.
+        image_key (Union[str, list[str]]): Key to the image data in the H5 file.
+            If a list of keys is given, each key is streamed as a channel
+            of a single multichannel image.
+        label_key (Optional[str]): Key to the label data in the H5 file.
+        new_image_key (Optional[str]): New key for the image data to
+            be stored in the OME-Zarr.
+        new_label_key (Optional[str]): New key for the label data to
+            be stored in the OME-Zarr.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
+    """
+    _validate_h5_path(input_path)
+
+    image_keys = [image_key] if isinstance(image_key, str) else list(image_key)
+    voxel_size, _, _, unit = load_h5(input_path, key=image_keys[0], info_only=True)
+    with h5py.File(input_path, "r") as f:
+        if label_key is not None:
+            label = Label(
+                label_key=label_key if new_label_key is None else new_label_key,
+                label_data=f[label_key],
+                voxel_size=voxel_size,
+                unit=unit,
+                layout=image_layout,
+            )
+        else:
+            label = None
+
+        image, layout = stack_channels(
+            [f[key] for key in image_keys], layout=image_layout
+        )
+        yield Image(
+            image_key=image_keys[0] if new_image_key is None else new_image_key,
+            image_data=image,
+            voxel_size=voxel_size,
+            unit=unit,
+            layout=layout,
+            channel_names=image_keys if len(image_keys) > 1 else None,
+            label=label,
+            input_layout=image_layout,
+        )
+
+
 def load_tiff_images(
     image_path: str,
     label_path: Optional[str] = None,
@@ -257,10 +581,12 @@ def load_tiff_images(
         new_label_key (str): New key for the label data to be stored in the OME-Zarr.
         image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
     """
-    _image, (voxel_size, _, _, unit) = load_tiff(image_path)
+    with _timed("read"):
+        _image, (voxel_size, _, _, unit) = load_tiff(image_path)
 
     if label_path is not None:
-        _label, _ = load_tiff(label_path)
+        with _timed("read"):
+            _label, _ = load_tiff(label_path)
         label = Label(
             label_key=new_label_key,
             label_data=_label,
@@ -278,14 +604,329 @@ def load_tiff_images(
         unit=unit,
         layout=image_layout,
         label=label,
+        pyramid_levels=read_tiff_pyramid_levels(image_path),
     )
 
 
+class TiffPageArray:
+    """Lazy array-like over the pages of a TIFF series.
+
+    Reading a region only decodes the pages that intersect it.
+    """
+
+    def __init__(self, series: tifffile.TiffPageSeries):
+        """Initialize the array from a TIFF series."""
+        self._series = series
+        self._shape = tuple(series.shape)
+
+        # find the leading axes that index the pages of the series
+        num_pages, num_leading, size = len(series.pages), 0, 1
+        while size < num_pages and num_leading < len(self._shape):
+            size *= self._shape[num_leading]
+            num_leading += 1
+
+        if size != num_pages:
+            raise ValueError(
+                f"Could not map the {num_pages} pages of the TIFF series "
+                f"to an array of shape {self._shape}."
+            )
+        self._num_leading = num_leading
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """Shape of the TIFF series."""
+        return self._shape
+
+    @property
+    def ndim(self) -> int:
+        """Number of dimensions of the TIFF series."""
+        return len(self._shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Data type of the TIFF series."""
+        return np.dtype(self._series.dtype)
+
+    def __getitem__(self, key: tuple[slice, ...]) -> np.ndarray:
+        """Decode the pages intersecting the region and crop them."""
+        leading_shape = self._shape[: self._num_leading]
+        page_shape = self._shape[self._num_leading :]
+
+        leading_ranges = [
+            range(*_slice.indices(size))
+            for _slice, size in zip(key[: self._num_leading], leading_shape)
+        ]
+        page_indices = [
+            int(np.ravel_multi_index(index, leading_shape))
+            for index in product(*leading_ranges)
+        ]
+
+        page_key = key[self._num_leading :]
+        if len(page_indices) == 0:
+            return np.empty((0, *page_shape), dtype=self.dtype)[
+                (slice(None), *page_key)
+            ]
+
+        pages = self._series.asarray(key=page_indices)
+        pages = pages.reshape(len(page_indices), *page_shape)[(slice(None), *page_key)]
+        return pages.reshape(*[len(r) for r in leading_ranges], *pages.shape[1:])
+
+
+def read_tiff_voxel_size(tiff_path: str) -> tuple[list[float], str]:
+    """Read the ZYX voxel size and its unit from the tags of a TIFF file.
+
+    Same as the voxel size returned by `plantseg.io.load_tiff`, but only the
+    tags and the ImageJ metadata are read, the pixels are never decoded.
+    """
+    with tifffile.TiffFile(tiff_path) as tiff:
+        tags = tiff.pages[0].tags
+        voxel_size_yx = []
+        for key in ("YResolution", "XResolution"):
+            if key in tags:
+                num_pixels, units = tags[key].value
+                voxel_size_yx.append(units / num_pixels)
+            else:
+                voxel_size_yx.append(1.0)
+
+        imagej_metadata = tiff.imagej_metadata
+        if imagej_metadata is None:
+            return [1.0, *voxel_size_yx], "um"
+        voxel_size_z = float(imagej_metadata.get("spacing", 1.0))
+        return [voxel_size_z, *voxel_size_yx], imagej_metadata.get("unit", "um")
+
+
+@contextmanager
+def _open_tiff_array(tiff_path: str) -> Iterator[Any]:
+    """Open the first series of a TIFF file as a lazy array-like.
+
+    Uncompressed and contiguous TIFFs are memory-mapped, any other TIFF is
+    decoded page by page when read.
+    """
+    with tifffile.TiffFile(tiff_path) as tiff:
+        series = tiff.series[0]
+        if series.dataoffset is not None:
+            yield tifffile.memmap(tiff_path, series=0, mode="r")
+        else:
+            yield TiffPageArray(series)
+
+
+def read_tiff_pyramid_levels(tiff_path: str) -> list[np.ndarray]:
+    """Read the sub-resolution levels of a pyramidal TIFF.
+
+    The list is empty if the first series of the TIFF is not pyramidal.
+    """
+    with tifffile.TiffFile(tiff_path) as tiff:
+        return [level.asarray() for level in tiff.series[0].levels[1:]]
+
+
+@contextmanager
+def _open_tiff_pyramid_levels(tiff_path: str) -> Iterator[list[Any]]:
+    """Open the sub-resolution levels of a pyramidal TIFF as lazy array-likes.
+
+    Same as `read_tiff_pyramid_levels`, but the levels are memory-mapped or
+    decoded page by page when read, as in `_open_tiff_array`.
+    """
+    with tifffile.TiffFile(tiff_path) as tiff:
+        levels = []
+        for ind_level, level in enumerate(tiff.series[0].levels[1:], start=1):
+            if level.dataoffset is not None:
+                levels.append(
+                    tifffile.memmap(tiff_path, series=0, level=ind_level, mode="r")
+                )
+            else:
+                levels.append(TiffPageArray(level))
+        yield levels
+
+
+@contextmanager
+def open_tiff_images(
+    image_path: str,
+    label_path: Optional[str] = None,
+    new_image_key: str = "raw",
+    new_label_key: str = "label",
+    image_layout: VALID_IMAGE_LAYOUT = "ZYX",
+) -> Iterator[Image]:
+    """Open images from TIFF files without loading them in memory.
+
+    Same as `load_tiff_images`, but the image and label data are kept
+    lazy, so that they can be streamed slab by slab into the OME-Zarr.
+    The TIFF files are closed when the context exits.
+
+    Args:
+        image_path (str): Path to the TIFF file.
+        label_path (Optional[str]): Path to the label TIFF file.
+        new_image_key (str): New key for the image data to be stored in the OME-Zarr.
+        new_label_key (str): New key for the label data to be stored in the OME-Zarr.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the image data.
+    """
+    voxel_size, unit = read_tiff_voxel_size(image_path)
+
+    with ExitStack() as stack:
+        if label_path is not None:
+            label = Label(
+                label_key=new_label_key,
+                label_data=stack.enter_context(_open_tiff_array(label_path)),
+                voxel_size=voxel_size,
+                unit=unit,
+                layout=image_layout,
+            )
+        else:
+            label = None
+
+        yield Image(
+            image_key=new_image_key,
+            image_data=stack.enter_context(_open_tiff_array(image_path)),
+            voxel_size=voxel_size,
+            unit=unit,
+            layout=image_layout,
+            label=label,
+            pyramid_levels=stack.enter_context(_open_tiff_pyramid_levels(image_path)),
+        )
+
+
+class TiffSliceStack:
+    """Lazy array-like over a sorted list of TIFF files, one per Z plane.
+
+    The slices are stacked along a new leading axis. Reading a region only
+    decodes the slices that intersect it, in parallel if an `executor`
+    is given, so the whole stack is never held in memory.
+    """
+
+    def __init__(self, slice_paths: list[str], executor: Optional[Executor] = None):
+        """Initialize the stack from the sorted paths of the slices."""
+        if len(slice_paths) == 0:
+            raise ValueError("A TIFF stack needs at least one slice.")
+        self.slice_paths = [str(path) for path in slice_paths]
+        self.executor = executor
+        with tifffile.TiffFile(self.slice_paths[0]) as tiff:
+            series = tiff.series[0]
+            self._slice_shape = tuple(series.shape)
+            self._dtype = np.dtype(series.dtype)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """Shape of the stack."""
+        return (len(self.slice_paths), *self._slice_shape)
+
+    @property
+    def ndim(self) -> int:
+        """Number of dimensions of the stack."""
+        return len(self.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Data type of the slices."""
+        return self._dtype
+
+    def _read_slice(self, slice_path: str, key: tuple[slice, ...]) -> np.ndarray:
+        data = tifffile.imread(slice_path)
+        if data.shape != self._slice_shape:
+            raise ValueError(
+                f"Slice {slice_path} has shape {data.shape}, "
+                f"expected {self._slice_shape} as the first slice."
+            )
+        return data[key]
+
+    def __getitem__(self, key) -> np.ndarray:
+        """Decode the slices intersecting the region and crop them."""
+        if key is Ellipsis:
+            key = ()
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (self.ndim - len(key))
+        if not all(isinstance(_slice, slice) for _slice in key):
+            raise ValueError("Only slices are supported to index a lazy image.")
+
+        slice_paths = self.slice_paths[key[0]]
+        slice_key = key[1:]
+        if len(slice_paths) == 0:
+            return np.empty((0, *self._slice_shape), dtype=self.dtype)[
+                (slice(None), *slice_key)
+            ]
+
+        if self.executor is None:
+            slices = [self._read_slice(path, slice_key) for path in slice_paths]
+        else:
+            slices = list(
+                self.executor.map(
+                    self._read_slice, slice_paths, [slice_key] * len(slice_paths)
+                )
+            )
+        return np.stack(slices, axis=0).astype(self.dtype, copy=False)
+
+
+@contextmanager
+def open_tiff_stack_images(
+    image_slices: list[str],
+    label_slices: Optional[list[str]] = None,
+    new_image_key: str = "raw",
+    new_label_key: str = "label",
+    image_layout: VALID_IMAGE_LAYOUT = "ZYX",
+    num_workers: int = 1,
+) -> Iterator[Image]:
+    """Open a stack of TIFF slices (one file per Z plane) as a single image.
+
+    The slices are decoded lazily, `num_workers` at a time, while the
+    image is streamed slab by slab into the OME-Zarr.
+
+    Args:
+        image_slices (list[str]): Paths of the image slices, sorted along Z.
+        label_slices (Optional[list[str]]): Paths of the label slices,
+            sorted along Z.
+        new_image_key (str): New key for the image data to be stored in the OME-Zarr.
+        new_label_key (str): New key for the label data to be stored in the OME-Zarr.
+        image_layout (VALID_IMAGE_LAYOUT): The layout of the stacked image,
+            e.g. "ZYX" for 2D slices.
+        num_workers (int): Number of slices decoded in parallel.
+    """
+    if label_slices is not None and len(label_slices) != len(image_slices):
+        raise ValueError(
+            f"Found {len(image_slices)} image slices, "
+            f"but {len(label_slices)} label slices."
+        )
+    voxel_size, unit = read_tiff_voxel_size(image_slices[0])
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        if label_slices is not None:
+            label = Label(
+                label_key=new_label_key,
+                label_data=TiffSliceStack(label_slices, executor=executor),
+                voxel_size=voxel_size,
+                unit=unit,
+                layout=image_layout,
+            )
+        else:
+            label = None
+
+        yield Image(
+            image_key=new_image_key,
+            image_data=TiffSliceStack(image_slices, executor=executor),
+            voxel_size=voxel_size,
+            unit=unit,
+            layout=image_layout,
+            label=label,
+        )
+
+
 def correct_image_metadata(image: Image, custom_axis: CustomAxisInputModel) -> Image:
     """If the image does not have a valid voxel size, set it from the custom axis.
 
+    The channel names of the custom axis are used if they were set by the
+    user, and must match the number of channels of the image. The default
+    names are never used, so images keep no omero metadata unless named.
+
     TODO: make sure that a custom axis is provided before returning the image.
     """
+    if "channel_names" in custom_axis.model_fields_set:
+        num_channels = image.image_data.shape[0]
+        if len(custom_axis.channel_names) != num_channels:
+            raise ValueError(
+                f"Got {len(custom_axis.channel_names)} channel names "
+                f"{custom_axis.channel_names}, but the image has "
+                f"{num_channels} channels."
+            )
+        image = replace(image, channel_names=list(custom_axis.channel_names))
+
     if image.has_valid_voxel_size():
         return image
 
@@ -304,23 +945,24 @@ def correct_image_metadata(image: Image, custom_axis: CustomAxisInputModel) -> I
             "Please provide a valid voxel size for axis X and Y."
         )
 
-    label = Label(
-        label_key=image.label.label_key,
-        label_data=image.label.label_data,
-        voxel_size=voxel_size,
-        unit=custom_axis.unit,
-        layout=image.input_layout,
-    )
+    # The data is already in the standard layout, so this only
+    # updates the metadata and never touches the data
+    return replace(image, voxel_size=voxel_size, unit=custom_axis.spatial_units)
 
-    return Image(
-        image_key=image.image_key,
-        image_data=image.image_data,
-        voxel_size=voxel_size,
-        unit=custom_axis.spatial_units,
-        layout=image.layout,
-        channel_names=image.channel_names,
-        label=label,
-    )
+
+def get_coarsening_factors(
+    shape: tuple[int, ...], omezarr_params: OMEZarrBuilderParams
+) -> list[tuple[int, ...]]:
+    """Coarsening factors between each pyramid level and the next one.
+
+    The last three axes of `shape` are ZYX. Z is only coarsened while the
+    level has enough planes, see `pyramid_factors`.
+    """
+    coarsening_xy = int(omezarr_params.scaling_factor_XY)
+    coarsening_z = int(omezarr_params.scaling_factor_Z)
+    factors = (1,) * (len(shape) - 3) + (coarsening_z, coarsening_xy, coarsening_xy)
+    num_levels = max(1, omezarr_params.number_multiscale)
+    return pyramid_factors(shape, num_levels=num_levels, factors=factors)
 
 
 def build_multiscale_metadata(
@@ -332,14 +974,8 @@ def build_multiscale_metadata(
     axes_metadata = [Axis(name=n, unit=u, type=t) for n, u, t in image.axis_info]
 
     datasets = []
-    if omezarr_params.scaling_factor_Z != 1:
-        raise NotImplementedError("Z scaling is not yet supported.")
-    downsample_factors = [
-        1,
-        omezarr_params.scaling_factor_Z,
-        int(omezarr_params.scaling_factor_XY),
-        int(omezarr_params.scaling_factor_XY),
-    ]
+    data = image.label_data if isinstance(image, Label) else image.image_data
+    level_factors = get_coarsening_factors(data.shape, omezarr_params)
     scale = image.scale
     for i in range(omezarr_params.number_multiscale):
         _dataset = Dataset(
@@ -349,7 +985,8 @@ def build_multiscale_metadata(
             ],
         )
         datasets.append(_dataset)
-        scale = [s * f for s, f in zip(scale, downsample_factors)]
+        if i < len(level_factors):
+            scale = [s * f for s, f in zip(scale, level_factors[i])]
 
     return Multiscale(
         version=__OME_NGFF_VERSION__,
@@ -359,49 +996,685 @@ def build_multiscale_metadata(
     )
 
 
+def build_omero_metadata(image: Image) -> Optional[Omero]:
+    """Build the omero metadata (channel names) of the image, if known."""
+    if image.channel_names is None:
+        return None
+
+    num_channels = image.image_data.shape[0]
+    if len(image.channel_names) != num_channels:
+        raise ValueError(
+            f"The image has {num_channels} channels, but "
+            f"{len(image.channel_names)} channel names were given."
+        )
+    channels = [
+        Channel(label=channel_name, color="FFFFFF")
+        for channel_name in image.channel_names
+    ]
+    return Omero(channels=channels)
+
+
+def iter_slabs(
+    shape: tuple[int, ...],
+    chunks: tuple[int, ...],
+    itemsize: int,
+    max_slab_bytes: int,
+    align: Optional[tuple[int, ...]] = None,
+) -> Iterator[tuple[slice, ...]]:
+    """Iterate over chunk aligned slabs of an array.
+
+    Slabs grow in multiples of the chunk shape, first along X, then Y
+    and then Z (the third to last axis), as long as they fit in
+    `max_slab_bytes`. Slabs therefore span full YX planes unless a single
+    chunk thick plane does not fit. Leading axes (e.g. channels) are split
+    chunk by chunk.
+
+    If `align` is given, every slab also starts at a multiple of `align`
+    along each axis (e.g. the total coarsening factor of a pyramid).
+    """
+    if align is None:
+        align = (1,) * len(shape)
+    units = [math.lcm(c, a) for c, a in zip(chunks, align)]
+
+    z_axis = len(shape) - 3
+    steps = list(units)
+    for ax in [len(shape) - 1, len(shape) - 2, z_axis]:
+        other_bytes = itemsize * int(np.prod(steps)) // steps[ax]
+        max_units = max(1, max_slab_bytes // (other_bytes * units[ax]))
+        steps[ax] = min(shape[ax], max_units * units[ax])
+
+    ranges = [range(0, size, step) for size, step in zip(shape, steps)]
+    for starts in product(*ranges):
+        yield tuple(
+            slice(start, min(start + step, size))
+            for start, step, size in zip(starts, steps, shape)
+        )
+
+
+class SlabProgress:
+    """Record of the slabs already written to a multiscale group.
+
+    The record is stored next to the levels in a small JSON file, that is
+    updated after every slab and removed once the write is complete. An
+    interrupted write can then be resumed skipping the slabs already written.
+    The record is only reused if the `signature` of the write (shape, chunks,
+    slab size, ...) did not change.
+    """
+
+    def __init__(self, zarr_url: str, signature: dict[str, Any], resume: bool):
+        """Load the record of `zarr_url` if `resume` is True."""
+        self.path = Path(zarr_url) / _PROGRESS_FILE
+        # normalize tuples to lists, as they are read back from JSON
+        self.signature = json.loads(json.dumps(signature))
+        self.done: set[tuple[int, ...]] = set()
+        if resume and self.path.exists():
+            progress = json.loads(self.path.read_text())
+            if progress.get("signature") == self.signature:
+                self.done = {tuple(starts) for starts in progress["done"]}
+
+    @staticmethod
+    def _key(slices: tuple[slice, ...]) -> tuple[int, ...]:
+        return tuple(s.start for s in slices)
+
+    def is_done(self, slices: tuple[slice, ...]) -> bool:
+        """Check if the slab was already written."""
+        return self._key(slices) in self.done
+
+    def mark_done(self, slices: tuple[slice, ...]) -> None:
+        """Record the slab as written."""
+        self.done.add(self._key(slices))
+        progress = {"signature": self.signature, "done": sorted(self.done)}
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(progress))
+        os.replace(tmp_path, self.path)
+
+    def reset(self) -> None:
+        """Forget all the slabs written so far."""
+        self.done = set()
+        self.path.unlink(missing_ok=True)
+
+    def finish(self) -> None:
+        """Remove the record once the write is complete."""
+        self.reset()
+
+
+def write_region(
+    zarr_array: zarr.Array,
+    slices: tuple[slice, ...],
+    data: np.ndarray,
+    executor: Optional[Executor] = None,
+) -> None:
+    """Write `data` to the region `slices` of `zarr_array`.
+
+    If an `executor` is given, the region is split along the chunk grid and
+    each chunk is encoded and written by a separate job. The jobs never
+    touch the same chunk, and the compressors release the GIL, so the chunks
+    are encoded in parallel.
+    """
+    if executor is None:
+        zarr_array[slices] = data
+        return
+
+    axes_blocks = []
+    for _slice, chunk in zip(slices, zarr_array.chunks):
+        bounds = [_slice.start]
+        bounds += range((_slice.start // chunk + 1) * chunk, _slice.stop, chunk)
+        bounds.append(_slice.stop)
+        axes_blocks.append(list(zip(bounds[:-1], bounds[1:])))
+
+    def _write_block(block: tuple[tuple[int, int], ...]) -> None:
+        zarr_array[tuple(slice(start, stop) for start, stop in block)] = data[
+            tuple(
+                slice(start - s.start, stop - s.start)
+                for (start, stop), s in zip(block, slices)
+            )
+        ]
+
+    # consume the results to propagate the errors of the jobs
+    for _ in executor.map(_write_block, product(*axes_blocks)):
+        pass
+
+
+def find_h5_chunk_source(data: Any) -> Optional[tuple[h5py.Dataset, int]]:
+    """Find the h5py dataset whose stored chunks can be copied to `data`'s array.
+
+    Returns the dataset and the number of singleton axes that `data` adds
+    in front of it, or None if `data` is neither a h5py dataset nor a
+    `StandardLayoutView` that only adds leading singleton axes to one
+    (e.g. a "ZYX" dataset seen in the "CZYX" layout).
+    """
+    num_leading = 0
+    if isinstance(data, StandardLayoutView):
+        if not data.standard_layout.endswith(data.current_layout):
+            return None
+        num_leading = data.ndim - data.source.ndim
+        data = data.source
+
+    if not isinstance(data, h5py.Dataset):
+        return None
+    return data, num_leading
+
+
+def copy_h5_chunks(
+    dataset: h5py.Dataset,
+    zarr_array: zarr.Array,
+    num_leading: int = 0,
+    executor: Optional[Executor] = None,
+) -> None:
+    """Copy the stored chunks of a HDF5 dataset into a zarr array.
+
+    The compressed chunks are copied byte for byte, without decoding them,
+    so `zarr_array` must have the chunk shape of `dataset` (with
+    `num_leading` singleton axes in front) and the codecs returned by
+    `get_h5_chunk_codecs`. Chunks never written in the HDF5 file are
+    skipped, and chunks stored without some of their filters are decoded
+    and written through zarr instead.
+    """
+    dataset_id = dataset.id
+
+    def _copy_chunk(ind_chunk: int) -> None:
+        offset = dataset_id.get_chunk_info(ind_chunk).chunk_offset
+        filter_mask, chunk_bytes = dataset_id.read_direct_chunk(offset)
+        if filter_mask != 0:
+            slices = tuple(
+                slice(start, min(start + chunk, size))
+                for start, chunk, size in zip(offset, dataset.chunks, dataset.shape)
+            )
+            zarr_array[(0,) * num_leading + slices] = dataset[slices]
+            return
+
+        chunk_index = (0,) * num_leading + tuple(
+            start // chunk for start, chunk in zip(offset, dataset.chunks)
+        )
+        # the arrays are always created with the "/" dimension separator
+        chunk_key = "/".join(str(i) for i in chunk_index)
+        if zarr_array.path:
+            chunk_key = f"{zarr_array.path}/{chunk_key}"
+        zarr_array.store[chunk_key] = chunk_bytes
+
+    chunk_indices = range(dataset_id.get_num_chunks())
+    if executor is None:
+        for ind_chunk in chunk_indices:
+            _copy_chunk(ind_chunk)
+        return
+
+    # consume the results to propagate the errors of the jobs
+    for _ in executor.map(_copy_chunk, chunk_indices):
+        pass
+
+
+def write_slabwise(
+    zarr_array: zarr.Array,
+    data: Any,
+    max_slab_bytes: int,
+    progress: Optional[SlabProgress] = None,
+    executor: Optional[Executor] = None,
+    phase: str = "level_0_write",
+) -> None:
+    """Copy `data` into `zarr_array` one chunk aligned slab at a time.
+
+    The source is only read one slab at a time, so if `data` is lazy
+    (e.g. a `StandardLayoutView` of a h5py dataset) the peak memory is bounded
+    by the slab size rather than by the size of the whole volume.
+    If `progress` is given, slabs already written are skipped. If `executor`
+    is given, the chunks of each slab are encoded in parallel. The writes
+    are timed as `phase` by `record_phase_timings`.
+    """
+    for slices in iter_slabs(
+        shape=zarr_array.shape,
+        chunks=zarr_array.chunks,
+        itemsize=zarr_array.dtype.itemsize,
+        max_slab_bytes=max_slab_bytes,
+    ):
+        if progress is not None and progress.is_done(slices):
+            continue
+        with _timed("read"):
+            slab = np.asarray(data[slices])
+        with _timed(phase):
+            write_region(zarr_array, slices, slab, executor=executor)
+        if progress is not None:
+            progress.mark_done(slices)
+
+
+def write_pyramid_slabwise(
+    levels: list[zarr.Array],
+    data: Any,
+    factors: list[tuple[int, ...]],
+    max_slab_bytes: int,
+    aggregation_function: Optional[Callable] = None,
+    progress: Optional[SlabProgress] = None,
+    executor: Optional[Executor] = None,
+    write_highres: bool = True,
+) -> None:
+    """Write all the levels of a pyramid in a single pass over `data`.
+
+    Each slab of `data` is written to level 0 and then coarsened in memory
+    into every lower resolution level, so the source is read only once and
+    the written levels are never read back from storage. `factors` are the
+    coarsening factors between each level and the next one. Slabs are
+    aligned to the total coarsening factor, so the result is identical to
+    building the levels one after the other with `build_pyramid`.
+    If `progress` is given, slabs already written (in all the levels)
+    are skipped. If `executor` is given, the chunks of each slab are encoded
+    in parallel. If `write_highres` is False, `levels[0]` is already written
+    and `data` is only read to compute the lower resolution levels.
+    """
+    highres = levels[0]
+    # coarsening factor of each level relative to level 0
+    level_totals = [(1,) * highres.ndim]
+    for level_factors in factors[: len(levels) - 1]:
+        level_totals.append(
+            tuple(t * f for t, f in zip(level_totals[-1], level_factors))
+        )
+    total_factors = level_totals[-1]
+    for slices in iter_slabs(
+        shape=highres.shape,
+        chunks=highres.chunks,
+        itemsize=highres.dtype.itemsize,
+        max_slab_bytes=max_slab_bytes,
+        align=total_factors,
+    ):
+        if progress is not None and progress.is_done(slices):
+            continue
+        with _timed("read"):
+            slab = np.asarray(data[slices])
+        if write_highres:
+            with _timed("level_0_write"):
+                write_region(highres, slices, slab, executor=executor)
+        with _timed("pyramid"):
+            for ind_level, level in enumerate(levels[1:], start=1):
+                slab = coarsen(slab, factors[ind_level - 1], aggregation_function)
+                level_slices = tuple(
+                    slice(s.start // t, s.start // t + n)
+                    for s, t, n in zip(slices, level_totals[ind_level], slab.shape)
+                )
+                write_region(level, level_slices, slab, executor=executor)
+        if progress is not None:
+            progress.mark_done(slices)
+
+
+def get_minimal_label_dtype(label_data: Any, max_slab_bytes: int) -> np.dtype:
+    """Find the smallest unsigned dtype that can store all the IDs of a label.
+
+    Labels already in memory are scanned at once, lazy labels are scanned
+    slab by slab, so they are never loaded as a whole. Labels with negative
+    or non integer values keep their dtype, uint8 labels are not scanned.
+    """
+    dtype = np.dtype(label_data.dtype)
+    if dtype.kind not in "iu" or dtype == np.uint8:
+        return dtype
+
+    min_id, max_id = 0, 0
+    if isinstance(label_data, np.ndarray):
+        all_slices = [tuple(slice(None) for _ in label_data.shape)]
+    else:
+        all_slices = iter_slabs(
+            shape=label_data.shape,
+            chunks=(1,) * label_data.ndim,
+            itemsize=dtype.itemsize,
+            max_slab_bytes=max_slab_bytes,
+        )
+    for slices in all_slices:
+        slab = np.asarray(label_data[slices])
+        if slab.size > 0:
+            min_id = min(min_id, int(slab.min()))
+            max_id = max(max_id, int(slab.max()))
+
+    if min_id < 0:
+        logger.warning(
+            f"Label has negative IDs (min {min_id}), keeping the {dtype} dtype."
+        )
+        return dtype
+
+    for candidate in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if max_id <= np.iinfo(candidate).max:
+            return np.dtype(candidate)
+
+
+def match_pyramid_levels(
+    shape: tuple[int, ...],
+    factors: list[tuple[int, ...]],
+    source_levels: list[Any],
+) -> list[Any]:
+    """Select the source levels that can be copied as pyramid levels 1, 2, ...
+
+    A source level matches level `i` if each axis has the size of level 0
+    divided by its total factor, rounded down (as in `pyramid_shapes`) or up (as
+    most TIFF writers do). Any extra row at the end of a level is ignored
+    when it is copied. Levels are matched in order, the first level that does
+    not match stops the search.
+    """
+    shapes = pyramid_shapes(shape, factors=factors)
+    matched = []
+    total_factors = (1,) * len(shape)
+    for level_factors, level_shape, source in zip(factors, shapes[1:], source_levels):
+        total_factors = tuple(t * f for t, f in zip(total_factors, level_factors))
+        max_shape = [math.ceil(s / t) for s, t in zip(shape, total_factors)]
+        if len(source.shape) != len(shape) or not all(
+            low <= s <= high
+            for low, s, high in zip(level_shape, source.shape, max_shape)
+        ):
+            break
+        matched.append(source)
+    return matched
+
+
+def _create_pyramid_arrays(
+    zarr_url: str,
+    shape: tuple[int, ...],
+    num_levels: int,
+    factors: list[tuple[int, ...]],
+    chunks: tuple[int, ...],
+    dtype: np.dtype,
+    compressor: Any,
+    reuse: bool = False,
+    filters: Optional[list[Any]] = None,
+) -> tuple[list[zarr.Array], bool]:
+    """Create the (empty) arrays of every level of a pyramid.
+
+    If `reuse` is True and all the arrays already exist, they are opened
+    as they are instead. Returns the arrays and whether they were reused.
+    """
+    level_urls = [f"{zarr_url}/{ind_level}" for ind_level in range(num_levels)]
+    if reuse and all(
+        zarr.storage.contains_array(zarr.storage.FSStore(url)) for url in level_urls
+    ):
+        return [zarr.open_array(url, mode="r+") for url in level_urls], True
+
+    levels = [
+        zarr.open_array(
+            shape=level_shape,
+            chunks=tuple(min(c, s) for c, s in zip(chunks, level_shape)),
+            dtype=dtype,
+            compressor=compressor,
+            filters=filters,
+            store=zarr.storage.FSStore(f"{zarr_url}/{ind_level}"),
+            overwrite=True,
+            dimension_separator="/",
+        )
+        for ind_level, level_shape in enumerate(
+            pyramid_shapes(shape, factors=factors[: num_levels - 1])
+        )
+    ]
+    return levels, False
+
+
+def _write_pyramid(
+    zarr_url: str,
+    data: Any,
+    chunks: tuple[int, ...],
+    compressor: Any,
+    omezarr_params: OMEZarrBuilderParams,
+    aggregation_function: Optional[Callable] = None,
+    dtype: Optional[np.dtype] = None,
+    resume: bool = False,
+    executor: Optional[Executor] = None,
+    source_levels: Optional[list[Any]] = None,
+) -> None:
+    """Write `data` and its lower resolution levels to `zarr_url`.
+
+    If `dtype` is given, the arrays are written with this dtype
+    instead of the dtype of `data`. If `resume` is True, an interrupted
+    write of the same data is resumed from the last slab written.
+    If `executor` is given, the chunks are encoded in parallel on it.
+    If `source_levels` are given (the sub-resolution levels of the source
+    file), the ones matching the pyramid are copied as they are, and only
+    the missing levels are computed, coarsening the last copied level.
+    If `omezarr_params.copy_source_chunks` is True and `data` is a HDF5
+    dataset with compatible codecs, its chunks are copied to level 0 without
+    decoding them, and `chunks` and `compressor` are replaced by the ones of
+    the dataset.
+    """
+    dtype = data.dtype if dtype is None else dtype
+    factors = get_coarsening_factors(data.shape, omezarr_params)
+    max_slab_bytes = omezarr_params.max_slab_size_mb * 1024**2
+    num_levels = max(1, omezarr_params.number_multiscale)
+    fused = omezarr_params.fused_pyramid
+
+    h5_source, h5_codecs, filters = None, None, None
+    if omezarr_params.copy_source_chunks and np.dtype(dtype) == data.dtype:
+        h5_source = find_h5_chunk_source(data)
+        if h5_source is not None:
+            h5_codecs = get_h5_chunk_codecs(h5_source[0])
+    if h5_codecs is not None:
+        h5_dataset, num_leading = h5_source
+        compressor, filters = h5_codecs
+        chunks = (1,) * num_leading + h5_dataset.chunks
+        logger.info(f"Copying the chunks of {h5_dataset.name} to {zarr_url}")
+    source_levels = match_pyramid_levels(data.shape, factors, source_levels or [])
+    if len(source_levels) > 0:
+        logger.info(
+            f"Copying {len(source_levels)} pyramid levels of the source to {zarr_url}"
+        )
+
+    progress = SlabProgress(
+        zarr_url,
+        signature={
+            "shape": data.shape,
+            "chunks": chunks,
+            "dtype": np.dtype(dtype).str,
+            "factors": factors,
+            "num_levels": num_levels,
+            "max_slab_bytes": max_slab_bytes,
+            "fused_pyramid": fused,
+            "source_levels": len(source_levels),
+            "copy_source_chunks": h5_codecs is not None,
+        },
+        resume=resume,
+    )
+    levels, reused = _create_pyramid_arrays(
+        zarr_url,
+        shape=data.shape,
+        num_levels=num_levels if fused or source_levels or h5_codecs else 1,
+        factors=factors,
+        chunks=chunks,
+        dtype=dtype,
+        compressor=compressor,
+        reuse=len(progress.done) > 0,
+        filters=filters,
+    )
+    if reused:
+        logger.info(f"Resuming {zarr_url}, {len(progress.done)} slabs already written")
+    else:
+        progress.reset()
+
+    if h5_codecs is not None:
+        # copying the chunks is cheap, so it is never resumed
+        with _timed("level_0_write"):
+            copy_h5_chunks(h5_dataset, levels[0], num_leading, executor=executor)
+        if len(levels) > 1:
+            write_pyramid_slabwise(
+                levels,
+                data,
+                factors,
+                max_slab_bytes=max_slab_bytes,
+                aggregation_function=aggregation_function,
+                executor=executor,
+                write_highres=False,
+            )
+    elif source_levels:
+        write_slabwise(
+            levels[0],
+            data,
+            max_slab_bytes=max_slab_bytes,
+            progress=progress,
+            executor=executor,
+        )
+        num_copied = len(source_levels)
+        for level, source in zip(levels[1:num_copied], source_levels):
+            write_slabwise(
+                level,
+                source,
+                max_slab_bytes=max_slab_bytes,
+                executor=executor,
+                phase="pyramid",
+            )
+        # the last copied level is the source of the missing ones
+        write_pyramid_slabwise(
+            levels[num_copied:],
+            source_levels[-1],
+            factors[num_copied:],
+            max_slab_bytes=max_slab_bytes,
+            aggregation_function=aggregation_function,
+            executor=executor,
+        )
+    elif fused:
+        write_pyramid_slabwise(
+            levels,
+            data,
+            factors,
+            max_slab_bytes=max_slab_bytes,
+            aggregation_function=aggregation_function,
+            progress=progress,
+            executor=executor,
+        )
+    else:
+        write_slabwise(
+            levels[0],
+            data,
+            max_slab_bytes=max_slab_bytes,
+            progress=progress,
+            executor=executor,
+        )
+        with _timed("pyramid"):
+            build_pyramid(
+                zarrurl=zarr_url,
+                overwrite=True,
+                num_levels=num_levels,
+                coarsening_xy=int(omezarr_params.scaling_factor_XY),
+                coarsening_z=int(omezarr_params.scaling_factor_Z),
+                chunksize=chunks,
+                aggregation_function=aggregation_function,
+                compressor=compressor,
+            )
+    progress.finish()
+
+
+def _write_label_pyramid(
+    label_url: str,
+    label_data: Any,
+    chunks: tuple[int, ...],
+    omezarr_params: OMEZarrBuilderParams,
+    resume: bool = False,
+    executor: Optional[Executor] = None,
+) -> None:
+    """Write a label and its lower resolution levels to `label_url`."""
+    if omezarr_params.minimal_label_dtype:
+        label_dtype = get_minimal_label_dtype(
+            label_data,
+            max_slab_bytes=omezarr_params.max_slab_size_mb * 1024**2,
+        )
+    else:
+        label_dtype = label_data.dtype
+
+    compression = omezarr_params.compression
+    label_compressor = get_compressor(
+        codec=compression.codec,
+        shuffle=compression.shuffle,
+        clevel=compression.clevel,
+        data=label_data,
+        chunks=chunks,
+        dtype=label_dtype,
+    )
+    _write_pyramid(
+        label_url,
+        data=label_data,
+        chunks=chunks,
+        compressor=label_compressor,
+        omezarr_params=omezarr_params,
+        aggregation_function=get_label_aggregation_function(
+            omezarr_params.label_downsampling
+        ),
+        dtype=label_dtype,
+        resume=resume,
+        executor=executor,
+    )
+
+
+def _run_write_jobs(write_jobs: list[Callable], num_threads: int) -> None:
+    """Run the write jobs of the arrays of an OME-Zarr.
+
+    With more than one thread, the jobs run concurrently (they write to
+    separate arrays), and all of them share a pool of `num_threads` threads
+    to encode their chunks in parallel.
+    """
+    if num_threads == 1:
+        for job in write_jobs:
+            job()
+        return
+
+    with ThreadPoolExecutor(max_workers=num_threads) as encode_executor:
+        with ThreadPoolExecutor(max_workers=len(write_jobs)) as job_executor:
+            futures = [
+                job_executor.submit(job, executor=encode_executor) for job in write_jobs
+            ]
+            for future in futures:
+                future.result()
+
+
 def create_ome_zarr(
     zarr_url: str,
     path: str,
     name: str,
     image: Image,
     omezarr_params: OMEZarrBuilderParams,
+    resume: bool = False,
 ) -> str:
-    """Create an OME-Zarr file from a give Image object."""
+    """Create an OME-Zarr file from a give Image object.
+
+    If `resume` is True, the existing OME-Zarr is not wiped, and an
+    interrupted conversion of the same image is resumed slab by slab.
+    The metadata of the OME-Zarr is consolidated once everything is written.
+    """
+    group_mode = "a" if resume else "w"
     multiscale_metadata = build_multiscale_metadata(
         image=image, omezarr_params=omezarr_params, name=name
     )
-    omero_metadata = None
+    omero_metadata = build_omero_metadata(image)
 
     ngff_metadata = NgffImageMeta(
         multiscales=[multiscale_metadata],
         omero=omero_metadata,
     )
 
-    chunksize = (1, 1, image.image_data.shape[-2], image.image_data.shape[-1])
     image_data = image.image_data
-    shape = image_data.shape
-    zarr_url = f"{zarr_url}/{path}"
-    zarr_group = zarr.open_group(store=zarr.storage.FSStore(f"{zarr_url}"), mode="w")
-    zarr_group.attrs.update(ngff_metadata.model_dump(exclude_none=True))
-    zarr_array = zarr.open_array(
-        shape=shape,
+    chunksize = plan_chunks(
+        shape=image_data.shape,
+        dtype=image_data.dtype,
+        target_chunk_size_mb=omezarr_params.target_chunk_size_mb,
+        access_pattern=omezarr_params.chunk_access_pattern,
+        voxel_size=image.scale[-3:],
+    )
+    compression = omezarr_params.compression
+    compressor = get_compressor(
+        codec=compression.codec,
+        shuffle=compression.shuffle,
+        clevel=compression.clevel,
+        data=image_data,
         chunks=chunksize,
-        dtype=image.image_data.dtype,
-        store=zarr.storage.FSStore(f"{zarr_url}/0"),
-        overwrite=True,
-        dimension_separator="/",
     )
-    zarr_array[...] = image_data
-    build_pyramid(
-        zarrurl=zarr_url,
-        num_levels=omezarr_params.number_multiscale,
-        coarsening_xy=int(omezarr_params.scaling_factor_XY),
+    zarr_url = f"{zarr_url}/{path}"
+    zarr_group = zarr.open_group(
+        store=zarr.storage.FSStore(f"{zarr_url}"), mode=group_mode
     )
+    zarr_group.attrs.update(ngff_metadata.model_dump(exclude_none=True))
+    write_jobs = [
+        partial(
+            _write_pyramid,
+            zarr_url,
+            data=image_data,
+            chunks=chunksize,
+            compressor=compressor,
+            omezarr_params=omezarr_params,
+            resume=resume,
+            source_levels=image.pyramid_levels,
+        )
+    ]
 
     if image.label is not None:
         # Create the label group container
         label_container_group = zarr.open_group(
-            store=zarr.storage.FSStore(f"{zarr_url}/labels"), mode="w"
+            store=zarr.storage.FSStore(f"{zarr_url}/labels"), mode=group_mode
         )
         label_container_group.attrs["labels"] = [image.label.label_key]
 
@@ -409,7 +1682,7 @@ def create_ome_zarr(
         label_url_path = f"{zarr_url}/labels/{image.label.label_key}"
 
         label_group = zarr.open_group(
-            store=zarr.storage.FSStore(label_url_path), mode="w"
+            store=zarr.storage.FSStore(label_url_path), mode=group_mode
         )
         label_source = {
             "image-label": {
@@ -428,21 +1701,17 @@ def create_ome_zarr(
         )
 
         label_group.attrs.update(label_ngff_metadata.model_dump(exclude_none=True))
-
-        # Write the label data
-        label_zarr_array = zarr.open_array(
-            shape=image.label.label_data.shape,
-            chunks=chunksize[1:],
-            dtype=image.label.label_data.dtype,
-            store=zarr.storage.FSStore(label_url_path + "/0"),
-            overwrite=True,
-            dimension_separator="/",
+        write_jobs.append(
+            partial(
+                _write_label_pyramid,
+                label_url_path,
+                label_data=image.label.label_data,
+                chunks=chunksize[1:],
+                omezarr_params=omezarr_params,
+                resume=resume,
+            )
         )
-        label_zarr_array[...] = image.label.label_data
 
-        build_pyramid(
-            zarrurl=label_url_path,
-            num_levels=omezarr_params.number_multiscale,
-            coarsening_xy=int(omezarr_params.scaling_factor_XY),
-        )
+    _run_write_jobs(write_jobs, num_threads=omezarr_params.num_threads)
+    consolidate_metadata(zarr_url)
     return zarr_url
@@ -0,0 +1,164 @@
+"""Boundary predictions saved in the OME-Zarr, to be reused by later runs."""
+
+from typing import TYPE_CHECKING, Literal, Optional
+
+import numpy as np
+import zarr
+from fractal_tasks_core.utils import logger
+
+from plantseg_tasks.ngio.ngff.zarr_utils import consolidate_metadata
+from plantseg_tasks.ngio.ngff_image import NgffImage
+from plantseg_tasks.task_utils.hashing import hash_params
+from plantseg_tasks.task_utils.ps_workflow_input_models import (
+    PlantSegPredictionsModel,
+)
+
+if TYPE_CHECKING:
+    from plantseg_tasks.ngio.multiscale_handlers import MultiscaleImage
+
+PREDICTIONS_DTYPE = Literal["float16", "uint8"]
+
+_ATTRS_KEY = "plantseg_predictions"
+# Fields of the prediction model that do not change the predictions
+_RUNTIME_FIELDS = {"device", "skip"}
+
+Box = list[list[int]]
+
+
+def hash_predictions_params(
+    prediction_model: PlantSegPredictionsModel, channel: int, level: int
+) -> str:
+    """Hash of the parameters the boundary predictions depend on."""
+    params = {
+        "prediction_model": prediction_model.model_dump(
+            mode="json", exclude=_RUNTIME_FIELDS
+        ),
+        "channel": channel,
+        "level": level,
+    }
+    return hash_params(params)
+
+
+def encode_predictions(predictions: np.ndarray, dtype: PREDICTIONS_DTYPE) -> np.ndarray:
+    """Convert boundary probabilities to the dtype they are saved with.
+
+    With "uint8", the probabilities in [0, 1] are quantized to 256 levels.
+    """
+    if dtype == "uint8":
+        return np.round(np.clip(predictions, 0, 1) * 255).astype("uint8")
+    return predictions.astype(dtype)
+
+
+def decode_predictions(data: np.ndarray) -> np.ndarray:
+    """Convert saved predictions back to float32 boundary probabilities."""
+    if data.dtype == np.uint8:
+        return data.astype("float32") / 255
+    return data.astype("float32")
+
+
+def _box(slices: tuple[slice, ...], shape: tuple[int, ...]) -> Box:
+    return [list(s.indices(size)[:2]) for s, size in zip(slices, shape)]
+
+
+class PredictionsCache:
+    """Boundary predictions of a model saved in an OME-Zarr.
+
+    The predictions are saved in `predictions/{hash}` of the OME-Zarr, where
+    the hash covers the prediction model, the input channel and the level of
+    the run. The attributes of the group record which regions were predicted:
+    "all" once the whole level is predicted, else the list of ZYX boxes of
+    the predicted ROIs. A region is loaded from the cache only if it is
+    covered, any other region is predicted and saved.
+    """
+
+    def __init__(
+        self,
+        ngff_image: NgffImage,
+        prediction_model: PlantSegPredictionsModel,
+        channel: int,
+        level: int,
+        dtype: PREDICTIONS_DTYPE = "float16",
+    ):
+        """Open the predictions saved for these parameters, or create them."""
+        self.name = hash_predictions_params(prediction_model, channel, level)
+        self.level = level
+        if self.name in ngff_image.list_predictions:
+            logger.info(f"Found saved predictions {self.name}.")
+        else:
+            ngff_image.create_new_predictions(self.name, dtype=dtype)
+        self.handler: MultiscaleImage = ngff_image.get_multiscale_predictions(
+            self.name, level=level
+        )
+        self._zarr_url = ngff_image.zarr_url
+        self._group = zarr.open_group(
+            self._zarr_url, path=f"predictions/{self.name}", mode="a"
+        )
+        if _ATTRS_KEY not in self._group.attrs:
+            self._group.attrs[_ATTRS_KEY] = {
+                "prediction_model": prediction_model.model_dump(mode="json"),
+                "channel": channel,
+                "level": level,
+                "regions": [],
+            }
+            consolidate_metadata(self._zarr_url)
+        self.regions: str | list[Box] = self._group.attrs[_ATTRS_KEY]["regions"]
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        """ZYX shape of the predictions at the level of the run."""
+        return self.handler.shape
+
+    def is_cached(self, slices: tuple[slice, ...]) -> bool:
+        """Whether the predictions of the ZYX `slices` were saved."""
+        return self.regions == "all" or _box(slices, self.shape) in self.regions
+
+    def read(self, slices: tuple[slice, ...]) -> np.ndarray:
+        """Read the saved predictions of the ZYX `slices`."""
+        return decode_predictions(self.handler.zarr_array[slices])
+
+    def write(self, slices: tuple[slice, ...], predictions: np.ndarray) -> None:
+        """Save the predictions of the ZYX `slices`."""
+        dtype = self.handler.zarr_array.dtype
+        self.handler._write_data(encode_predictions(predictions, dtype), slices)
+
+    def save(
+        self, written_slices: list[tuple[slice, ...]], whole_level: bool = False
+    ) -> None:
+        """Record the regions written, and build the other pyramid levels.
+
+        Only the regions written are resampled to the other levels.
+
+        Args:
+            written_slices: The ZYX slices written with `write`.
+            whole_level: Whether the slices cover the whole level.
+        """
+        if len(written_slices) == 0:
+            return None
+        if whole_level:
+            self.regions = "all"
+        elif self.regions != "all":
+            boxes = [_box(slices, self.shape) for slices in written_slices]
+            self.regions = self.regions + [b for b in boxes if b not in self.regions]
+
+        attrs = self._group.attrs[_ATTRS_KEY]
+        self._group.attrs[_ATTRS_KEY] = {**attrs, "regions": self.regions}
+        consolidate_metadata(self._zarr_url)
+        self.handler.consolidate(
+            aggregation_function=np.mean,
+            regions=None if whole_level else written_slices,
+        )
+
+
+def open_predictions_cache(
+    ngff_image: NgffImage,
+    prediction_model: PlantSegPredictionsModel,
+    channel: int,
+    level: int,
+    dtype: PREDICTIONS_DTYPE = "float16",
+) -> Optional[PredictionsCache]:
+    """Open the predictions cache of a run, None if the predictions are skipped."""
+    if prediction_model.skip:
+        return None
+    return PredictionsCache(
+        ngff_image, prediction_model, channel=channel, level=level, dtype=dtype
+    )
@@ -1,16 +1,20 @@
 """Main PlantSeg processing functions."""
 
+from dataclasses import dataclass
 from functools import partial
 from pathlib import Path
-from typing import Callable, Optional
+from typing import Any, Callable, Optional
 
 import numpy as np
+import torch
 import zarr
 from fractal_tasks_core.ngff.specs import NgffImageMeta
 from fractal_tasks_core.ngff.zarr_utils import load_NgffImageMeta
 from fractal_tasks_core.pyramids import build_pyramid
 from fractal_tasks_core.utils import logger
-from plantseg.predictions.functional import unet_predictions
+from plantseg.models.zoo import model_zoo
+from plantseg.predictions.functional.array_predictor import ArrayPredictor
+from plantseg.predictions.functional.utils import get_patch_halo
 from plantseg.segmentation.functional import dt_watershed, gasp, multicut, mutex_ws
 
 from plantseg_tasks.task_utils.ps_workflow_input_models import (
@@ -70,46 +74,129 @@ def _load_zarr(
     return raw_image, metadata
 
 
+@dataclass(frozen=True)
+class ModelHandle:
+    """A model as returned by the PlantSeg model zoo, with its weights loaded.
+
+    Attributes:
+        model: The network, with the trained weights.
+        config: The model configuration (channels, embedding, ...).
+        model_name: The name of the model in the PlantSeg zoo, None for the
+            other sources.
+    """
+
+    model: Any
+    config: dict[str, Any]
+    model_name: Optional[str]
+
+
+# Models loaded in this process, keyed by `_model_key`
+_loaded_models: dict[tuple, ModelHandle] = {}
+
+
+def _model_key(prediction_model: PlantSegPredictionsModel) -> tuple:
+    if prediction_model.model_source == "PlantSegZoo":
+        name = prediction_model.plantsegzoo_name
+    elif prediction_model.model_source == "BioImageIO":
+        name = prediction_model.bioimageio_name
+    else:
+        name = prediction_model.local_model_path
+    return prediction_model.model_source, name, prediction_model.device
+
+
+def load_model(prediction_model: PlantSegPredictionsModel) -> ModelHandle:
+    """Resolve and load the model of `prediction_model`, once per process.
+
+    The model is resolved with the PlantSeg model zoo (from the PlantSeg zoo,
+    the BioImageIO zoo or a local path), which builds the network, and its
+    weights are loaded. This can take longer than predicting on a ROI, so
+    the handles are cached by model source, name (or local path) and device,
+    and reused by all the later calls.
+    """
+    key = _model_key(prediction_model)
+    if key in _loaded_models:
+        return _loaded_models[key]
+
+    model_source, name, _ = key
+    model_name = None
+    if model_source == "PlantSegZoo":
+        model_name = name
+        model, config, model_path = model_zoo.get_model_by_name(
+            name, model_update=False
+        )
+    elif model_source == "BioImageIO":
+        model, config, model_path = model_zoo.get_model_by_id(name)
+    elif model_source == "LocalModel":
+        model, config, model_path = model_zoo.get_model_by_config_path(
+            f"{name}/config.yaml", f"{name}/model.pth"
+        )
+    else:
+        raise ValueError(f"Invalid model source: {model_source}.")
+
+    state = torch.load(model_path, map_location="cpu")
+    # the zoo checkpoints store the weights in "model_state_dict"
+    model.load_state_dict(state.get("model_state_dict", state))
+    logger.info(f"Loaded model {name} from {model_source}.")
+    _loaded_models[key] = ModelHandle(model=model, config=config, model_name=model_name)
+    return _loaded_models[key]
+
+
+class PlantSegPredictor:
+    """Boundary predictor reusable on several images.
+
+    The model is loaded when the predictor is created (see `load_model`),
+    and every call only runs the patch-wise inference of PlantSeg.
+    """
+
+    def __init__(self, prediction_model: PlantSegPredictionsModel):
+        """Load the model and set up the patch-wise inference."""
+        self.prediction_model = prediction_model
+        handle = load_model(prediction_model)
+        if int(handle.config["in_channels"]) != 1:
+            raise ValueError(
+                "Only models with a single input channel are supported, "
+                f"got {handle.config['in_channels']} input channels."
+            )
+        self._predictor = ArrayPredictor(
+            model=handle.model,
+            in_channels=handle.config["in_channels"],
+            out_channels=handle.config["out_channels"],
+            device=prediction_model.device,
+            patch=prediction_model.patch,
+            patch_halo=get_patch_halo(handle.model_name),
+            single_batch_mode=True,
+            headless=False,
+            is_embedding=not handle.config.get("is_segmentation", True),
+            verbose_logging=False,
+            disable_tqdm=True,
+        )
+
+    def __call__(self, raw_image: np.ndarray) -> np.ndarray:
+        """Predict the boundaries of a ZYX image.
+
+        The predictor returns the output channels first (CZYX), the first
+        channel is the boundaries.
+        """
+        if raw_image.ndim != 3:
+            raise ValueError(f"Expected a ZYX image, got shape {raw_image.shape}.")
+        predictions = self._predictor(raw_image.astype("float32"))
+        return predictions[0]
+
+
 def plantseg_predictions(
     raw_image: np.ndarray,
     prediction_model: PlantSegPredictionsModel,
 ):
     """PlantSeg predictions function.
 
+    The model is loaded at the first call only, see `load_model`. Use a
+    `PlantSegPredictor` to also reuse the inference setup across calls.
+
     Args:
         raw_image: The raw image to predict.
         prediction_model: The prediction model.
     """
-    if prediction_model.model_source == "PlantSegZoo":
-        model_name = prediction_model.plantsegzoo_name
-        model_id = None
-        config_path = None
-        model_weights_path = None
-    elif prediction_model.model_source == "BioImageIO":
-        model_name = None
-        model_id = prediction_model.bioimageio_name
-        config_path = None
-        model_weights_path = None
-    elif prediction_model.model_source == "LocalModel":
-        model_name = None
-        model_id = None
-        config_path = f"{prediction_model.local_model_path}/config.yaml"
-        model_weights_path = f"{prediction_model.local_model_path}/model.pth"
-
-    predictions = unet_predictions(
-        raw_image,
-        model_name=model_name,
-        model_id=model_id,
-        patch=prediction_model.patch,
-        single_batch_mode=True,
-        device=prediction_model.device,
-        model_update=False,
-        disable_tqdm=True,
-        handle_multichannel=False,
-        config_path=config_path,
-        model_weights_path=model_weights_path,
-    )
-    return predictions
+    return PlantSegPredictor(prediction_model)(raw_image)
 
 
 def plantseg_segmentation(
@@ -0,0 +1,203 @@
+"""Build the lower resolution levels of a multiscale OME-Zarr image."""
+
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Callable, Literal, Optional, Union
+
+import dask.array as da
+import numpy as np
+from fractal_tasks_core.utils import logger
+
+from plantseg_tasks.task_utils.compression import Compressor
+
+LABEL_DOWNSAMPLING = Literal["mode", "strided"]
+
+
+def build_pyramid(
+    *,
+    zarrurl: Union[str, Path],
+    overwrite: bool = False,
+    num_levels: int = 2,
+    coarsening_xy: int = 2,
+    coarsening_z: int = 1,
+    chunksize: Optional[Sequence[int]] = None,
+    aggregation_function: Optional[Callable] = None,
+    compressor: Compressor = "default",
+) -> None:
+    """Build and write the `(num_levels - 1)` coarsened levels of a pyramid.
+
+    This mirrors `fractal_tasks_core.pyramids.build_pyramid`, but it also
+    supports coarsening along Z and lets the caller choose the compressor
+    of the new levels.
+
+    Args:
+        zarrurl: Path of the image zarr group, not including the
+            multiscale-level path.
+        overwrite: Whether to overwrite existing pyramid levels.
+        num_levels: Total number of pyramid levels (including 0).
+        coarsening_xy: Linear coarsening factor between subsequent levels.
+        coarsening_z: Coarsening factor along Z (the third to last axis)
+            between subsequent levels, as long as the previous level has
+            enough planes (see `pyramid_factors`).
+        chunksize: Shape of a single chunk.
+        aggregation_function: Function to be used when downsampling.
+        compressor: The compressor of the new levels, as accepted by zarr.
+    """
+    zarrurl = str(Path(zarrurl))
+    data_highres = da.from_zarr(f"{zarrurl}/0")
+
+    ndims = len(data_highres.shape)
+    if ndims not in [2, 3, 4]:
+        raise ValueError(f"{data_highres.shape=}, ndims not in [2,3,4]")
+    factors = [1] * ndims
+    factors[-2:] = [coarsening_xy, coarsening_xy]
+    if ndims > 2:
+        factors[-3] = coarsening_z
+    level_factors = pyramid_factors(data_highres.shape, num_levels, factors)
+
+    if aggregation_function is None:
+        aggregation_function = np.mean
+
+    previous_level = data_highres
+    for ind_level, factors in enumerate(level_factors, start=1):
+        if any(s < f for s, f in zip(previous_level.shape, factors)):
+            raise ValueError(
+                f"ERROR: at {ind_level}-th level, "
+                f"coarsening factors {factors} "
+                f"but previous level has shape {previous_level.shape}"
+            )
+
+        new_level = da.coarsen(
+            aggregation_function,
+            previous_level,
+            dict(enumerate(factors)),
+            trim_excess=True,
+        ).astype(data_highres.dtype)
+
+        if chunksize is not None:
+            new_level = new_level.rechunk(chunksize)
+
+        logger.info(f"[build_pyramid] Level {ind_level} data: {new_level}")
+        previous_level = new_level.to_zarr(
+            zarrurl,
+            component=f"{ind_level}",
+            overwrite=overwrite,
+            compute=True,
+            return_stored=True,
+            write_empty_chunks=False,
+            dimension_separator="/",
+            compressor=compressor,
+        )
+
+
+def coarsen(
+    data: np.ndarray,
+    factors: Sequence[int],
+    aggregation_function: Optional[Callable] = None,
+) -> np.ndarray:
+    """Coarsen an in-memory array by integer factors along each axis.
+
+    This is the numpy equivalent of the `dask.array.coarsen` call used by
+    `build_pyramid`, the excess at the end of each axis is trimmed.
+    """
+    if aggregation_function is None:
+        aggregation_function = np.mean
+
+    trimmed = data[tuple(slice(0, (s // f) * f) for s, f in zip(data.shape, factors))]
+    blocks_shape = []
+    for size, factor in zip(trimmed.shape, factors):
+        blocks_shape += [size // factor, factor]
+    blocks = trimmed.reshape(blocks_shape)
+    block_axes = tuple(range(1, 2 * data.ndim, 2))
+    return aggregation_function(blocks, axis=block_axes).astype(data.dtype)
+
+
+def pyramid_factors(
+    shape: Sequence[int], num_levels: int, factors: Sequence[int]
+) -> list[tuple[int, ...]]:
+    """Coarsening factors between each level of a pyramid and the next one.
+
+    The Z factor (third to last axis) is only applied while the level has at
+    least as many planes as the factor, so shallow stacks stop being
+    coarsened along Z once they are down to a single plane. The other axes
+    are coarsened by their factor at every level.
+    """
+    level_factors = []
+    level_shape = list(shape)
+    for _ in range(1, num_levels):
+        level = list(factors)
+        if len(shape) >= 3 and level_shape[-3] < level[-3]:
+            level[-3] = 1
+        level_factors.append(tuple(level))
+        level_shape = [s // f for s, f in zip(level_shape, level)]
+    return level_factors
+
+
+def pyramid_shapes(
+    shape: Sequence[int], factors: Sequence[Sequence[int]]
+) -> list[tuple[int, ...]]:
+    """Compute the shape of every level of a pyramid, including level 0.
+
+    `factors` are the coarsening factors between each level and the next one
+    (see `pyramid_factors`).
+    """
+    shapes = [tuple(shape)]
+    for ind_level, level_factors in enumerate(factors, start=1):
+        previous_shape = shapes[-1]
+        if any(s < f for s, f in zip(previous_shape, level_factors)):
+            raise ValueError(
+                f"ERROR: at {ind_level}-th level, coarsening factors "
+                f"{level_factors} but previous level has shape {previous_shape}"
+            )
+        shapes.append(tuple(s // f for s, f in zip(previous_shape, level_factors)))
+    return shapes
+
+
+def strided_subsample(
+    blocks: np.ndarray, axis: Optional[tuple[int, ...]] = None
+) -> np.ndarray:
+    """Aggregation function that keeps the first voxel of each block.
+
+    It can be used as `aggregation_function` for label images, it does no
+    arithmetic and never creates label IDs that are not in the input.
+    """
+    if axis is None:
+        axis = tuple(range(blocks.ndim))
+    return blocks[tuple(0 if i in axis else slice(None) for i in range(blocks.ndim))]
+
+
+def block_mode(
+    blocks: np.ndarray, axis: Optional[tuple[int, ...]] = None
+) -> np.ndarray:
+    """Aggregation function that keeps the most frequent value of each block.
+
+    It can be used as `aggregation_function` for label images. Ties are
+    broken in favour of the smallest value. The mode is vectorized over all
+    the blocks, by sorting the values of each block and finding the longest
+    run of equal values.
+    """
+    if axis is None:
+        axis = tuple(range(blocks.ndim))
+    keep_axes = [i for i in range(blocks.ndim) if i not in axis]
+    moved = np.transpose(blocks, (*keep_axes, *axis))
+    out_shape = moved.shape[: len(keep_axes)]
+    block_values = np.sort(moved.reshape(int(np.prod(out_shape)), -1), axis=1)
+
+    block_size = block_values.shape[1]
+    positions = np.arange(block_size)
+    is_run_start = np.ones(block_values.shape, dtype=bool)
+    is_run_start[:, 1:] = block_values[:, 1:] != block_values[:, :-1]
+    run_start = np.maximum.accumulate(np.where(is_run_start, positions, 0), axis=1)
+    # length of the run up to each position, the longest run ends at the argmax
+    run_length = positions - run_start
+    best = np.argmax(run_length, axis=1)
+    return block_values[np.arange(len(block_values)), best].reshape(out_shape)
+
+
+def get_label_aggregation_function(method: LABEL_DOWNSAMPLING) -> Callable:
+    """Return the aggregation function used to downsample label images."""
+    if method == "mode":
+        return block_mode
+    if method == "strided":
+        return strided_subsample
+    raise ValueError(f"Unknown label downsampling method: {method}.")
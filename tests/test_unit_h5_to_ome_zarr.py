@@ -1,11 +1,37 @@
+import json
 from pathlib import Path
 
+import h5py
 import numpy as np
 import pytest
+import zarr
 from fractal_tasks_core.ngff.zarr_utils import load_NgffImageMeta
+from numcodecs import Blosc, Zlib
 from plantseg.io import create_h5
+from scipy.ndimage import zoom
 
 from plantseg_tasks.convert_h5_to_ome_zarr import convert_h5_to_ome_zarr
+from plantseg_tasks.convert_h5_to_ome_zarr_compute import (
+    convert_h5_to_ome_zarr_compute,
+)
+from plantseg_tasks.convert_h5_to_ome_zarr_init import convert_h5_to_ome_zarr_init
+from plantseg_tasks.ngio.ngff import consolidate_metadata, open_group_metadata
+from plantseg_tasks.ngio.ngff_image import NgffImage
+from plantseg_tasks.ngio.tables.tables import load_table_meta
+from plantseg_tasks.task_utils.batch import _share_threads
+from plantseg_tasks.task_utils.converter_input_models import (
+    CompressionParams,
+    CustomAxisInputModel,
+    OMEZarrBuilderParams,
+)
+from plantseg_tasks.task_utils.io import (
+    Image,
+    correct_image_metadata,
+    create_ome_zarr,
+    load_h5_images,
+    record_phase_timings,
+)
+from plantseg_tasks.task_utils.pyramids import block_mode, coarsen
 
 
 @pytest.fixture
@@ -41,3 +67,886 @@ class TestH5ToOmeZarr:
         load_NgffImageMeta(zarr_url)
 
         # TODO add proper validation with ngio
+
+    def test_streaming_matches_in_memory(self, tmp_path: Path):
+        h5_file = tmp_path / "sample_zcyx.h5"
+        random_image = np.random.randint(0, 255, (40, 2, 256, 256)).astype("uint16")
+        create_h5(
+            path=h5_file, stack=random_image, key="raw", voxel_size=(0.5, 0.25, 0.25)
+        )
+        ome_zarr_parameters = OMEZarrBuilderParams(max_slab_size_mb=1)
+
+        zarr_urls = {}
+        for streaming in [False, True]:
+            image_list_update = convert_h5_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / f"zarr_{streaming}"),
+                input_path=str(h5_file),
+                image_key="raw",
+                image_layout="ZCYX",
+                ome_zarr_parameters=ome_zarr_parameters,
+                streaming=streaming,
+            )
+            zarr_urls[streaming] = image_list_update["image_list_updates"][0][
+                "zarr_url"
+            ]
+
+        streamed = zarr.open_array(f"{zarr_urls[True]}/0", mode="r")
+        in_memory = zarr.open_array(f"{zarr_urls[False]}/0", mode="r")
+        assert streamed.shape == (2, 40, 256, 256)
+        np.testing.assert_array_equal(streamed[...], in_memory[...])
+        np.testing.assert_array_equal(
+            streamed[...], np.transpose(random_image, (1, 0, 2, 3))
+        )
+
+    def test_parallel_folder_conversion(self, tmp_path: Path):
+        input_dir = tmp_path / "h5_files"
+        input_dir.mkdir()
+        for name in ["c_sample", "a_sample", "b_sample"]:
+            random_image = np.random.randint(0, 255, (10, 10, 10))
+            key = "raw" if name != "b_sample" else "not_raw"
+            create_h5(
+                path=input_dir / f"{name}.h5",
+                stack=random_image,
+                key=key,
+                voxel_size=(0.5, 0.25, 0.25),
+            )
+
+        # b_sample does not contain the "raw" key and must fail on its own
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(input_dir),
+            image_key="raw",
+            image_layout="ZYX",
+            num_workers=2,
+        )
+
+        zarr_urls = [
+            update["zarr_url"] for update in image_list_update["image_list_updates"]
+        ]
+        assert [Path(url).parent.name for url in zarr_urls] == [
+            "a_sample.zarr",
+            "c_sample.zarr",
+        ]
+
+    def test_compound_workflow_3D(
+        self, sample_h5_file_3d: tuple[str, str], tmp_path: Path
+    ):
+        zarr_dir = str(tmp_path / "zarr")
+        image_path, keys = sample_h5_file_3d
+
+        parallelization_list = convert_h5_to_ome_zarr_init(
+            zarr_urls=[],
+            zarr_dir=zarr_dir,
+            input_path=str(image_path),
+            image_key=keys["image_key"],
+            label_key=keys["label_key"],
+            image_layout="ZYX",
+        )["parallelization_list"]
+        assert len(parallelization_list) == 1
+
+        for item in parallelization_list:
+            image_list_update = convert_h5_to_ome_zarr_compute(**item)
+            zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+            assert zarr_url == item["zarr_url"]
+            load_NgffImageMeta(zarr_url)
+            # the default channel name is not passed on by the init task
+            assert "omero" not in zarr.open_group(zarr_url, mode="r").attrs
+
+    @pytest.mark.parametrize("access_pattern", ["volume", "plane"])
+    def test_planned_chunks(self, tmp_path: Path, access_pattern: str):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (32, 128, 128)).astype("uint8")
+        random_label = np.random.randint(0, 5, (32, 128, 128)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(2, 1, 1))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(2, 1, 1))
+
+        ome_zarr_parameters = OMEZarrBuilderParams(
+            number_multiscale=3,
+            chunk_access_pattern=access_pattern,
+            target_chunk_size_mb=0.125,
+        )
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            label_key="label",
+            image_layout="ZYX",
+            ome_zarr_parameters=ome_zarr_parameters,
+            streaming=True,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+
+        expected = {"volume": (1, 32, 64, 64), "plane": (1, 1, 128, 128)}
+        image = zarr.open_array(f"{zarr_url}/0", mode="r")
+        assert image.chunks == expected[access_pattern]
+        np.testing.assert_array_equal(image[0], random_image)
+
+        label = zarr.open_array(f"{zarr_url}/labels/label/0", mode="r")
+        assert label.chunks == image.chunks[1:]
+        np.testing.assert_array_equal(label[...], random_label)
+        for level in [1, 2]:
+            level_image = zarr.open_array(f"{zarr_url}/{level}", mode="r")
+            assert level_image.chunks == tuple(
+                min(c, s) for c, s in zip(image.chunks, level_image.shape)
+            )
+
+    def test_new_label_follows_image_chunks(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (32, 128, 128)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        ome_zarr_parameters = OMEZarrBuilderParams(
+            number_multiscale=2,
+            chunk_access_pattern="plane",
+            target_chunk_size_mb=1 / 64,
+        )
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            image_layout="ZYX",
+            ome_zarr_parameters=ome_zarr_parameters,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+
+        image = zarr.open_array(f"{zarr_url}/0", mode="r")
+        new_label = NgffImage(zarr_url).create_new_label("new_label")
+        assert new_label.zarr_array.chunks == image.chunks[1:]
+
+    @pytest.mark.parametrize("codec", ["zstd", "lz4", "none", "auto"])
+    def test_compression(
+        self, sample_h5_file_3d: tuple[str, str], tmp_path: Path, codec: str
+    ):
+        image_path, keys = sample_h5_file_3d
+        ome_zarr_parameters = OMEZarrBuilderParams(
+            number_multiscale=2,
+            compression=CompressionParams(codec=codec, shuffle="bit", clevel=3),
+        )
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(image_path),
+            image_key=keys["image_key"],
+            label_key=keys["label_key"],
+            image_layout="ZYX",
+            ome_zarr_parameters=ome_zarr_parameters,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+
+        for path in ["0", "1", "labels/label/0", "labels/label/1"]:
+            array = zarr.open_array(f"{zarr_url}/{path}", mode="r")
+            if codec == "none":
+                assert array.compressor is None
+            elif codec == "auto":
+                assert array.compressor.codec_id == "blosc"
+            else:
+                assert array.compressor.cname == codec
+                assert array.compressor.clevel == 3
+                assert array.compressor.shuffle == Blosc.BITSHUFFLE
+
+    def test_fused_pyramid_matches_two_pass(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 2**16, (20, 203, 190)).astype("uint16")
+        random_label = np.random.randint(0, 50, (20, 203, 190)).astype("uint16")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(1, 0.5, 0.5))
+
+        zarr_urls = {}
+        for fused in [True, False]:
+            ome_zarr_parameters = OMEZarrBuilderParams(
+                number_multiscale=3,
+                max_slab_size_mb=1,
+                target_chunk_size_mb=0.01,
+                fused_pyramid=fused,
+            )
+            image_list_update = convert_h5_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / f"zarr_{fused}"),
+                input_path=str(h5_file),
+                image_key="raw",
+                label_key="label",
+                image_layout="ZYX",
+                ome_zarr_parameters=ome_zarr_parameters,
+                streaming=True,
+            )
+            zarr_urls[fused] = image_list_update["image_list_updates"][0]["zarr_url"]
+
+        for path in ["0", "1", "2", "labels/label/1", "labels/label/2"]:
+            fused = zarr.open_array(f"{zarr_urls[True]}/{path}", mode="r")
+            two_pass = zarr.open_array(f"{zarr_urls[False]}/{path}", mode="r")
+            assert fused.shape == two_pass.shape
+            assert fused.chunks == two_pass.chunks
+            np.testing.assert_array_equal(fused[...], two_pass[...])
+
+    @pytest.mark.parametrize("fused_pyramid", [True, False])
+    def test_record_phase_timings(self, tmp_path: Path, fused_pyramid: bool):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (8, 64, 64)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+
+        with record_phase_timings() as timings:
+            convert_h5_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / "zarr"),
+                input_path=str(h5_file),
+                image_key="raw",
+                image_layout="ZYX",
+                ome_zarr_parameters=OMEZarrBuilderParams(
+                    number_multiscale=3, fused_pyramid=fused_pyramid
+                ),
+                streaming=True,
+            )
+        assert set(timings) == {"read", "level_0_write", "pyramid"}
+        assert all(seconds > 0 for seconds in timings.values())
+
+        # Nothing is recorded outside of the context
+        recorded = dict(timings)
+        convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr_2"),
+            input_path=str(h5_file),
+            image_key="raw",
+            image_layout="ZYX",
+            streaming=True,
+        )
+        assert timings == recorded
+
+    def test_z_downsampling(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (16, 64, 64)).astype("uint8")
+        random_label = np.random.randint(0, 5, (16, 64, 64)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(1, 0.5, 0.5))
+
+        ome_zarr_parameters = OMEZarrBuilderParams(
+            number_multiscale=3, scaling_factor_XY=2, scaling_factor_Z=2
+        )
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            label_key="label",
+            image_layout="ZYX",
+            ome_zarr_parameters=ome_zarr_parameters,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+
+        expected_shapes = [(16, 64, 64), (8, 32, 32), (4, 16, 16)]
+        expected_scales = [[1, 0.5, 0.5], [2, 1, 1], [4, 2, 2]]
+        image_meta = load_NgffImageMeta(zarr_url)
+        label_meta = load_NgffImageMeta(f"{zarr_url}/labels/label")
+        for level, (shape, scale) in enumerate(zip(expected_shapes, expected_scales)):
+            image = zarr.open_array(f"{zarr_url}/{level}", mode="r")
+            label = zarr.open_array(f"{zarr_url}/labels/label/{level}", mode="r")
+            assert image.shape == (1, *shape)
+            assert label.shape == shape
+            assert image_meta.get_pixel_sizes_zyx(level=level) == scale
+            assert label_meta.get_pixel_sizes_zyx(level=level) == scale
+
+        # New labels follow the Z coarsening of the image pyramid
+        new_label = NgffImage(zarr_url, mode="a").create_new_label("new_label")
+        for level, shape in enumerate(expected_shapes):
+            assert new_label.change_level(level).shape == shape
+
+        # A label written at a coarse level is resampled to all the others
+        new_label = new_label.change_level(1)
+        new_label.write_data(np.ones(expected_shapes[1], dtype="int32"))
+        new_label.consolidate()
+        np.testing.assert_array_equal(new_label.change_level(0).get_data(), 1)
+        np.testing.assert_array_equal(new_label.change_level(2).get_data(), 1)
+
+    @pytest.mark.parametrize("fused_pyramid", [True, False])
+    def test_z_downsampling_shallow_stack(self, tmp_path: Path, fused_pyramid: bool):
+        # 6 planes are fewer than 2**3, Z stops being coarsened at one plane
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (6, 64, 64)).astype("uint8")
+        random_label = np.random.randint(0, 5, (6, 64, 64)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(1, 0.5, 0.5))
+
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            label_key="label",
+            image_layout="ZYX",
+            ome_zarr_parameters=OMEZarrBuilderParams(
+                scaling_factor_Z=2, fused_pyramid=fused_pyramid
+            ),
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+
+        expected_shapes = [(6, 64, 64), (3, 32, 32), (1, 16, 16), (1, 8, 8)]
+        expected_scales = [[1, 0.5, 0.5], [2, 1, 1], [4, 2, 2], [4, 4, 4]]
+        image_meta = load_NgffImageMeta(zarr_url)
+        label_meta = load_NgffImageMeta(f"{zarr_url}/labels/label")
+        for level, (shape, scale) in enumerate(zip(expected_shapes, expected_scales)):
+            image = zarr.open_array(f"{zarr_url}/{level}", mode="r")
+            label = zarr.open_array(f"{zarr_url}/labels/label/{level}", mode="r")
+            assert image.shape == (1, *shape)
+            assert label.shape == shape
+            assert image_meta.get_pixel_sizes_zyx(level=level) == scale
+            assert label_meta.get_pixel_sizes_zyx(level=level) == scale
+
+        new_label = NgffImage(zarr_url, mode="a").create_new_label("new_label")
+        new_label_meta = load_NgffImageMeta(f"{zarr_url}/labels/new_label")
+        for level, (shape, scale) in enumerate(zip(expected_shapes, expected_scales)):
+            assert new_label.change_level(level).shape == shape
+            assert new_label_meta.get_pixel_sizes_zyx(level=level) == scale
+
+    def test_consolidate_by_chunks(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (12, 60, 68)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            image_layout="ZYX",
+            ome_zarr_parameters=OMEZarrBuilderParams(
+                number_multiscale=3, target_chunk_size_mb=1 / 256
+            ),
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        new_label = NgffImage(zarr_url, mode="a").create_new_label("new_label")
+
+        # the chunks of every level are resampled on their own, the result
+        # must match the resampling of the whole level
+        label = np.random.randint(0, 5, new_label.change_level(1).shape)
+        new_label = new_label.change_level(1)
+        new_label.write_data(label.astype("int32"))
+        new_label.consolidate()
+
+        level_0 = new_label.change_level(0)
+        factors = [s0 / s1 for s0, s1 in zip(level_0.shape, label.shape)]
+        expected = zoom(label, factors, order=0, mode="nearest", grid_mode=True)
+        np.testing.assert_array_equal(level_0.get_data(), expected)
+        np.testing.assert_array_equal(
+            new_label.change_level(2).get_data(), coarsen(label, [1, 2, 2], block_mode)
+        )
+
+    def test_consolidate_regions(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (12, 60, 68)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            image_layout="ZYX",
+            ome_zarr_parameters=OMEZarrBuilderParams(
+                number_multiscale=3, target_chunk_size_mb=1 / 256
+            ),
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        predictions = NgffImage(zarr_url, mode="a").create_new_predictions(
+            "predictions", dtype="float32"
+        )
+        predictions.write_data(np.zeros(predictions.shape, dtype="float32"))
+        predictions.consolidate(aggregation_function=np.mean)
+
+        # a chunk outside of the region must not be rewritten
+        level_1 = zarr.open_array(f"{zarr_url}/predictions/predictions/1", mode="a")
+        level_1[:, -1, -1] = 7
+
+        region = (slice(None), slice(10, 30), slice(0, 20))
+        predictions._write_data(np.ones((12, 20, 20), dtype="float32"), region)
+        predictions.consolidate(aggregation_function=np.mean, regions=[region])
+
+        expected = np.zeros(level_1.shape, dtype="float32")
+        expected[:, 5:15, 0:10] = 1
+        expected[:, -1, -1] = 7
+        np.testing.assert_array_equal(level_1[...], expected)
+
+    @pytest.mark.parametrize("label_downsampling", ["mode", "strided"])
+    def test_label_downsampling(self, tmp_path: Path, label_downsampling: str):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (4, 64, 64)).astype("uint8")
+        # blocks of 2x2 voxels with three voxels of the same (large) label ID
+        block_label = np.random.randint(1000, 2000, (4, 32, 32)).astype("uint16")
+        random_label = np.repeat(np.repeat(block_label, 2, axis=1), 2, axis=2)
+        random_label[:, ::2, ::2] = 0
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(1, 0.5, 0.5))
+
+        ome_zarr_parameters = OMEZarrBuilderParams(
+            number_multiscale=2, label_downsampling=label_downsampling
+        )
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            label_key="label",
+            image_layout="ZYX",
+            ome_zarr_parameters=ome_zarr_parameters,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        label = zarr.open_array(f"{zarr_url}/labels/label/1", mode="r")[...]
+
+        if label_downsampling == "mode":
+            np.testing.assert_array_equal(label, block_label)
+        else:
+            np.testing.assert_array_equal(label, random_label[:, ::2, ::2])
+
+    def test_lazy_layout_with_label(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (6, 2, 32, 32)).astype("uint8")
+        random_label = np.random.randint(0, 5, (6, 1, 32, 32)).astype("uint8")
+        # default voxel size, so the metadata is corrected from the custom axis
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 1, 1))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(1, 1, 1))
+
+        image = load_h5_images(
+            str(h5_file), image_key="raw", label_key="label", image_layout="ZCYX"
+        )
+        corrected = correct_image_metadata(image, custom_axis=CustomAxisInputModel())
+        # the layout change is a view on the loaded array, never a copy
+        assert corrected.image_data.source is image.image_data.source
+        assert corrected.label.label_data.source is image.label.label_data.source
+        assert corrected.image_data.shape == (2, 6, 32, 32)
+        assert corrected.label.label_data.shape == (6, 32, 32)
+
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            label_key="label",
+            image_layout="ZCYX",
+            ome_zarr_parameters=OMEZarrBuilderParams(number_multiscale=2),
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        np.testing.assert_array_equal(
+            zarr.open_array(f"{zarr_url}/0", mode="r")[...],
+            np.transpose(random_image, (1, 0, 2, 3)),
+        )
+        np.testing.assert_array_equal(
+            zarr.open_array(f"{zarr_url}/labels/label/0", mode="r")[...],
+            random_label[:, 0],
+        )
+
+    @pytest.mark.parametrize(
+        "max_id, minimal_label_dtype, expected_dtype",
+        [
+            (200, True, "uint8"),
+            (300, True, "uint16"),
+            (70000, True, "uint32"),
+            (300, False, "int64"),
+        ],
+    )
+    def test_minimal_label_dtype(
+        self,
+        tmp_path: Path,
+        max_id: int,
+        minimal_label_dtype: bool,
+        expected_dtype: str,
+    ):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (4, 32, 32)).astype("uint8")
+        random_label = np.random.randint(0, max_id, (4, 32, 32)).astype("int64")
+        random_label[0, 0, 0] = max_id
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(1, 0.5, 0.5))
+
+        ome_zarr_parameters = OMEZarrBuilderParams(
+            number_multiscale=2,
+            max_slab_size_mb=1,
+            minimal_label_dtype=minimal_label_dtype,
+        )
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="raw",
+            label_key="label",
+            image_layout="ZYX",
+            ome_zarr_parameters=ome_zarr_parameters,
+            streaming=True,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        for level in [0, 1]:
+            label = zarr.open_array(f"{zarr_url}/labels/label/{level}", mode="r")
+            assert label.dtype == expected_dtype
+        np.testing.assert_array_equal(
+            zarr.open_array(f"{zarr_url}/labels/label/0", mode="r")[...], random_label
+        )
+
+    def test_resume_skips_converted_files(self, tmp_path: Path):
+        input_dir = tmp_path / "h5_files"
+        input_dir.mkdir()
+        for name in ["a_sample", "b_sample"]:
+            random_image = np.random.randint(0, 255, (4, 32, 32)).astype("uint8")
+            create_h5(
+                input_dir / f"{name}.h5",
+                stack=random_image,
+                key="raw",
+                voxel_size=(1, 0.5, 0.5),
+            )
+
+        def convert():
+            image_list_update = convert_h5_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / "zarr"),
+                input_path=str(input_dir),
+                image_key="raw",
+                image_layout="ZYX",
+                resume=True,
+            )
+            return [u["zarr_url"] for u in image_list_update["image_list_updates"]]
+
+        zarr_urls = convert()
+        manifest_path = tmp_path / "zarr" / ".conversion_manifest.json"
+        # the files are hashed while they are converted
+        entries = json.loads(manifest_path.read_text())["files"]
+        assert all(entry["hash"] is not None for entry in entries.values())
+        for zarr_url in zarr_urls:
+            (Path(zarr_url) / "marker").touch()
+
+        # a file with a new content is converted again, the other is skipped
+        new_image = np.random.randint(0, 255, (4, 32, 32)).astype("uint8")
+        (input_dir / "b_sample.h5").unlink()
+        create_h5(
+            input_dir / "b_sample.h5",
+            stack=new_image,
+            key="raw",
+            voxel_size=(1, 0.5, 0.5),
+        )
+        assert convert() == zarr_urls
+        assert (Path(zarr_urls[0]) / "marker").exists()
+        assert not (Path(zarr_urls[1]) / "marker").exists()
+        np.testing.assert_array_equal(
+            zarr.open_array(f"{zarr_urls[1]}/0", mode="r")[0], new_image
+        )
+
+    def test_resume_with_different_runtime_params(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (4, 32, 32)).astype("uint8")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+
+        def convert(**params):
+            params = {"number_multiscale": 2, **params}
+            image_list_update = convert_h5_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / "zarr"),
+                input_path=str(h5_file),
+                image_key="raw",
+                image_layout="ZYX",
+                resume=True,
+                ome_zarr_parameters=OMEZarrBuilderParams(**params),
+            )
+            return image_list_update["image_list_updates"][0]["zarr_url"]
+
+        zarr_url = convert(num_threads=1)
+        (Path(zarr_url) / "marker").touch()
+
+        # options that do not change the output do not trigger a new conversion
+        assert convert(num_threads=2) == zarr_url
+        assert convert(max_slab_size_mb=1, fused_pyramid=False) == zarr_url
+        assert (Path(zarr_url) / "marker").exists()
+
+        # options that change the output do
+        assert convert(number_multiscale=3) == zarr_url
+        assert not (Path(zarr_url) / "marker").exists()
+
+    def test_resume_interrupted_write(self, tmp_path: Path):
+        class FailingReader:
+            """Array wrapper that fails after `max_reads` reads."""
+
+            def __init__(self, data, max_reads=None):
+                self.data, self.max_reads, self.num_reads = data, max_reads, 0
+                self.shape, self.dtype, self.ndim = data.shape, data.dtype, data.ndim
+
+            def __getitem__(self, slices):
+                if self.max_reads is not None and self.num_reads >= self.max_reads:
+                    raise OSError("Simulated crash")
+                self.num_reads += 1
+                return self.data[slices]
+
+        random_image = np.random.randint(0, 255, (32, 256, 256)).astype("uint16")
+        ome_zarr_parameters = OMEZarrBuilderParams(
+            number_multiscale=2,
+            max_slab_size_mb=1,
+            chunk_access_pattern="plane",
+            target_chunk_size_mb=0.125,
+        )
+
+        def write(reader, resume):
+            image = Image(
+                image_key="raw",
+                image_data=reader,
+                voxel_size=(1, 0.5, 0.5),
+                unit="micrometer",
+                layout="ZYX",
+            )
+            return create_ome_zarr(
+                zarr_url=str(tmp_path / "sample.zarr"),
+                path="raw",
+                name="raw",
+                image=image,
+                omezarr_params=ome_zarr_parameters,
+                resume=resume,
+            )
+
+        with pytest.raises(OSError):
+            write(FailingReader(random_image, max_reads=2), resume=False)
+
+        reader = FailingReader(random_image)
+        zarr_url = write(reader, resume=True)
+        # 4 slabs of 8 planes, the first 2 were written before the crash
+        assert reader.num_reads == 2
+        assert not (Path(zarr_url) / ".conversion_progress.json").exists()
+        np.testing.assert_array_equal(
+            zarr.open_array(f"{zarr_url}/0", mode="r")[0], random_image
+        )
+        np.testing.assert_array_equal(
+            zarr.open_array(f"{zarr_url}/1", mode="r")[0],
+            coarsen(random_image, factors=(1, 2, 2)),
+        )
+
+    @pytest.mark.parametrize("streaming", [False, True])
+    def test_multi_key_channels(self, tmp_path: Path, streaming: bool):
+        h5_file = tmp_path / "sample.h5"
+        channels = {
+            "nuclei": np.random.randint(0, 255, (8, 64, 64)).astype("uint16"),
+            "membrane": np.random.randint(0, 255, (8, 64, 64)).astype("uint16"),
+        }
+        for key, stack in channels.items():
+            create_h5(h5_file, stack=stack, key=key, voxel_size=(1, 0.5, 0.5))
+
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(h5_file),
+            image_key="nuclei",
+            channel_keys=["membrane"],
+            image_layout="ZYX",
+            ome_zarr_parameters=OMEZarrBuilderParams(max_slab_size_mb=1),
+            streaming=streaming,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        assert Path(zarr_url).name == "nuclei"
+
+        image = zarr.open_array(f"{zarr_url}/0", mode="r")
+        assert image.shape == (2, 8, 64, 64)
+        assert image.chunks[0] == 1
+        np.testing.assert_array_equal(image[...], np.stack(list(channels.values())))
+
+        omero = zarr.open_group(zarr_url, mode="r").attrs["omero"]
+        assert [ch["label"] for ch in omero["channels"]] == list(channels)
+
+        # channel names from the custom axis take precedence over the keys
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr_named"),
+            input_path=str(h5_file),
+            image_key="nuclei",
+            channel_keys=["membrane"],
+            image_layout="ZYX",
+            custom_axis=CustomAxisInputModel(channel_names=["DAPI", "FM4-64"]),
+            streaming=streaming,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        omero = zarr.open_group(zarr_url, mode="r").attrs["omero"]
+        assert [ch["label"] for ch in omero["channels"]] == ["DAPI", "FM4-64"]
+
+        # a number of names not matching the channels is an error
+        image = load_h5_images(str(h5_file), image_key=["nuclei", "membrane"])
+        with pytest.raises(ValueError, match="3 channel names"):
+            correct_image_metadata(
+                image,
+                custom_axis=CustomAxisInputModel(channel_names=["a", "b", "c"]),
+            )
+
+    def test_threaded_write_matches_sequential(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 255, (16, 96, 96)).astype("uint16")
+        random_label = np.random.randint(0, 50, (16, 96, 96)).astype("uint32")
+        create_h5(h5_file, stack=random_image, key="raw", voxel_size=(1, 0.5, 0.5))
+        create_h5(h5_file, stack=random_label, key="label", voxel_size=(1, 0.5, 0.5))
+
+        zarr_urls = {}
+        for num_threads in [1, 4]:
+            ome_zarr_parameters = OMEZarrBuilderParams(
+                number_multiscale=3,
+                target_chunk_size_mb=1 / 64,
+                num_threads=num_threads,
+            )
+            image_list_update = convert_h5_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / f"zarr_{num_threads}"),
+                input_path=str(h5_file),
+                image_key="raw",
+                label_key="label",
+                image_layout="ZYX",
+                ome_zarr_parameters=ome_zarr_parameters,
+                streaming=True,
+            )
+            zarr_urls[num_threads] = image_list_update["image_list_updates"][0][
+                "zarr_url"
+            ]
+
+        for level in range(3):
+            for array_path in [f"{level}", f"labels/label/{level}"]:
+                sequential = zarr.open_array(f"{zarr_urls[1]}/{array_path}", mode="r")
+                threaded = zarr.open_array(f"{zarr_urls[4]}/{array_path}", mode="r")
+                np.testing.assert_array_equal(threaded[...], sequential[...])
+
+    def test_threads_shared_between_workers(self):
+        kwargs = {"ome_zarr_parameters": OMEZarrBuilderParams(num_threads=8)}
+        _share_threads(kwargs, num_workers=3)
+        assert kwargs["ome_zarr_parameters"].num_threads == 2
+        _share_threads(kwargs, num_workers=4)
+        assert kwargs["ome_zarr_parameters"].num_threads == 1
+
+    def test_consolidated_metadata(
+        self, sample_h5_file_3d: tuple[str, str], tmp_path: Path
+    ):
+        image_path, keys = sample_h5_file_3d
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(image_path),
+            image_key=keys["image_key"],
+            label_key=keys["label_key"],
+            image_layout="ZYX",
+            ome_zarr_parameters=OMEZarrBuilderParams(number_multiscale=2),
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        assert (Path(zarr_url) / ".zmetadata").exists()
+
+        ngff_image = NgffImage(zarr_url)
+        ngff_image.create_new_label("new_label")
+        consolidated = zarr.open_consolidated(zarr_url, mode="r")
+        assert consolidated["labels"].attrs["labels"] == ["label", "new_label"]
+
+        # only the metadata keys are consolidated, the same as zarr does
+        with open(Path(zarr_url) / ".zmetadata") as f:
+            metadata = json.load(f)["metadata"]
+        zarr.consolidate_metadata(zarr_url)
+        with open(Path(zarr_url) / ".zmetadata") as f:
+            assert json.load(f)["metadata"] == metadata
+
+        # the lists of labels are read from the store, even if not consolidated
+        labels_group = zarr.open_group(zarr_url, path="labels", mode="a")
+        labels_group.attrs["labels"] = ["label", "new_label", "other_label"]
+        assert NgffImage(zarr_url).list_labels == [
+            "label",
+            "new_label",
+            "other_label",
+        ]
+        labels_group.attrs["labels"] = ["label", "new_label"]
+
+        # the metadata is read from .zmetadata, not from the individual files
+        (Path(zarr_url) / "labels" / "label" / ".zgroup").unlink()
+        ngff_image = NgffImage(zarr_url)
+        assert ngff_image.list_labels == ["label", "new_label"]
+        label = ngff_image.get_multiscale_label("label", level=1)
+        assert label.metadata.num_levels == 2
+
+    def test_consolidated_metadata_after_attrs_change(
+        self, sample_h5_file_3d: tuple[str, str], tmp_path: Path
+    ):
+        image_path, keys = sample_h5_file_3d
+        image_list_update = convert_h5_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            input_path=str(image_path),
+            image_key=keys["image_key"],
+            label_key=keys["label_key"],
+            image_layout="ZYX",
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+        table_attrs = {
+            "type": "feature_table",
+            "fractal_table_version": "1",
+            "encoding-type": "anndata",
+            "encoding-version": "0.1.0",
+            "region": {"path": "../labels/label"},
+            "instance_key": "label",
+        }
+        zarr.open_group(zarr_url, path="tables/features", mode="a").attrs.update(
+            table_attrs
+        )
+        consolidate_metadata(zarr_url)
+
+        # attributes changed after the consolidation, e.g. by another task
+        root = zarr.open_group(zarr_url, mode="a")
+        root.attrs["multiscales"] = [
+            {**root.attrs["multiscales"][0], "name": "renamed"}
+        ]
+        label_group = zarr.open_group(zarr_url, path="labels/label", mode="a")
+        label_group.attrs["multiscales"] = [
+            {**label_group.attrs["multiscales"][0], "name": "renamed_label"}
+        ]
+        table_group = zarr.open_group(zarr_url, path="tables/features", mode="a")
+        table_group.attrs["region"] = {"path": "../labels/new_label"}
+
+        image_attrs = NgffImage(zarr_url).group.attrs
+        assert image_attrs["multiscales"][0]["name"] == "renamed"
+        label_attrs = open_group_metadata(zarr_url, path="labels/label").attrs
+        assert label_attrs["multiscales"][0]["name"] == "renamed_label"
+        table_meta = load_table_meta(zarr_url, "features")
+        assert table_meta.region == {"path": "../labels/new_label"}
+
+    def test_copy_source_chunks(self, tmp_path: Path):
+        h5_file = tmp_path / "sample.h5"
+        random_image = np.random.randint(0, 1000, (10, 33, 35)).astype("uint16")
+        random_label = np.random.randint(0, 5, (10, 33, 35)).astype("uint16")
+        with h5py.File(h5_file, "w") as f:
+            f.create_dataset(
+                "raw",
+                data=random_image,
+                chunks=(4, 16, 16),
+                compression="gzip",
+                compression_opts=4,
+                shuffle=True,
+            )
+            f["raw"].attrs["element_size_um"] = (1.0, 0.5, 0.5)
+            f.create_dataset(
+                "label", data=random_label, chunks=(4, 16, 16), compression="gzip"
+            )
+            raw_chunk = f["raw"].id.read_direct_chunk((4, 16, 32))[1]
+
+        zarr_urls = {}
+        for copy_source_chunks in [False, True]:
+            image_list_update = convert_h5_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / f"zarr_{copy_source_chunks}"),
+                input_path=str(h5_file),
+                image_key="raw",
+                label_key="label",
+                image_layout="ZYX",
+                ome_zarr_parameters=OMEZarrBuilderParams(
+                    number_multiscale=3,
+                    minimal_label_dtype=False,
+                    copy_source_chunks=copy_source_chunks,
+                ),
+                streaming=True,
+            )
+            zarr_urls[copy_source_chunks] = image_list_update["image_list_updates"][0][
+                "zarr_url"
+            ]
+
+        copied_url = zarr_urls[True]
+        image = zarr.open_array(f"{copied_url}/0", mode="r")
+        assert image.chunks == (1, 4, 16, 16)
+        assert image.compressor == Zlib(level=4)
+        # the chunks are copied byte for byte
+        assert (Path(copied_url) / "0" / "0" / "1" / "1" / "2").read_bytes() == (
+            raw_chunk
+        )
+        np.testing.assert_array_equal(image[0], random_image)
+
+        for level in range(3):
+            for array_path in [f"{level}", f"labels/label/{level}"]:
+                copied = zarr.open_array(f"{copied_url}/{array_path}", mode="r")
+                decoded = zarr.open_array(f"{zarr_urls[False]}/{array_path}", mode="r")
+                np.testing.assert_array_equal(copied[...], decoded[...])
@@ -0,0 +1,257 @@
+from pathlib import Path
+
+import anndata as ad
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+import zarr
+from fractal_tasks_core.tables import write_table
+from plantseg.io import create_h5
+
+from plantseg_tasks.convert_h5_to_ome_zarr import convert_h5_to_ome_zarr
+from plantseg_tasks.plantseg_workflow import plantseg_workflow
+from plantseg_tasks.task_utils import process
+from plantseg_tasks.task_utils.converter_input_models import OMEZarrBuilderParams
+from plantseg_tasks.task_utils.predictions_cache import hash_predictions_params
+from plantseg_tasks.task_utils.process import PlantSegPredictor
+from plantseg_tasks.task_utils.ps_workflow_input_models import (
+    PlantSegPredictionsModel,
+    PlantSegSegmentationModel,
+)
+
+VOXEL_SIZE = (0.5, 0.5, 0.5)
+
+
+def _boundaries(shape: tuple[int, ...]) -> np.ndarray:
+    """A boundary map of cubic cells, usable without running a prediction."""
+    z, y, x = np.indices(shape)
+    boundaries = (y % 16 == 0) | (x % 16 == 0) | (z % 8 == 0)
+    return boundaries.astype("float32")
+
+
+@pytest.fixture
+def tiny_model(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> list[tuple]:
+    """Serve a tiny local model from the PlantSeg zoo, without downloading it.
+
+    Returns the list of the calls to the zoo loader.
+    """
+    monkeypatch.setattr(process, "_loaded_models", {})
+    model_path = tmp_path / "tiny_model.pth"
+    torch.save(
+        torch.nn.Sequential(torch.nn.Conv3d(1, 1, 1), torch.nn.Sigmoid()).state_dict(),
+        model_path,
+    )
+    calls = []
+
+    def get_model_by_name(*args, **kwargs):
+        calls.append(args)
+        model = torch.nn.Sequential(torch.nn.Conv3d(1, 1, 1), torch.nn.Sigmoid())
+        return model, {"in_channels": 1, "out_channels": 1}, str(model_path)
+
+    monkeypatch.setattr(process.model_zoo, "get_model_by_name", get_model_by_name)
+    monkeypatch.setattr(process, "get_patch_halo", lambda model_name: (2, 4, 4))
+    return calls
+
+
+@pytest.fixture
+def ome_zarr_with_rois(tmp_path: Path) -> str:
+    """An OME-Zarr with a boundary map and a ROI table of 4 ROIs."""
+    h5_file = tmp_path / "boundaries.h5"
+    create_h5(
+        path=h5_file, stack=_boundaries((16, 64, 64)), key="raw", voxel_size=VOXEL_SIZE
+    )
+    image_list_update = convert_h5_to_ome_zarr(
+        zarr_urls=[],
+        zarr_dir=str(tmp_path / "zarr"),
+        input_path=str(h5_file),
+        image_key="raw",
+        image_layout="ZYX",
+        # isotropic 16x16x16 chunks, so that blocks can be smaller than the image
+        ome_zarr_parameters=OMEZarrBuilderParams(
+            number_multiscale=2, target_chunk_size_mb=1 / 64
+        ),
+    )
+    zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+
+    # 4 ROIs of 16x32x32 voxels, covering the image
+    rois = [[0, y * 32, x * 32, 16, 32, 32] for y in range(2) for x in range(2)]
+    columns = [
+        "z_micrometer",
+        "y_micrometer",
+        "x_micrometer",
+        "len_z_micrometer",
+        "len_y_micrometer",
+        "len_x_micrometer",
+    ]
+    roi_table = ad.AnnData(
+        X=np.array(rois, dtype="float32") * VOXEL_SIZE[0],
+        obs=pd.DataFrame(index=[f"FOV_{i}" for i in range(len(rois))]),
+        var=pd.DataFrame(index=columns),
+    )
+    write_table(
+        zarr.open_group(zarr_url, mode="r+"),
+        "FOV_ROI_table",
+        roi_table,
+        table_type="roi_table",
+    )
+    return zarr_url
+
+
+def _run_workflow(
+    zarr_url: str,
+    label_name: str,
+    prediction_model: PlantSegPredictionsModel = PlantSegPredictionsModel(skip=True),
+    **kwargs,
+) -> np.ndarray:
+    plantseg_workflow(
+        zarr_url=zarr_url,
+        prediction_model=prediction_model,
+        segmentation_model=PlantSegSegmentationModel(segmentation_type="dt_watershed"),
+        label_name=label_name,
+        **kwargs,
+    )
+    return zarr.open_array(f"{zarr_url}/labels/{label_name}/0", mode="r")[...]
+
+
+class TestPlantSegWorkflow:
+    def test_parallel_rois_match_sequential(self, ome_zarr_with_rois: str):
+        sequential = _run_workflow(
+            ome_zarr_with_rois, "sequential", table_name="FOV_ROI_table"
+        )
+        parallel = _run_workflow(
+            ome_zarr_with_rois,
+            "parallel",
+            table_name="FOV_ROI_table",
+            num_workers=2,
+        )
+        np.testing.assert_array_equal(parallel, sequential)
+
+        # the label IDs of different ROIs never collide
+        rois_ids = [
+            set(np.unique(sequential[:, y : y + 32, x : x + 32]))
+            for y in (0, 32)
+            for x in (0, 32)
+        ]
+        for i, ids in enumerate(rois_ids):
+            for other_ids in rois_ids[i + 1 :]:
+                assert ids.isdisjoint(other_ids)
+
+    def test_blockwise(self, ome_zarr_with_rois: str):
+        # without halo, the blocks are the same regions as the ROIs
+        rois = _run_workflow(ome_zarr_with_rois, "rois", table_name="FOV_ROI_table")
+        blocks = _run_workflow(
+            ome_zarr_with_rois, "blocks", block_shape=(16, 32, 32), halo=(0, 0, 0)
+        )
+        np.testing.assert_array_equal(blocks, rois)
+
+        # blocks are rounded up to the 16x16x16 chunks
+        sequential = _run_workflow(
+            ome_zarr_with_rois, "halo", block_shape=(10, 20, 20), halo=(4, 8, 8)
+        )
+        parallel = _run_workflow(
+            ome_zarr_with_rois,
+            "halo_parallel",
+            block_shape=(10, 20, 20),
+            halo=(4, 8, 8),
+            num_workers=2,
+        )
+        np.testing.assert_array_equal(parallel, sequential)
+        assert len(np.unique(sequential)) == len(np.unique(rois))
+
+    def test_pipeline_propagates_errors(
+        self, ome_zarr_with_rois: str, monkeypatch: pytest.MonkeyPatch
+    ):
+        calls = []
+
+        def failing_segmentation(predictions, segmentation_model):
+            calls.append(predictions.shape)
+            if len(calls) == 3:
+                raise RuntimeError("Segmentation failed")
+            return np.ones(predictions.shape, dtype="uint32")
+
+        monkeypatch.setattr(
+            "plantseg_tasks.plantseg_workflow.plantseg_segmentation",
+            failing_segmentation,
+        )
+        with pytest.raises(RuntimeError, match="Segmentation failed"):
+            _run_workflow(ome_zarr_with_rois, "failing", table_name="FOV_ROI_table")
+
+    @pytest.mark.parametrize("predictions_dtype", ["float16", "uint8"])
+    def test_saved_predictions(
+        self,
+        ome_zarr_with_rois: str,
+        tiny_model: list[tuple],
+        monkeypatch: pytest.MonkeyPatch,
+        predictions_dtype: str,
+    ):
+        num_predictions = []
+        predict = PlantSegPredictor.__call__
+
+        def counting_predict(self, raw_image):
+            num_predictions.append(raw_image.shape)
+            return predict(self, raw_image)
+
+        monkeypatch.setattr(PlantSegPredictor, "__call__", counting_predict)
+        kwargs = {
+            "prediction_model": PlantSegPredictionsModel(device="cpu"),
+            "table_name": "FOV_ROI_table",
+            "save_predictions": True,
+            "predictions_dtype": predictions_dtype,
+        }
+        first = _run_workflow(ome_zarr_with_rois, "first", **kwargs)
+        assert len(num_predictions) == 4
+
+        predictions_group = zarr.open_group(
+            f"{ome_zarr_with_rois}/predictions", mode="r"
+        )
+        (name,) = predictions_group.attrs["predictions"]
+        for level in range(2):
+            assert predictions_group[f"{name}/{level}"].dtype == predictions_dtype
+
+        # the saved predictions do not depend on the device
+        assert hash_predictions_params(
+            PlantSegPredictionsModel(device="cuda"), channel=0, level=0
+        ) == hash_predictions_params(
+            PlantSegPredictionsModel(device="cpu"), channel=0, level=0
+        )
+        second = _run_workflow(ome_zarr_with_rois, "second", **kwargs)
+        assert len(num_predictions) == 4
+        np.testing.assert_array_equal(second, first)
+
+        # blocks matching the saved ROIs are reused as well
+        _run_workflow(
+            ome_zarr_with_rois,
+            "blocks",
+            block_shape=(16, 32, 32),
+            halo=(0, 0, 0),
+            **{**kwargs, "table_name": None},
+        )
+        assert len(num_predictions) == 4
+
+        # the whole image is not a saved ROI, it is predicted once and saved
+        for label_name in ("full", "full_again"):
+            _run_workflow(
+                ome_zarr_with_rois, label_name, **{**kwargs, "table_name": None}
+            )
+            assert len(num_predictions) == 5
+
+    def test_model_loaded_once(self, ome_zarr_with_rois: str, tiny_model: list):
+        prediction_model = PlantSegPredictionsModel(device="cpu")
+        _run_workflow(
+            ome_zarr_with_rois,
+            "rois",
+            prediction_model=prediction_model,
+            table_name="FOV_ROI_table",
+        )
+        assert len(tiny_model) == 1
+
+        # the model is reused by later predictors, but not for another model
+        PlantSegPredictor(prediction_model)
+        assert len(tiny_model) == 1
+        PlantSegPredictor(
+            PlantSegPredictionsModel(
+                plantsegzoo_name="generic_light_sheet_3D_unet", device="cpu"
+            )
+        )
+        assert len(tiny_model) == 2
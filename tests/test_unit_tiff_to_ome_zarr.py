@@ -2,10 +2,17 @@ from pathlib import Path
 
 import numpy as np
 import pytest
+import tifffile
+import zarr
 from fractal_tasks_core.ngff.zarr_utils import load_NgffImageMeta
 from plantseg.io import create_tiff
 
 from plantseg_tasks.convert_tiff_to_ome_zarr import convert_tiff_to_ome_zarr
+from plantseg_tasks.task_utils.converter_input_models import (
+    CustomAxisInputModel,
+    OMEZarrBuilderParams,
+)
+from plantseg_tasks.task_utils.io import open_tiff_images
 
 
 @pytest.fixture
@@ -45,5 +52,147 @@ class TestTiffToOmeZarr:
         zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
         assert Path(zarr_url).exists()
         load_NgffImageMeta(zarr_url)
+        # a default single channel conversion is not given channel names
+        assert "omero" not in zarr.open_group(zarr_url, mode="r").attrs
 
         # TODO add proper validation with ngio
+
+    @pytest.mark.parametrize("compression", [None, "zlib"])
+    def test_streaming_matches_in_memory(self, tmp_path: Path, compression):
+        tiff_file = tmp_path / "sample.tiff"
+        random_image = np.random.randint(0, 255, (40, 256, 256)).astype("uint16")
+        tifffile.imwrite(
+            tiff_file,
+            random_image,
+            compression=compression,
+            resolution=(4.0, 4.0),
+            metadata={"axes": "ZYX"},
+        )
+        ome_zarr_parameters = OMEZarrBuilderParams(max_slab_size_mb=1)
+        custom_axis = CustomAxisInputModel()
+
+        zarr_urls = {}
+        for streaming in [False, True]:
+            image_list_update = convert_tiff_to_ome_zarr(
+                zarr_urls=[],
+                zarr_dir=str(tmp_path / f"zarr_{streaming}"),
+                image_path=str(tiff_file),
+                image_layout="ZYX",
+                custom_axis=custom_axis,
+                ome_zarr_parameters=ome_zarr_parameters,
+                streaming=streaming,
+            )
+            zarr_urls[streaming] = image_list_update["image_list_updates"][0][
+                "zarr_url"
+            ]
+
+        streamed = zarr.open_array(f"{zarr_urls[True]}/0", mode="r")
+        in_memory = zarr.open_array(f"{zarr_urls[False]}/0", mode="r")
+        np.testing.assert_array_equal(streamed[...], in_memory[...])
+        np.testing.assert_array_equal(streamed[0], random_image)
+
+    @pytest.mark.parametrize("compression", [None, "zlib"])
+    def test_open_does_not_decode(
+        self,
+        sample_tiff_file_3d: tuple[str, str],
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch,
+        compression,
+    ):
+        tiff_file = tmp_path / "compressed.tiff"
+        image_path, _ = sample_tiff_file_3d
+        tifffile.imwrite(
+            tiff_file,
+            tifffile.imread(image_path),
+            compression=compression,
+            imagej=True,
+            resolution=(4.0, 2.0),
+            metadata={"spacing": 0.5, "unit": "um", "axes": "ZYX"},
+        )
+
+        def no_decode(*args, **kwargs):
+            raise AssertionError("The pixels were decoded.")
+
+        monkeypatch.setattr(tifffile.TiffPage, "asarray", no_decode)
+        monkeypatch.setattr(tifffile.TiffFile, "asarray", no_decode)
+        with open_tiff_images(str(tiff_file)) as image:
+            assert image.voxel_size == [0.5, 0.5, 0.25]
+            assert image.unit == "um"
+
+    def test_stack_slices(self, tmp_path: Path):
+        image_dir, label_dir = tmp_path / "stack", tmp_path / "stack_labels"
+        image_dir.mkdir()
+        label_dir.mkdir()
+        random_image = np.random.randint(0, 255, (12, 64, 64)).astype("uint16")
+        random_label = np.random.randint(0, 5, (12, 64, 64)).astype("uint8")
+        # not zero padded, the slices must be sorted by their numeric Z index
+        for z in range(12):
+            tifffile.imwrite(image_dir / f"plane_z{z}.tif", random_image[z])
+            tifffile.imwrite(label_dir / f"plane_z{z}_mask.tif", random_label[z])
+
+        image_list_update = convert_tiff_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            image_path=str(image_dir),
+            label_path=str(label_dir),
+            image_layout="ZYX",
+            custom_axis=CustomAxisInputModel(),
+            ome_zarr_parameters=OMEZarrBuilderParams(max_slab_size_mb=1),
+            stack_slices=True,
+            slice_pattern=r"z(\d+)",
+            num_workers=3,
+        )
+        updates = image_list_update["image_list_updates"]
+        assert len(updates) == 1
+        zarr_url = updates[0]["zarr_url"]
+        assert Path(zarr_url).parent.name == "stack.zarr"
+
+        image = zarr.open_array(f"{zarr_url}/0", mode="r")
+        assert image.shape == (1, 12, 64, 64)
+        np.testing.assert_array_equal(image[0], random_image)
+        label = zarr.open_array(f"{zarr_url}/labels/label/0", mode="r")
+        np.testing.assert_array_equal(label[...], random_label)
+
+    @pytest.mark.parametrize(
+        "streaming, compression", [(False, None), (True, None), (True, "zlib")]
+    )
+    def test_pyramidal_tiff_levels(self, tmp_path: Path, streaming, compression):
+        tiff_file = tmp_path / "pyramid.ome.tiff"
+        random_image = np.random.randint(0, 255, (8, 101, 97)).astype("uint8")
+        # constant sub-resolution levels, to tell them apart from computed ones
+        with tifffile.TiffWriter(tiff_file) as tiff:
+            tiff.write(
+                random_image,
+                subifds=2,
+                compression=compression,
+                metadata={"axes": "ZYX"},
+            )
+            for value, shape in [(7, (8, 51, 49)), (9, (8, 26, 25))]:
+                tiff.write(
+                    np.full(shape, value, dtype="uint8"),
+                    subfiletype=1,
+                    compression=compression,
+                )
+
+        image_list_update = convert_tiff_to_ome_zarr(
+            zarr_urls=[],
+            zarr_dir=str(tmp_path / "zarr"),
+            image_path=str(tiff_file),
+            image_layout="ZYX",
+            custom_axis=CustomAxisInputModel(),
+            ome_zarr_parameters=OMEZarrBuilderParams(number_multiscale=4),
+            streaming=streaming,
+        )
+        zarr_url = image_list_update["image_list_updates"][0]["zarr_url"]
+
+        levels = [zarr.open_array(f"{zarr_url}/{i}", mode="r") for i in range(4)]
+        np.testing.assert_array_equal(levels[0][0], random_image)
+        # levels 1 and 2 are copied, level 3 is computed from level 2
+        for level, value in zip(levels[1:], [7, 9, 9]):
+            assert np.all(level[...] == value)
+        assert [level.shape[-2:] for level in levels] == [
+            (101, 97),
+            (50, 48),
+            (25, 24),
+            (12, 12),
+        ]